@@ -0,0 +1,73 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.mock_servicenow import MockServiceNow, make_record
+from modules.decoders import get_decoder
+from modules.normalize import RecordNormalizer
+from modules.servicenow import ServiceNowClient
+
+def record_fixtures(directory, pages, page_size, columns, exclude_reference_link):
+    """Save raw response bodies from the mock Table API as page fixtures."""
+    extra_columns = max(0, columns - len(make_record(0)))
+    with MockServiceNow(pages * page_size, extra_columns) as mock:
+        client = ServiceNowClient(mock.config(pagination="keyset", page_size=page_size,
+                                              exclude_reference_link=exclude_reference_link), "admin")
+        last_key = None
+        for n in range(pages):
+            response = client.session.get(client.base_url, params=client.page_params(last_key=last_key))
+            response.raise_for_status()
+            with open(os.path.join(directory, f"page-{n:04d}.json"), "wb") as f:
+                f.write(response.content)
+            last = response.json()["result"][-1]
+            last_key = (last["sys_updated_on"], last["sys_id"])
+
+def run_backend(name, bodies, fields):
+    decoder = get_decoder(name, fields)
+    normalizer = RecordNormalizer()
+    decode_times, total_times = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for body in bodies:
+            start = time.perf_counter()
+            page = decoder.decode(body)
+            decoded = time.perf_counter()
+            normalizer.normalize(page)
+            done = time.perf_counter()
+            decode_times.append(decoded - start)
+            total_times.append(done - start)
+    return statistics.median(decode_times), statistics.median(total_times)
+
+# Pass --fixtures with a directory of recorded response bodies (*.json, one page
+# each) to benchmark real pages. Without it, pages are recorded from the mock
+# Table API first. Reports decode time alone and decode + normalise per page.
+#
+#     python -m benchmarks.bench_decoders --pages 20 --columns 80
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare page decoder backends (json, orjson, msgspec) over recorded Table API pages.")
+    parser.add_argument("--fixtures", help="Directory of recorded page bodies (*.json)")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--exclude-reference-link", action="store_true")
+    parser.add_argument("--backends", default="json,orjson,msgspec")
+    args = parser.parse_args()
+
+    directory = args.fixtures or tempfile.mkdtemp()
+    if not args.fixtures:
+        record_fixtures(directory, args.pages, args.page_size, args.columns, args.exclude_reference_link)
+    bodies = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "rb") as f:
+            bodies.append(f.read())
+    fields = list(get_decoder("json").decode(bodies[0])[0])  # msgspec's typed schema comes from the projection
+
+    print(f"{len(bodies)} pages, {statistics.mean(map(len, bodies)) / 1024:.0f} KiB each")
+    print(f"{'backend':>8} {'decode ms':>10} {'decode+normalise ms':>20}")
+    for name in args.backends.split(","):
+        decode, total = run_backend(name, bodies, fields)
+        print(f"{name:>8} {decode * 1000:>10.2f} {total * 1000:>20.2f}")
@@ -0,0 +1,154 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.continuous_harness import FakeSnowflake
+from benchmarks.mock_servicenow import MockServiceNow
+
+BUCKET = "bench-bucket"
+PREFIX = "tickets/"
+
+def child(url, tickets, page_size):
+    """Run the batch pipeline once against url inside moto; print the result as JSON."""
+    import boto3
+    from moto import mock_aws
+    from modules.metrics import metrics
+    from modules.parquet import ParquetHandler
+    from modules.s3 import S3Uploader
+    from modules.servicenow import ServiceNowClient
+    from modules.snowflake import SnowflakeLoader
+
+    config = {
+        "servicenow": {"instance": "mock", "url": url, "username": "admin", "table": "incident",
+                       "pagination": "keyset", "page_size": page_size},
+        "s3": {"bucket": BUCKET, "prefix": PREFIX, "region": "us-east-1"},
+        "snowflake": {"database": "bench", "schema": "bench", "table": "incident", "warehouse": "bench",
+                      "account": "bench", "user": "bench"}
+    }
+    local_file = os.path.join(tempfile.mkdtemp(), "tickets.parquet")
+    s3_key = f"{PREFIX}bench/tickets.parquet"
+    phases = {}
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        db = FakeSnowflake(s3_client, bucket=BUCKET, prefix=PREFIX, materialize=False)  # Records and times each statement
+        metrics.start_run("incident", f"bench_{tickets}")
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            phase_started = time.perf_counter()
+            df = ServiceNowClient(config, "admin").fetch_tickets()
+            phases["fetch"] = time.perf_counter() - phase_started
+
+            phase_started = time.perf_counter()
+            ParquetHandler(config).save_to_parquet(df, local_file)
+            phases["parquet"] = time.perf_counter() - phase_started
+            parquet_mb = os.path.getsize(local_file) / 2 ** 20
+
+            phase_started = time.perf_counter()
+            S3Uploader(config, s3_client=s3_client).run(local_file, s3_key)
+            phases["upload"] = time.perf_counter() - phase_started
+
+            phase_started = time.perf_counter()
+            SnowflakeLoader(config, provider=db).run(s3_key, sample_df=df.head(1))
+            phases["load"] = time.perf_counter() - phase_started
+        seconds = time.perf_counter() - started
+    os.remove(local_file)
+
+    statements = {}
+    for kind, elapsed in db.statements:
+        statements.setdefault(kind, {"count": 0, "seconds": 0.0})
+        statements[kind]["count"] += 1
+        statements[kind]["seconds"] += elapsed
+    print(json.dumps({
+        "tickets": len(df),
+        "seconds": seconds,
+        "rows_per_second": len(df) / seconds if seconds else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KiB on Linux
+        "parquet_mb": parquet_mb,
+        "rows_merged": db.staged,
+        "phases": phases,
+        "stages": metrics.summary("incident"),
+        "statements": statements
+    }))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Each size runs the classic batch path in a child process:
+#
+#     ServiceNowClient.fetch_tickets -> ParquetHandler -> S3Uploader -> SnowflakeLoader.run
+#
+# against the mock Table API (synthetic incidents with reference dicts and timestamps),
+# moto S3 and the continuous harness's FakeSnowflake, which records and times each
+# statement the loader issues (without materialize, so row counts come from the staged
+# Parquet footers and the target is not held in memory).
+# The child reports wall time per phase, the per-stage percentiles from modules.metrics
+# and its peak RSS (moto keeps the uploaded file in the same process, so it is included).
+# Results are written as JSON; pass an earlier file as --baseline to compare versions.
+#
+#     python -m benchmarks.bench_end_to_end --sizes 10000,100000,1000000 --baseline benchmarks/results/previous.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput, latency and peak memory with local stand-ins for every service.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated ticket counts")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock server delay per page, seconds")
+    parser.add_argument("--output", help="Results file (default benchmarks/results/end_to_end_<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--child", nargs=2, metavar=("URL", "TICKETS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]), args.page_size)
+        sys.exit(0)
+
+    runs = []
+    print(f"{'tickets':>9} {'seconds':>8} {'rows/s':>9} {'fetch p50':>10} {'fetch p95':>10} {'peak MB':>8} {'file MB':>8}")
+    for tickets in [int(size) for size in args.sizes.split(",")]:
+        with MockServiceNow(tickets, latency=args.latency) as mock:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_end_to_end", "--page-size", str(args.page_size),
+                 "--child", mock.url, str(tickets)],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip().splitlines()[-1]
+        run = json.loads(output)
+        runs.append(run)
+        fetch = run["stages"].get("fetch", {})
+        print(f"{run['tickets']:>9} {run['seconds']:>8.1f} {run['rows_per_second']:>9.0f} "
+              f"{fetch.get('p50', 0) * 1000:>8.0f}ms {fetch.get('p95', 0) * 1000:>8.0f}ms "
+              f"{run['peak_rss_mb']:>8.0f} {run['parquet_mb']:>8.1f}")
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "page_size": args.page_size,
+        "latency": args.latency,
+        "runs": runs
+    }
+    output_path = args.output or os.path.join("benchmarks", "results", f"end_to_end_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved results to {output_path}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = {run["tickets"]: run for run in json.load(file)["runs"]}
+        print(f"Compared with {args.baseline}:")
+        for run in runs:
+            before = baseline.get(run["tickets"])
+            if before:
+                print(f"  {run['tickets']:>9} tickets: rows/s {run['rows_per_second'] / before['rows_per_second'] - 1:+.1%}, "
+                      f"peak RSS {run['peak_rss_mb'] - before['peak_rss_mb']:+.0f} MB")
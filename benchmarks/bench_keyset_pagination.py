@@ -0,0 +1,65 @@
+import argparse
+import statistics
+import time
+
+from benchmarks.mock_servicenow import MockServiceNow, row_key
+from modules.servicenow import ServiceNowClient
+
+def time_request(client, params, repeat):
+    """Median wall time of one page request (fetch + JSON decode)."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.session.get(client.base_url, params=params)
+        response.raise_for_status()
+        response.json()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def sample_depths(mock, rows, page_size, points, repeat):
+    offset_client = ServiceNowClient(mock.config(pagination="offset", page_size=page_size), "admin")
+    keyset_client = ServiceNowClient(mock.config(pagination="keyset", page_size=page_size), "admin")
+    print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+    for depth in [int(rows * k / points) for k in range(points)]:
+        offset_params = offset_client.page_params(offset=depth)
+        keyset_params = keyset_client.page_params(last_key=row_key(depth - 1) if depth else None)
+        offset_ms = time_request(offset_client, offset_params, repeat) * 1000
+        keyset_ms = time_request(keyset_client, keyset_params, repeat) * 1000
+        print(f"{depth:>10} {offset_ms:>10.1f} {keyset_ms:>10.1f}")
+
+def full_keyset_run(mock, page_size):
+    client = ServiceNowClient(mock.config(pagination="keyset", page_size=page_size), "admin")
+    latencies = []
+    pages = client.iter_pages()
+    while True:
+        start = time.perf_counter()
+        try:
+            next(pages)
+        except StopIteration:
+            break
+        latencies.append(time.perf_counter() - start)
+    print(f"Keyset full run: {len(latencies)} pages")
+    bucket = max(1, len(latencies) // 10)
+    for k in range(0, len(latencies), bucket):
+        chunk = latencies[k:k + bucket]
+        print(f"  pages {k:>5}-{k + len(chunk) - 1:>5}: median {statistics.median(chunk) * 1000:.1f} ms")
+
+# For each sampled depth the benchmark issues the exact request ServiceNowClient
+# would send for the page starting at that row, in both pagination modes, and
+# reports the median latency. With --full-run it also pages through the whole
+# table in keyset mode and reports latency per decile of the run.
+#
+#     python -m benchmarks.bench_keyset_pagination --rows 1000000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Page latency of offset vs keyset pagination against a 1M-row mock Table API.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--points", type=int, default=10, help="Number of sampled depths")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--full-run", action="store_true", help="Also page through the whole table in keyset mode")
+    args = parser.parse_args()
+
+    with MockServiceNow(args.rows) as mock:
+        sample_depths(mock, args.rows, args.page_size, args.points, args.repeat)
+        if args.full_run:
+            full_keyset_run(mock, args.page_size)
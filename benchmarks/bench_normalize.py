@@ -0,0 +1,119 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from benchmarks.mock_servicenow import make_record
+from modules.decoders import JsonDecoder, KeyDecoder
+from modules.normalize import RecordNormalizer
+from modules.normalize_pool import NormalizePool, normalize_page
+
+BASE_COLUMNS = len(make_record(0))
+
+def legacy_normalize(records, census=True):
+    df = pd.DataFrame(records)
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, dict)).any():
+            print(f"Warning: Found dict in column '{col}', will convert to sys_id string")
+            df[col] = df[col].apply(lambda x: x.get("sys_id", "") if isinstance(x, dict) else (x if isinstance(x, str) else ""))
+        if census:
+            types = df[col].apply(type).value_counts()
+            print(f"Column '{col}' types after preprocessing: {types}")
+    for col in ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, dict)).any():
+            raise ValueError(f"Column '{col}' contains unhandled dictionary values")
+    return df
+
+def timed(label, func, rows, columns, page_size):
+    records = [make_record(i, columns - BASE_COLUMNS) for i in range(rows)]
+    pages = [records[k:k + page_size] for k in range(0, rows, page_size)] if page_size else [records]
+    del records
+    gc.collect()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for page in pages:
+            func(page)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>28}: {elapsed:8.2f} s  ({rows / elapsed:,.0f} rows/s)")
+    return elapsed
+
+def timed_bodies(label, func, rows, columns, page_size):
+    """Time func over the pages as raw response bodies, the way fetch_frames sees them."""
+    page_size = page_size or 1000
+    records = [make_record(i, columns - BASE_COLUMNS) for i in range(rows)]
+    bodies = [json.dumps({"result": records[k:k + page_size]}).encode("utf-8") for k in range(0, rows, page_size)]
+    del records
+    gc.collect()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        count = func(bodies)
+    elapsed = time.perf_counter() - start
+    assert count == rows, count
+    print(f"{label:>28}: {elapsed:8.2f} s  ({rows / elapsed:,.0f} rows/s)")
+    return elapsed
+
+def in_process(bodies):
+    decoder, normalizer = JsonDecoder(), RecordNormalizer()
+    return sum(len(normalizer.normalize(decoder.decode(body))) for body in bodies)
+
+def in_pool(bodies, pool):
+    decoder = JsonDecoder()
+    client = SimpleNamespace(normalizer=RecordNormalizer(), decoder=decoder, fields=[], table="bench")  # What NormalizePool.map reads
+    client.build_dataframe = client.normalizer.normalize
+    keys = KeyDecoder("sys_updated_on", decoder)
+    pages = ((body, keys.decode(body)) for body in bodies)  # The fetching thread only decodes the keyset key
+    return sum(len(df) for df in pool.map(pages, client))
+
+def started_pool(processes, body):
+    """A NormalizePool whose workers have all imported their modules, as in a long-lived process."""
+    pool = NormalizePool({"servicenow": {"normalize_processes": processes}}).open()
+    futures = [pool.executor.submit(normalize_page, body, "json", [], [], False) for _ in range(processes)]
+    for future in futures:
+        future.result()
+    return pool
+
+# Builds synthetic incident records (20 base fields plus filler columns, four of
+# them reference dicts) and times both normalisers on identical copies. The
+# legacy path is the loop fetch_tickets used before RecordNormalizer, including
+# its type census; --no-census times it without that debug output.
+#
+# --processes N also times decoding and normalising raw page bodies in-process
+# against a NormalizePool of N workers (servicenow.normalize_processes), pages
+# coming back as Arrow IPC in order.
+#
+#     python -m benchmarks.bench_normalize --rows 500000 --columns 80
+#     python -m benchmarks.bench_normalize --rows 500000 --page-size 1000 --processes 8
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Legacy per-column apply() normalisation vs RecordNormalizer.")
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--page-size", type=int, default=0, help="Normalise in pages of this size (0 = one batch)")
+    parser.add_argument("--no-census", action="store_true")
+    parser.add_argument("--processes", type=int, default=0, help="Also time a NormalizePool of this many workers")
+    args = parser.parse_args()
+
+    census = not args.no_census
+    legacy = timed(f"legacy apply (census={census})", lambda page: legacy_normalize(page, census),
+                   args.rows, args.columns, args.page_size)
+    normalizer = RecordNormalizer()
+    current = timed("RecordNormalizer", normalizer.normalize, args.rows, args.columns, args.page_size)
+    print(f"Speed-up: {legacy / current:.1f}x on {args.rows} rows x {args.columns} columns")
+
+    if args.processes:
+        single = timed_bodies("decode + normalise", in_process, args.rows, args.columns, args.page_size)
+        body = json.dumps({"result": [make_record(0, args.columns - BASE_COLUMNS)]}).encode("utf-8")
+        pool = started_pool(args.processes, body)  # Startup is paid once per process, so it is not timed
+        try:
+            pooled = timed_bodies(f"NormalizePool x{args.processes}", lambda bodies: in_pool(bodies, pool),
+                                  args.rows, args.columns, args.page_size)
+        finally:
+            pool.close()
+        print(f"Speed-up: {single / pooled:.1f}x with {args.processes} processes")
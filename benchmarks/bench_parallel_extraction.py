@@ -0,0 +1,36 @@
+import argparse
+import time
+
+from benchmarks.mock_servicenow import MockServiceNow
+from modules.extractor import ParallelExtractor
+from modules.servicenow import ServiceNowClient
+
+# The mock Table API adds a fixed round-trip latency to every request, so a
+# single session is latency-bound the way a real backfill is. Throughput should
+# grow roughly linearly with max_workers until the mock itself saturates.
+#
+#     python -m benchmarks.bench_parallel_extraction --rows 50000 --latency 0.2
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill throughput of ParallelExtractor as the worker cap grows.")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    with MockServiceNow(args.rows, latency=args.latency) as mock:
+        start = time.perf_counter()
+        baseline = ServiceNowClient(mock.config(pagination="keyset", page_size=args.page_size), "admin")
+        expected = [r["sys_id"] for page in baseline.iter_pages() for r in page]
+        elapsed = time.perf_counter() - start
+        print(f"{'sequential':>12}: {len(expected) / elapsed:>9.0f} rows/s")
+
+        for workers in [int(w) for w in args.workers.split(",")]:
+            config = mock.config(pagination="keyset", page_size=args.page_size,
+                                 parallel={"max_workers": workers, "slices": workers * 4})
+            extractor = ParallelExtractor(config, "admin")
+            start = time.perf_counter()
+            df = extractor.fetch_tickets()
+            elapsed = time.perf_counter() - start
+            assert df["sys_id"].tolist() == expected, "parallel merge differs from sequential order"
+            print(f"{workers:>4} workers: {len(df) / elapsed:>9.0f} rows/s")
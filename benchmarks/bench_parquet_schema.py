@@ -0,0 +1,69 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.mock_servicenow import make_record
+from modules.normalize import RecordNormalizer
+from modules.parquet import ParquetHandler
+
+def make_frames(tickets, page_size, columns):
+    extra_columns = max(0, columns - len(make_record(0)))
+    normalizer = RecordNormalizer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [normalizer.normalize([make_record(i, extra_columns) for i in range(start, min(start + page_size, tickets))])
+                for start in range(0, tickets, page_size)]
+
+def write_untyped(frames, path):
+    schema = pa.Table.from_pandas(frames[0].head(1), preserve_index=False).schema
+    with pq.ParquetWriter(path, schema, compression="snappy") as writer:
+        for df in frames:
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+def write_typed(frames, path, compression):
+    handler = ParquetHandler({"parquet": {"compression": compression}})
+    if compression != "zstd":
+        handler.compression_level = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler.write_stream(iter(frames), path)
+
+def measure(name, write, directory):
+    path = os.path.join(directory, f"{name}.parquet")
+    start = time.perf_counter()
+    write(path)
+    written = time.perf_counter()
+    table = pq.read_table(path)
+    read = time.perf_counter()
+    return os.path.getsize(path), pq.ParquetFile(path).metadata.num_row_groups, written - start, read - written, table.num_rows
+
+# "untyped" is what the pipeline wrote before: object-dtype string columns, snappy,
+# one row group per page. "typed" uses incident_schema (dictionary-encoded choice
+# fields, timestamp[us], ints, bools) with buffered row groups, once per codec.
+#
+#     python -m benchmarks.bench_parquet_schema --tickets 200000 --columns 40
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File size and write/read time of the typed incident Parquet schema vs the untyped one.")
+    parser.add_argument("--tickets", type=int, default=200000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=40)
+    args = parser.parse_args()
+
+    frames = make_frames(args.tickets, args.page_size, args.columns)
+    directory = tempfile.mkdtemp()
+    variants = [
+        ("untyped-snappy", lambda path: write_untyped(frames, path)),
+        ("typed-snappy", lambda path: write_typed(frames, path, "snappy")),
+        ("typed-zstd", lambda path: write_typed(frames, path, "zstd")),
+    ]
+    print(f"{args.tickets} tickets x {len(frames[0].columns)} columns")
+    print(f"{'variant':>15} {'file MB':>8} {'groups':>7} {'write s':>8} {'read s':>7}")
+    for name, write in variants:
+        size, groups, write_s, read_s, rows = measure(name, write, directory)
+        assert rows == args.tickets
+        print(f"{name:>15} {size / 2 ** 20:>8.2f} {groups:>7} {write_s:>8.2f} {read_s:>7.2f}")
+        os.remove(os.path.join(directory, f"{name}.parquet"))
@@ -0,0 +1,54 @@
+import argparse
+import statistics
+import time
+
+from benchmarks.mock_servicenow import MockServiceNow, make_record
+from modules.servicenow import ServiceNowClient
+
+PROJECTION = [
+    "number", "short_description", "state", "priority", "impact", "urgency", "category",
+    "caller_id", "assignment_group", "assigned_to", "opened_at", "resolved_at", "closed_at",
+    "active", "reopen_count", "sys_mod_count", "sys_created_on", "sys_updated_on",
+]
+
+SCENARIOS = {
+    "all columns + links": {},
+    "exclude_reference_link": {"exclude_reference_link": True},
+    "projection + exclude": {"fields": PROJECTION, "exclude_reference_link": True},
+}
+
+def measure(client, max_pages):
+    sizes, decode_times = [], []
+    last_key = None
+    while len(sizes) < max_pages:
+        response = client.session.get(client.base_url, params=client.page_params(last_key=last_key))
+        response.raise_for_status()
+        start = time.perf_counter()
+        batch = response.json().get("result", [])
+        if not batch:
+            break
+        decode_times.append(time.perf_counter() - start)
+        sizes.append(len(response.content))
+        last_key = (batch[-1]["sys_updated_on"], batch[-1]["sys_id"])
+    return statistics.mean(sizes), statistics.mean(decode_times)
+
+# Pages through a wide mock incident table (80 columns by default) in keyset mode
+# for each request configuration and reports the mean response size and decode
+# time per page.
+#
+#     python -m benchmarks.bench_projection --rows 20000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes on the wire and JSON decode time per page, with and without server-side projection.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=10)
+    args = parser.parse_args()
+
+    extra_columns = max(0, args.columns - len(make_record(0)))
+    with MockServiceNow(args.rows, extra_columns) as mock:
+        print(f"{'scenario':>24} {'KiB/page':>10} {'decode ms/page':>15}")
+        for name, options in SCENARIOS.items():
+            client = ServiceNowClient(mock.config(pagination="keyset", page_size=args.page_size, **options), "admin")
+            size, decode = measure(client, args.pages)
+            print(f"{name:>24} {size / 1024:>10.1f} {decode * 1000:>15.2f}")
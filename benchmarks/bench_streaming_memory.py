@@ -0,0 +1,62 @@
+import argparse
+import contextlib
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_servicenow import MockServiceNow
+
+def child(url, mode, page_size):
+    """Fetch everything from url and write one Parquet file, then report peak RSS."""
+    from modules.parquet import ParquetHandler
+    from modules.servicenow import ServiceNowClient
+
+    config = {"servicenow": {"instance": "mock", "url": url, "username": "admin",
+                             "pagination": "keyset", "page_size": page_size}}
+    client = ServiceNowClient(config, "admin")
+    out = os.path.join(tempfile.mkdtemp(), "bench.parquet")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "stream":
+            rows, _ = ParquetHandler().write_stream(client.iter_frames(), out)
+        else:
+            df = client.fetch_tickets()
+            df.to_parquet(out)
+            rows = len(df)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(f"{rows} {elapsed:.1f} {peak_mb:.0f} {os.path.getsize(out) / 2 ** 20:.1f}")
+    os.remove(out)
+
+# The mock Table API runs in this process; every measured run happens in a child
+# process so its peak RSS covers only the client side. Streaming peak RSS should
+# stay flat as the ticket count grows, while eager mode grows with it.
+#
+#     python -m benchmarks.bench_streaming_memory --runs stream:200000,stream:2000000,eager:200000
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of eager vs streaming fetch-to-Parquet on a synthetic ticket feed.")
+    parser.add_argument("--runs", default="stream:200000,stream:2000000,eager:200000",
+                        help="Comma-separated mode:tickets pairs (mode is stream or eager)")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--child", nargs=2, metavar=("URL", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.page_size)
+        sys.exit(0)
+
+    print(f"{'mode':>7} {'tickets':>9} {'seconds':>8} {'peak MB':>8} {'file MB':>8}")
+    for run in args.runs.split(","):
+        mode, tickets = run.split(":")
+        with MockServiceNow(int(tickets)) as mock:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_streaming_memory", "--page-size", str(args.page_size),
+                 "--child", mock.url, mode],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+        rows, seconds, peak_mb, file_mb = output
+        print(f"{mode:>7} {rows:>9} {seconds:>8} {peak_mb:>8} {file_mb:>8}")
@@ -0,0 +1,266 @@
+import argparse
+import bisect
+import contextlib
+import io
+import re
+import statistics
+import tempfile
+import threading
+import time
+
+import boto3
+import pandas as pd
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+from benchmarks.mock_servicenow import MockServiceNow
+from modules.continuous import ContinuousPipeline
+from modules.s3 import S3Uploader
+from modules.snowflake import SnowflakeLoader
+
+BUCKET = "harness-bucket"
+PREFIX = "tickets/"
+COPY_COLUMNS = [("file",), ("status",), ("rows_loaded",), ("errors_seen",), ("first_error",)]
+MODIFIERS = {"OR", "REPLACE", "TEMPORARY", "IF", "NOT", "EXISTS"}
+
+def statement_kind(sql):
+    """e.g. "COPY", "MERGE", "CREATE TABLE", "DROP TABLE"."""
+    words = sql.upper().split()
+    if words[0] in ("CREATE", "DROP", "ALTER", "SHOW", "DESCRIBE"):
+        return " ".join(words[:1] + [word for word in words[1:] if word not in MODIFIERS][:1])
+    return words[0]
+
+class FakeSnowflake:
+    """In-memory target, temp and pipeline-state tables shared by every fake connection.
+
+    Every statement is recorded in statements as (kind, seconds). With materialize=False
+    COPY only counts the rows in the Parquet footers and MERGE inserts every staged row,
+    for benchmarks whose target would not fit in memory.
+    """
+
+    def __init__(self, s3_client, bucket=BUCKET, prefix=PREFIX, materialize=True):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.materialize = materialize
+        self.statements = []
+        self.staged = 0  # Rows in the temp table
+        self.columns = {}
+        self.target = {}  # number -> row dict
+        self.merged_at = {}  # number -> wall time of its last MERGE
+        self.temp = None
+        self.state_rows = []
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    # Provider interface used by SnowflakeLoader
+    def acquire(self):
+        return FakeConnection(self)
+
+    def release(self, conn):
+        pass
+
+    def run_once(self, key, action):
+        action()
+        return True
+
+    def forget_ddl(self, key=None):
+        pass
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.statements.append(("COMMIT", 0.0))
+
+    def rollback(self):
+        self.db.statements.append(("ROLLBACK", 0.0))
+
+    def is_closed(self):
+        return False
+
+class FakeCursor:
+    """Executes the SQL subset generated by SnowflakeLoader against FakeSnowflake."""
+
+    def __init__(self, db):
+        self.db = db
+        self.description = []
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        sql = " ".join(sql.split())
+        with self.db.lock:
+            self.rows, self.description = [], []
+            if sql.startswith("SHOW WAREHOUSES"):
+                self.rows = [("warehouse",)]
+            elif sql.startswith("CREATE TABLE IF NOT EXISTS") and "pipeline_state" not in sql:
+                for col, col_type in re.findall(r'"(\w+)" (\w+)', sql):
+                    self.db.columns.setdefault(col, col_type)
+            elif sql.startswith("DESCRIBE TABLE"):
+                self.rows = list(self.db.columns.items())
+            elif sql.startswith("ALTER TABLE"):
+                col, col_type = re.search(r'"(\w+)" (\w+)$', sql).groups()
+                self.db.columns.setdefault(col, col_type)
+            elif sql.startswith("CREATE OR REPLACE TEMPORARY TABLE"):
+                self.db.temp = []
+                self.db.staged = 0
+            elif sql.startswith("COPY INTO"):
+                self._copy(sql)
+            elif sql.startswith("SELECT COUNT(*), COUNT(DISTINCT"):
+                self._stats()
+            elif sql.startswith("MERGE INTO"):
+                self._merge()
+            elif sql.startswith("INSERT INTO") and "pipeline_state" in sql:
+                self.db.state_rows.append(params)
+            elif sql.startswith("SELECT watermark"):
+                last = self.db.state_rows[-1] if self.db.state_rows else None
+                self.rows = [(pd.Timestamp(last[2]), last[3], pd.Timestamp(last[4]) if last[4] else None, last[1])] if last else []
+            elif sql.startswith('SELECT MAX("sys_created_on")'):
+                rows = list(self.db.target.values())
+                self.rows = [(max((r["sys_created_on"] for r in rows), default=None),
+                              max((r["sys_updated_on"] for r in rows), default=None))]
+            elif sql.startswith("DROP TABLE"):
+                self.db.temp = None
+            self.db.statements.append((statement_kind(sql), time.perf_counter() - started))
+        return self
+
+    def _copy(self, sql):
+        paths = re.findall(r"'([^']+)'", sql.split("FILES = (", 1)[1].split(")", 1)[0]) if "FILES = (" in sql else []
+        frames = []
+        self.description = COPY_COLUMNS
+        bucket, prefix = self.db.bucket, self.db.prefix
+        for path in paths:
+            body = self.db.s3_client.get_object(Bucket=bucket, Key=prefix + path)["Body"].read()
+            if self.db.materialize:
+                frames.append(pq.read_table(io.BytesIO(body)).to_pandas())
+                rows = len(frames[-1])
+            else:
+                rows = pq.ParquetFile(io.BytesIO(body)).metadata.num_rows
+            self.rows.append((f"s3://{bucket}/{prefix}{path}", "LOADED", rows, 0, None))
+            self.db.staged += rows
+            self.db.s3_client.delete_object(Bucket=bucket, Key=prefix + path)  # PURGE = TRUE
+        self.db.temp += [row for df in frames for row in df.astype(object).where(df.notna(), None).to_dict("records")]
+
+    def _stats(self):
+        if not self.db.materialize:
+            self.rows = [(self.db.staged, self.db.staged, None, 0, None, None)]
+            return
+        temp = self.db.temp
+        created = [r["sys_created_on"] for r in temp if r.get("sys_created_on") is not None]
+        updated = [r["sys_updated_on"] for r in temp if r.get("sys_updated_on") is not None]
+        self.rows = [(len(temp), len({r["number"] for r in temp}), min(created, default=None),
+                      len(temp) - len(created), max(updated, default=None), max(created, default=None))]
+
+    def _merge(self):
+        self.description = [("number of rows inserted",), ("number of rows updated",)]
+        if not self.db.materialize:
+            self.rows = [(self.db.staged, 0)]
+            self.rowcount = self.db.staged
+            self.db.batches += 1
+            return
+        latest = {}
+        for row in self.db.temp:
+            current = latest.get(row["number"])
+            if current is None or row["sys_updated_on"] >= current["sys_updated_on"]:
+                latest[row["number"]] = row
+        inserted = updated = 0
+        now = time.time()
+        for number, row in latest.items():
+            target = self.db.target.get(number)
+            if target is None:
+                inserted += 1
+            elif row["sys_updated_on"] >= target["sys_updated_on"] and row.get("row_hash") != target.get("row_hash"):
+                updated += 1
+            else:
+                continue
+            self.db.target[number] = row
+            self.db.merged_at[number] = now
+        self.db.batches += 1
+        self.rows = [(inserted, updated)]
+        self.rowcount = inserted + updated
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+def publish(mock, rate, stop, timeline):
+    """Append rate tickets per second to the mock table, recording when each batch appeared."""
+    while not stop.wait(0.5):
+        mock.table.grow(max(1, int(rate / 2)))
+        timeline.append((mock.table.rows, time.time()))
+
+def percentile(values, pct):
+    return sorted(values)[min(len(values) - 1, int(len(values) * pct / 100))]
+
+# A publisher thread keeps appending tickets to the mock Table API while the
+# continuous extractor and micro-batch loader run against moto S3 and an
+# in-memory Snowflake stand-in that understands the statements SnowflakeLoader
+# issues. Reports how many tickets reached the target and how stale they were
+# (publish -> MERGE) when they got there.
+#
+#     python -m benchmarks.continuous_harness --duration 60 --rate 50 --interval 5 --poll 2
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local harness for continuous mode: mock ServiceNow, moto S3 and a fake Snowflake.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to keep publishing tickets")
+    parser.add_argument("--initial", type=int, default=2000, help="Tickets present before the run starts")
+    parser.add_argument("--rate", type=float, default=50, help="New tickets per second")
+    parser.add_argument("--interval", type=float, default=5, help="continuous.interval_seconds")
+    parser.add_argument("--poll", type=float, default=2, help="continuous.poll_seconds")
+    parser.add_argument("--batch-files", type=int, default=5)
+    parser.add_argument("--max-latency", type=float, default=15)
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    with mock_aws(), MockServiceNow(args.initial) as mock:
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        config = mock.config(pagination="keyset", page_size=1000, exclude_reference_link=True)
+        config.update({
+            "pipeline": {"streaming": True},
+            "s3": {"bucket": BUCKET, "prefix": PREFIX, "region": "us-east-1", "direct_upload": False},
+            "snowflake": {"database": "db", "schema": "sc", "table": "incident", "warehouse": "wh",
+                          "account": "harness", "user": "harness"},
+            "state": {"enabled": True, "path": f"{tempfile.mkdtemp()}/watermarks.json"},
+            "continuous": {"interval_seconds": args.interval, "poll_seconds": args.poll,
+                           "batch_files": args.batch_files, "max_latency_seconds": args.max_latency},
+        })
+        db = FakeSnowflake(s3_client)
+        pipeline = ContinuousPipeline(
+            config, "admin",
+            uploader=S3Uploader(config, s3_client=s3_client),
+            loader_factory=lambda: SnowflakeLoader(config, provider=db)
+        )
+
+        timeline = [(args.initial, time.time())]
+        stop = threading.Event()
+        publisher = threading.Thread(target=publish, args=(mock, args.rate, stop, timeline), daemon=True)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            runner = threading.Thread(target=pipeline.run, daemon=True)
+            runner.start()
+            publisher.start()
+            time.sleep(args.duration)
+            stop.set()
+            time.sleep(args.interval + args.max_latency + args.poll)  # Let the last tickets drain
+            pipeline.stop()
+            runner.join()
+
+        published = mock.table.rows
+        ends = [rows for rows, _ in timeline]
+        lags = []
+        for number, merged_at in db.merged_at.items():
+            i = int(number[3:])
+            published_at = timeline[bisect.bisect_right(ends, i)][1]
+            lags.append(merged_at - published_at)
+        print(f"published {published} tickets, {len(db.target)} in target after {db.batches} MERGE batch(es)")
+        if lags:
+            print(f"freshness (publish -> MERGE) s: p50 {statistics.median(lags):.1f}  "
+                  f"p95 {percentile(lags, 95):.1f}  max {max(lags):.1f}")
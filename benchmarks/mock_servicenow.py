@@ -0,0 +1,333 @@
+import argparse
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+BASE_TIME = datetime(2024, 1, 1)
+ROWS_PER_SECOND = 3  # Several rows share each sys_updated_on second, so keyset ties are exercised
+MAX_SYS_ID = "~"  # Sorts after every hex sys_id
+CATEGORIES = ["inquiry", "software", "hardware", "network", "database"]
+CONDITION_RE = re.compile(r"^(\w+?)(>=|<=|!=|>|<|=)(.*)$")
+
+@lru_cache(maxsize=65536)
+def _timestamp(seconds):
+    return (BASE_TIME + timedelta(seconds=seconds)).strftime(TIMESTAMP_FORMAT)
+
+def row_key(i):
+    """(sys_updated_on, sys_id) of row i."""
+    return _timestamp(i // ROWS_PER_SECOND), f"{i:032x}"
+
+def _reference(table, sys_id):
+    return {"link": f"https://mock.service-now.com/api/now/table/{table}/{sys_id}", "value": sys_id}
+
+def make_record(i, extra_columns=0):
+    """Build the synthetic incident record stored at index i."""
+    updated_on, sys_id = row_key(i)
+    created_on = _timestamp(i // ROWS_PER_SECOND - 3600 * (1 + i % 48))
+    resolved = i % 4 == 0
+    record = {
+        "sys_id": sys_id,
+        "number": f"INC{i:07d}",
+        "sys_created_on": created_on,
+        "sys_updated_on": updated_on,
+        "opened_at": created_on,
+        "resolved_at": updated_on if resolved else "",
+        "closed_at": updated_on if resolved else "",
+        "state": "7" if resolved else str(1 + i % 3),
+        "priority": str(1 + i % 5),
+        "impact": str(1 + i % 3),
+        "urgency": str(1 + i % 3),
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "short_description": f"Synthetic incident {i}",
+        "sys_mod_count": str(i % 17),
+        "reopen_count": str(i % 2),
+        "active": "false" if resolved else "true",
+        "caller_id": _reference("sys_user", f"{(i * 7919) % 5000:032x}"),
+        "assignment_group": _reference("sys_user_group", f"{i % 40:032x}"),
+        "assigned_to": _reference("sys_user", f"{i % 300:032x}") if i % 5 else "",
+        "sys_domain": _reference("sys_user_group", "global"),
+    }
+    for k in range(extra_columns):
+        record[f"u_field_{k:02d}"] = f"value {i % (k + 2)}"
+    return record
+
+class _KeyIndex:
+    """Sequence view of row keys so bisect can seek without materialising them."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, i):
+        return row_key(i)
+
+def _parse_condition(text):
+    match = CONDITION_RE.match(text)
+    if not match:
+        raise ValueError(f"Unsupported query condition: {text}")
+    return match.groups()
+
+def parse_query(query):
+    """Split an encoded query into OR'd blocks of AND'd clauses plus the sort order.
+
+    Each clause is a list of OR'd (field, operator, value) conditions.
+    """
+    blocks = []
+    order_by = []
+    for block_text in query.split("^NQ") if query else []:
+        clauses = []
+        for part in block_text.split("^"):
+            if not part:
+                continue
+            if part.startswith("ORDERBYDESC"):
+                order_by.append((part[len("ORDERBYDESC"):], True))
+            elif part.startswith("ORDERBY"):
+                order_by.append((part[len("ORDERBY"):], False))
+            elif part.startswith("OR") and clauses and CONDITION_RE.match(part[2:]):
+                clauses[-1].append(_parse_condition(part[2:]))
+            else:
+                clauses.append([_parse_condition(part)])
+        blocks.append(clauses)
+    return blocks or [[]], order_by
+
+def _compare(actual, operator, expected):
+    if operator == "=":
+        return actual == expected
+    if operator == "!=":
+        return actual != expected
+    if operator == ">":
+        return actual > expected
+    if operator == ">=":
+        return actual >= expected
+    if operator == "<":
+        return actual < expected
+    return actual <= expected
+
+def _matches(record, clauses):
+    return all(any(_compare(record.get(field, ""), op, value) for field, op, value in clause) for clause in clauses)
+
+class MockTable:
+    """In-memory (virtual) incident table answering Table API queries."""
+
+    def __init__(self, rows, extra_columns=0):
+        self.rows = rows
+        self.extra_columns = extra_columns
+        self.keys = _KeyIndex(rows)
+
+    def grow(self, rows):
+        """Append rows newer than every existing row, as if tickets were created or updated."""
+        self.rows += rows
+        self.keys.rows = self.rows
+
+    def _block_range(self, clauses):
+        """Index range [lo, hi) that can satisfy a block, from its sys_updated_on/sys_id bounds."""
+        lo, hi = 0, self.rows
+        updated_eq = None
+        sys_id_gt = None
+        for clause in clauses:
+            if len(clause) != 1:
+                continue
+            field, op, value = clause[0]
+            if field == "sys_updated_on":
+                if op == ">":
+                    lo = max(lo, bisect.bisect_right(self.keys, (value, MAX_SYS_ID)))
+                if op in (">=", "="):
+                    lo = max(lo, bisect.bisect_left(self.keys, (value, "")))
+                if op == "<":
+                    hi = min(hi, bisect.bisect_left(self.keys, (value, "")))
+                if op in ("<=", "="):
+                    hi = min(hi, bisect.bisect_right(self.keys, (value, MAX_SYS_ID)))
+                if op == "=":
+                    updated_eq = value
+            elif field == "sys_id" and op == ">":
+                sys_id_gt = value
+        if updated_eq is not None and sys_id_gt is not None:
+            lo = max(lo, bisect.bisect_right(self.keys, (updated_eq, sys_id_gt)))
+        return lo, hi
+
+    def query(self, query="", limit=1000, offset=0, fields=None, exclude_reference_link=False):
+        """Return the page of records matching an encoded query.
+
+        fields and exclude_reference_link mirror sysparm_fields and
+        sysparm_exclude_reference_link; sysparm_display_value is not emulated.
+        """
+        blocks, order_by = parse_query(query)
+        ranges = [self._block_range(clauses) for clauses in blocks]
+        lo = min(r[0] for r in ranges)
+        hi = max(r[1] for r in ranges)
+        descending = bool(order_by) and order_by[0] == ("sys_updated_on", True)
+        indexes = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+
+        page = []
+        skipped = 0
+        for i in indexes:
+            updated_on, sys_id = row_key(i)
+            candidate = {
+                "sys_id": sys_id,
+                "sys_updated_on": updated_on,
+                "sys_created_on": _timestamp(i // ROWS_PER_SECOND - 3600 * (1 + i % 48)),
+            }
+            if not any(_matches(candidate, clauses) for clauses in blocks):
+                continue
+            if skipped < offset:
+                skipped += 1  # The instance walks every skipped row for sysparm_offset
+                continue
+            record = make_record(i, self.extra_columns)
+            if fields:
+                record = {field: record.get(field, "") for field in fields}
+            if exclude_reference_link:
+                record = {k: v["value"] if v.__class__ is dict else v for k, v in record.items()}
+            page.append(record)
+            if len(page) >= limit:
+                break
+        return page
+
+class FaultInjector:
+    """Decide, per request, whether to answer normally or inject a fault.
+
+    Rates are probabilities per request: error_rate (HTTP 500/503), throttle_rate
+    (HTTP 429 with Retry-After: retry_after), stall_rate (sleep stall_seconds before
+    answering, to trip read timeouts) and drop_rate (close the connection unanswered).
+    """
+
+    def __init__(self, error_rate=0.0, throttle_rate=0.0, stall_rate=0.0, drop_rate=0.0,
+                 retry_after=1, stall_seconds=5.0, seed=None):
+        self.rates = [("error", error_rate), ("throttle", throttle_rate), ("stall", stall_rate), ("drop", drop_rate)]
+        self.retry_after = retry_after
+        self.stall_seconds = stall_seconds
+        self.random = random.Random(seed)
+        self.counts = {"ok": 0, "error": 0, "throttle": 0, "stall": 0, "drop": 0}
+        self.lock = threading.Lock()
+
+    def decide(self):
+        with self.lock:
+            roll = self.random.random()
+            for fault, rate in self.rates:
+                if roll < rate:
+                    self.counts[fault] += 1
+                    return fault
+                roll -= rate
+            self.counts["ok"] += 1
+            return None
+
+class _Handler(BaseHTTPRequestHandler):
+    table = None
+    latency = 0.0
+    faults = None
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)  # Simulated network and instance round trip
+        fault = self.faults.decide() if self.faults else None
+        if fault == "drop":
+            self.close_connection = True
+            self.connection.close()
+            return
+        if fault == "stall":
+            time.sleep(self.faults.stall_seconds)
+        if fault in ("error", "throttle"):
+            body = json.dumps({"error": {"message": f"Injected {fault}"}}).encode("utf-8")
+            self.send_response(429 if fault == "throttle" else random.choice([500, 503]))
+            if fault == "throttle":
+                self.send_header("Retry-After", str(self.faults.retry_after))
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            page = self.table.query(
+                params.get("sysparm_query", ""),
+                limit=int(params.get("sysparm_limit", 10000)),
+                offset=int(params.get("sysparm_offset", 0)),
+                fields=params["sysparm_fields"].split(",") if params.get("sysparm_fields") else None,
+                exclude_reference_link=params.get("sysparm_exclude_reference_link") == "true",
+            )
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps({"result": page}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up, e.g. a read timeout on a stalled request
+
+    def log_message(self, format, *args):
+        pass
+
+class MockServiceNow:
+    """Run a MockTable behind a local HTTP server in a background thread."""
+
+    def __init__(self, rows, extra_columns=0, latency=0.0, host="127.0.0.1", port=0, faults=None):
+        self.table = MockTable(rows, extra_columns)
+        self.faults = faults
+        handler = type("Handler", (_Handler,), {"table": self.table, "latency": latency, "faults": faults})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/now/table/incident"
+
+    def config(self, **servicenow):
+        """Pipeline config whose servicenow section points at this mock."""
+        section = {"instance": "mock", "url": self.url, "username": "admin"}
+        section.update(servicenow)
+        return {"servicenow": section}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Rows are generated on demand from their index, so a mock table of millions of
+# tickets costs no memory. Row i is stored in (sys_updated_on, sys_id) order, like
+# an index on the instance: range predicates on sys_updated_on/sys_id seek with a
+# binary search, while sysparm_offset has to walk every skipped row.
+#
+# Only the subset of the encoded query syntax used by the pipeline is understood:
+# conditions joined with ^, ^OR and ^NQ, the operators > >= < <= = !=, and
+# ORDERBY/ORDERBYDESC on sys_updated_on.
+#
+# A FaultInjector makes a share of requests fail with 5xx, 429 + Retry-After,
+# stalls longer than the client's read timeout, or dropped connections.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the ServiceNow Table API serving synthetic incident rows.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--extra-columns", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500/503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of requests stalled for --stall-seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of connections closed unanswered")
+    parser.add_argument("--stall-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    faults = FaultInjector(args.error_rate, args.throttle_rate, args.stall_rate, args.drop_rate, stall_seconds=args.stall_seconds)
+    with MockServiceNow(args.rows, args.extra_columns, args.latency, port=args.port, faults=faults) as mock:
+        print(f"Mock Table API serving {args.rows} incidents at {mock.url}")
+        mock.thread.join()
@@ -2,9 +2,19 @@ import yaml
 import os
 from dotenv import load_dotenv
 from modules.servicenow import ServiceNowClient
+from modules.extractor import ParallelExtractor
 from modules.snowflake import SnowflakeLoader
+from modules.parquet import ParquetHandler, widen_sample
+from modules.state import WatermarkStore, drop_extracted
+from modules.s3 import S3Uploader
+from modules.orchestrator import AsyncPipeline
+from modules.checkpoint import RunCheckpoint
+from modules.metrics import metrics, table_label
+from modules.logging_config import setup_logging
 import pandas as pd
-import boto3
+import shutil
+import uuid
+import asyncio
 from datetime import datetime
 
 def load_config():
@@ -12,50 +22,166 @@ def load_config():
     with open("config/config.yaml", "r") as file:
         return yaml.safe_load(file)
 
-def run_servicenow(config, password):
-    """Fetch tickets from ServiceNow."""
-    client = ServiceNowClient(config, password)
-    loader = SnowflakeLoader(config)
-    latest_created_on = loader.get_latest_created_on()
-    latest_updated_on = loader.get_latest_updated_on()
-    df = client.fetch_tickets(latest_created_on, latest_updated_on)
-    return df
+def resume_point(config):
+    """Return (latest_created_on, latest_updated_on, start_key) from the local store, else Snowflake."""
+    latest_created_on, latest_updated_on, start_key = WatermarkStore(config).resume_point()
+    if latest_updated_on is None:
+        # Only connect to Snowflake when the local store has no watermark yet
+        loader = SnowflakeLoader(config)
+        latest_created_on, latest_updated_on, start_key = loader.get_resume_point()
+        loader.close()  # Back to the pool; the load step reuses the same session
+    return latest_created_on, latest_updated_on, start_key
+
+def run_servicenow(config, password, stream=False, resume=None, session=None, seen=None):
+    """Fetch tickets from ServiceNow (as one DataFrame, or per-page DataFrames when stream=True).
+
+    resume overrides the (latest_created_on, latest_updated_on, start_key) to fetch after;
+    seen overrides the rows of start_key's second already extracted (by default those the
+    local store recorded; see drop_extracted); session is a shared requests.Session (see
+    TableEngine).
+    """
+    if config["servicenow"].get("parallel", {}).get("enabled"):
+        client = ParallelExtractor(config, password, session=session)
+    else:
+        client = ServiceNowClient(config, password, session=session)
+    latest_created_on, latest_updated_on, start_key = resume or resume_point(config)
+    if seen is None:
+        seen = WatermarkStore(config).boundary(start_key)
+    if stream:
+        return drop_extracted(client.iter_frames(latest_created_on, latest_updated_on, start_key), seen)
+    df = client.fetch_tickets(latest_created_on, latest_updated_on, start_key)
+    frames = list(drop_extracted([df], seen))
+    return frames[0] if frames else pd.DataFrame()
+
+def stage_to_s3(config, frames, uploader, run_prefix, local_dir, checkpoint=None, part_name="part-{:05d}.parquet"):
+    """Write frames as Parquet part files under run_prefix in S3.
+
+    With a checkpoint, finished parts are recorded in its manifest and kept in local_dir
+    until the load commits. part_name formats the n-th file name. Returns (rows, one-row
+    sample_df, s3_keys).
+    """
+    # Roll to a new part file at the target size and start uploading it while later pages are fetched
+    target_bytes = config["s3"].get("target_file_size_mb", 128) * 1024 * 1024
+    if config["s3"].get("direct_upload"):
+        # Stream row groups straight into S3 multipart uploads; nothing is written to local disk
+        return ParquetHandler(config).write_rolling(
+            frames,
+            lambda part: f"{run_prefix}{part_name.format(part)}",
+            target_bytes=target_bytes,
+            open_sink=uploader.open_multipart
+        )
+    def on_file(path):
+        s3_key = f"{run_prefix}{os.path.basename(path)}"
+        if checkpoint is None:
+            uploader.submit(path, s3_key, remove=True)
+            return
+        checkpoint.part_closed(path, s3_key)
+        future = uploader.submit(path, s3_key)
+        future.add_done_callback(lambda f: f.exception() is None and checkpoint.part_uploaded(path))
+
+    os.makedirs(local_dir, exist_ok=True)
+    try:
+        rows, sample_df, _ = ParquetHandler(config).write_rolling(
+            checkpoint.track(frames) if checkpoint is not None else frames,
+            lambda part: os.path.join(local_dir, part_name.format(part)),
+            target_bytes=target_bytes,
+            on_file=on_file
+        )
+    finally:
+        s3_keys = uploader.wait()
+        if checkpoint is None:
+            shutil.rmtree(local_dir, ignore_errors=True)
+    return rows, sample_df, s3_keys
+
+def run_pipeline(config, password, uploader=None, session=None):
+    """Extract, stage and load the table described by config; returns the number of rows extracted."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    attempt = f"{timestamp}_{uuid.uuid4().hex[:8]}"  # Unique even when a run is restarted within the same second
+    local_dir = f"tickets_{config['snowflake']['table']}_{attempt}"
+    watermarks = WatermarkStore(config)
+    uploader = uploader or S3Uploader(config)
+    run_prefix = uploader.run_prefix(attempt)
+    metrics.start_run(table_label(config), timestamp)
+    textfile = config.get("metrics", {}).get("textfile")  # Prometheus textfile collector output, if set
+    if config.get("pipeline", {}).get("async", {}).get("enabled"):
+        # Fetch, encode, upload and COPY overlap instead of running one after another
+        frames = run_servicenow(config, password, stream=True, session=session)
+        pipeline = AsyncPipeline(config, uploader=uploader, watermarks=watermarks)
+        asyncio.run(pipeline.run(frames, timestamp, attempt))
+        rows = pipeline.writer.rows if pipeline.writer is not None else 0
+        metrics.finish_run(table_label(config), rows, textfile)
+        return rows
+
+    checkpoint = None
+    resume = None
+    if config.get("checkpoint", {}).get("enabled") and not config["s3"].get("direct_upload"):
+        # Finished parts survive a crash; the next run uploads what is missing and fetches only the rest
+        checkpoint = RunCheckpoint(config, watermarks)
+        if checkpoint.resumed:
+            resume = checkpoint.resume()
+            for path, s3_key in checkpoint.pending_uploads():
+                future = uploader.submit(path, s3_key)
+                future.add_done_callback(lambda f, path=path: f.exception() is None and checkpoint.part_uploaded(path))
+        local_dir = checkpoint.attempt_dir(attempt)
+
+    if config.get("pipeline", {}).get("streaming"):
+        # Each page becomes a row group as it arrives; the full extract is never held in memory
+        frames = run_servicenow(config, password, stream=True, resume=resume, session=session)
+    else:
+        df = run_servicenow(config, password, resume=resume, session=session)
+        if not df.empty:
+            print(f"Processed {len(df)} tickets into DataFrame with {len(df.columns)} columns")
+        frames = [df]
+
+    frames = (watermarks.observe(df) for df in frames)
+    rows, sample_df, s3_keys = stage_to_s3(config, frames, uploader, run_prefix, local_dir, checkpoint)
+    if checkpoint is not None:
+        # Earlier attempts' parts are loaded with this one's
+        rows, s3_keys = checkpoint.rows(), checkpoint.s3_keys()
+        checkpoint_sample = checkpoint.sample_frame()
+        if sample_df is None:
+            sample_df = checkpoint_sample
+        elif checkpoint_sample is not None:
+            sample_df = widen_sample(sample_df, checkpoint_sample)  # Earlier parts may have columns this attempt never saw
+
+    if rows:
+        print(f"Uploaded {len(s3_keys)} Parquet file(s) to s3://{config['s3']['bucket']}/{run_prefix}")
+
+        # Load every part in one COPY and one MERGE (pass a one-row sample_df for schema)
+        loader = SnowflakeLoader(config)
+        run_state = watermarks.run_state(timestamp, rows, s3_keys)
+        if checkpoint is not None:
+            checkpoint.load_started()  # COPY PURGEs the parts from S3, so a failed load has to upload them again
+        try:
+            if config["snowflake"].get("drain_backlog"):
+                # Also picks up files that failed runs left in the stage
+                counts = loader.drain_backlog(sample_df, keys=s3_keys, run_state=run_state)
+            else:
+                counts = loader.run_batch(sample_df, keys=s3_keys, run_state=run_state)
+        finally:
+            loader.close()
+        if not counts:
+            # Nothing reached the MERGE (e.g. the staged files were gone); keep the watermarks and checkpoint for a retry
+            print("Warning: No rows were merged; watermarks not advanced")
+            metrics.finish_run(table_label(config), rows, textfile)
+            return rows
+        watermarks.save()
+    else:
+        print("No new tickets to process")
+    if checkpoint is not None:
+        checkpoint.clear()
+    metrics.finish_run(table_label(config), rows, textfile)
+    return rows
 
 def main():
     """Main function to orchestrate the data pipeline."""
     load_dotenv()
     config = load_config()
+    setup_logging(config)
     password = os.getenv("SERVICENOW_PASSWORD")
     if not password:
         raise ValueError("SERVICENOW_PASSWORD not found in .env file")
-
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=config["s3"]["region"]
-    )
-
-    df = run_servicenow(config, password)
-    if not df.empty:
-        print(f"Processed {len(df)} tickets into DataFrame with {len(df.columns)} columns")
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        parquet_file = f"tickets_{timestamp}.parquet"
-        df.to_parquet(parquet_file)
-        print(f"Saved {len(df)} tickets to Parquet file: {parquet_file}")
-
-        s3_key = f"{config['s3']['prefix']}{parquet_file}"
-        s3_client.upload_file(parquet_file, config["s3"]["bucket"], s3_key)
-        print(f"Uploaded Parquet file to s3://{config['s3']['bucket']}/{s3_key}")
-
-        # Load from S3 to Snowflake (pass s3_key and optional sample_df for schema)
-        loader = SnowflakeLoader(config)
-        loader.run(s3_key, sample_df=df.head(1))  # Use head(1) as sample for table creation
-
-        os.remove(parquet_file)
-        print(f"Cleaned up local file: {parquet_file}")
-    else:
-        print("No new tickets to process")
+    run_pipeline(config, password)
 
 if __name__ == "__main__":
     main()
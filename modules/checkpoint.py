@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import threading
+from collections import deque
+from datetime import datetime
+import pyarrow.parquet as pq
+from modules.normalize import TIMESTAMP_FORMAT
+from modules.parquet import widen_sample
+
+class RunCheckpoint:
+    """Manifest of the Parquet parts a run has finished, so a crashed run can carry on from them.
+
+    Parts are spilled under checkpoint.path/<table>/<attempt>/ and kept until the load
+    commits. manifest.json records each closed part (local path, rows, S3 key, whether it
+    was uploaded), the (watermark, sys_id) key of the last page wholly inside the closed
+    parts and the watermarks observed so far. A restarted run uploads the parts that never
+    reached S3, fetches only after the recorded key and loads old and new parts together;
+    at most the part that was open when the run died is fetched again. If the run died
+    during the load, COPY may already have purged the parts from S3, so all of them are
+    uploaded again.
+    """
+
+    def __init__(self, config, watermarks):
+        settings = config.get("checkpoint", {})
+        self.enabled = settings.get("enabled", True)
+        self.dir = os.path.join(settings.get("path", "checkpoints"), config["snowflake"]["table"])
+        self.path = os.path.join(self.dir, "manifest.json")
+        self.watermarks = watermarks
+        servicenow = config["servicenow"]
+        parallel = servicenow.get("parallel", {})
+        self.watermark_column = servicenow.get("watermark_column", "sys_updated_on")
+        # Pages only arrive in (watermark, sys_id) order with keyset paging (sliced by time, if parallel)
+        self.ordered = servicenow.get("pagination") == "keyset" and not (parallel.get("enabled") and parallel.get("split_by") == "sys_id")
+        self.manifest = self._read() or {"parts": [], "checkpoint": None, "pending": {}}
+        self.frames = deque()  # (rows streamed through this frame, its last key), until a closed part covers it
+        self.rows_streamed = 0
+        self.rows_closed = 0
+        self.lock = threading.Lock()
+
+    def _read(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def _write(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(tmp_path, self.path)  # Atomic, so a crash never leaves a half-written manifest
+
+    @property
+    def resumed(self):
+        """True when an earlier attempt left finished parts behind."""
+        return bool(self.manifest["parts"])
+
+    def attempt_dir(self, attempt):
+        """Local directory for this attempt's parts (attempt is unique per run)."""
+        path = os.path.join(self.dir, attempt)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def resume(self):
+        """Restore the observed watermarks and return the resume point after the last finished page.
+
+        Returns (latest_created_on, latest_updated_on, start_key), or None when pages are not
+        fetched in key order; the run then starts over and the MERGE drops the duplicates.
+        """
+        self.watermarks.pending = {
+            col: datetime.fromisoformat(value) if col in ("sys_created_on", "sys_updated_on") else value
+            for col, value in self.manifest["pending"].items()
+        }
+        print(f"Resuming from checkpoint: {len(self.manifest['parts'])} part(s) with {self.rows()} rows already extracted")
+        if self.manifest.get("loading"):
+            # The last load failed after its COPY, which PURGEs the files it read: upload every kept part again
+            print("The previous load did not commit; re-uploading every checkpointed part")
+            for part in self.manifest["parts"]:
+                part["uploaded"] = False
+            self.manifest["loading"] = False
+            self._write()
+        key = self.manifest["checkpoint"]
+        if not self.ordered or not key:
+            return None
+        return None, datetime.strptime(key[0], TIMESTAMP_FORMAT), tuple(key)
+
+    def track(self, frames):
+        """Pass frames through, remembering where each one ends in the stream."""
+        for df in frames:
+            self.rows_streamed += len(df)
+            if self.ordered and not df.empty:
+                last = df.iloc[-1]
+                self.frames.append((self.rows_streamed, (last[self.watermark_column].strftime(TIMESTAMP_FORMAT), last["sys_id"])))
+            yield df
+
+    def part_closed(self, path, s3_key):
+        """Record a finished part and move the checkpoint past every page it completes."""
+        rows = pq.ParquetFile(path).metadata.num_rows
+        self.rows_closed += rows
+        key = None
+        while self.frames and self.frames[0][0] <= self.rows_closed:
+            key = self.frames.popleft()[1]
+        with self.lock:
+            self.manifest["parts"].append({"path": path, "rows": rows, "s3_key": s3_key, "uploaded": False})
+            if key:
+                self.manifest["checkpoint"] = list(key)
+            self.manifest["pending"] = {
+                col: value.isoformat() if isinstance(value, datetime) else value
+                for col, value in self.watermarks.pending.items()
+            }
+            self._write()
+
+    def part_uploaded(self, path):
+        with self.lock:
+            for part in self.manifest["parts"]:
+                if part["path"] == path:
+                    part["uploaded"] = True
+            self._write()
+
+    def load_started(self):
+        """Note that the parts are being loaded (and may be purged from S3 by the COPY)."""
+        with self.lock:
+            self.manifest["loading"] = True
+            self._write()
+
+    def pending_uploads(self):
+        """(path, s3_key) of finished parts that never reached S3."""
+        return [(part["path"], part["s3_key"]) for part in self.manifest["parts"] if not part["uploaded"]]
+
+    def s3_keys(self):
+        return [part["s3_key"] for part in self.manifest["parts"]]
+
+    def rows(self):
+        return sum(part["rows"] for part in self.manifest["parts"])
+
+    def sample_frame(self):
+        """One-row DataFrame with every column of the finished parts (later parts can be wider)."""
+        if not self.manifest["parts"]:
+            return None
+        sample_df = pq.ParquetFile(self.manifest["parts"][0]["path"]).read_row_group(0).slice(0, 1).to_pandas()
+        for part in self.manifest["parts"][1:]:
+            sample_df = widen_sample(sample_df, pq.read_schema(part["path"]).empty_table().to_pandas())
+        return sample_df
+
+    def clear(self):
+        """Drop the manifest and every spilled part once the load has committed."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.manifest = {"parts": [], "checkpoint": None, "pending": {}}
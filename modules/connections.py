@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+import snowflake.connector
+from modules.normalize_pool import close_pools
+
+class SnowflakeConnectionProvider:
+    """Process-wide pool of Snowflake connections plus a cache of DDL already issued.
+
+    Connections are opened lazily on first acquire, kept alive by the connector's
+    heartbeat, and handed back to the pool on release, so a long-lived process (the
+    scheduler) logs in once instead of once per loader. Idle connections are pinged
+    before reuse and replaced if the session has expired.
+    """
+
+    def __init__(self, config, max_idle=2, validate_after=300):
+        sf_config = config["snowflake"]
+        self.password = os.getenv("SNOWFLAKE_PASSWORD")
+        if not self.password:
+            raise ValueError("SNOWFLAKE_PASSWORD not found in .env file")
+        self.params = {
+            "user": sf_config["user"],
+            "account": sf_config["account"],
+            "warehouse": sf_config["warehouse"],
+            "database": sf_config["database"],
+            "schema": sf_config["schema"]
+        }
+        self.max_idle = max_idle
+        self.validate_after = validate_after  # Seconds idle before a connection is pinged on reuse
+        self.idle = []  # (connection, released_at)
+        self.ddl_done = set()
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Open a new Snowflake connection (no DictCursor for simplicity)."""
+        conn = snowflake.connector.connect(
+            password=self.password,
+            client_session_keep_alive=True,  # Heartbeat keeps pooled sessions from expiring between runs
+            **self.params
+        )
+        print("Snowflake raw connection established")
+        return conn
+
+    def is_alive(self, conn, released_at):
+        """Check an idle connection before handing it out again."""
+        if conn.is_closed():
+            return False
+        if time.monotonic() - released_at < self.validate_after:
+            return True
+        try:
+            conn.cursor().execute("SELECT 1")
+            return True
+        except Exception as e:
+            print(f"Dropping stale Snowflake connection: {e}")
+            return False
+
+    def acquire(self):
+        """Return an idle pooled connection, or open a new one."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, released_at = self.idle.pop()
+            if self.is_alive(conn, released_at):
+                return conn
+            self.discard(conn)
+        return self.connect()
+
+    def release(self, conn):
+        """Hand a connection back to the pool (closing it when the pool is full)."""
+        if conn is None or conn.is_closed():
+            return
+        try:
+            conn.rollback()  # Never let an open transaction leak into the next borrower
+        except Exception as e:
+            print(f"Error resetting Snowflake connection: {e}")
+            self.discard(conn)
+            return
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append((conn, time.monotonic()))
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        """Close a connection without returning it to the pool."""
+        try:
+            conn.close()
+            print("Snowflake raw connection closed")
+        except Exception as e:
+            print(f"Error closing Snowflake connection: {e}")
+
+    def run_once(self, key, action):
+        """Call action() unless key already succeeded in this process; returns True if it ran.
+
+        Used for existence checks and idempotent DDL (SHOW WAREHOUSES, CREATE ... IF NOT EXISTS).
+        """
+        with self.lock:
+            if key in self.ddl_done:
+                return False
+        action()
+        with self.lock:
+            self.ddl_done.add(key)
+        return True
+
+    def forget_ddl(self, key=None):
+        """Drop one cached DDL key (or all of them), e.g. after a table was dropped."""
+        with self.lock:
+            if key is None:
+                self.ddl_done.clear()
+            else:
+                self.ddl_done.discard(key)
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self.discard(conn)
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_provider(config):
+    """Return the shared provider for the Snowflake account/user/database/schema in config."""
+    sf_config = config["snowflake"]
+    key = tuple(sf_config[name] for name in ("account", "user", "warehouse", "database", "schema"))
+    with _providers_lock:
+        if key not in _providers:
+            pool = sf_config.get("pool", {})
+            _providers[key] = SnowflakeConnectionProvider(
+                config,
+                max_idle=pool.get("max_idle", 2),
+                validate_after=pool.get("validate_after_seconds", 300)
+            )
+        return _providers[key]
+
+def close_all():
+    """Close the idle connections of every provider and stop the normalize workers (at process exit)."""
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        provider.close_all()
+    close_pools()
@@ -0,0 +1,169 @@
+import argparse
+import io
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from modules.connections import close_all
+from modules.s3 import S3Uploader
+from modules.snowflake import SnowflakeLoader
+from modules.state import WatermarkStore
+from main import load_config, run_servicenow, stage_to_s3
+
+class ContinuousPipeline:
+    """Continuous delivery: a short-interval extractor and a micro-batching loader.
+
+    The extractor runs an incremental fetch every interval_seconds and drops small Parquet
+    files under the S3 prefix, remembering how far it got in its own "extracted" watermark.
+    The loader polls the prefix and loads whatever has accumulated with one COPY and one
+    MERGE as soon as batch_files are waiting or the oldest has waited max_latency_seconds.
+    It only borrows a Snowflake connection while a batch is due, so the warehouse can
+    auto-suspend between batches. The two loops can run in one process or separately.
+    """
+
+    def __init__(self, config, password, uploader=None, loader_factory=None):
+        self.config = config
+        self.password = password
+        settings = config.get("continuous", {})
+        self.interval = settings.get("interval_seconds", 60)
+        self.poll = settings.get("poll_seconds", 30)
+        self.batch_files = settings.get("batch_files", 20)  # Load as soon as this many files are waiting
+        self.max_latency = settings.get("max_latency_seconds", 300)  # ...or the oldest has waited this long
+        self.max_batch_files = settings.get("max_batch_files", 1000)
+        self.uploader = uploader or S3Uploader(config)
+        self.loader_factory = loader_factory or (lambda: SnowflakeLoader(config))
+        self.extracted = WatermarkStore(config, name="extracted")
+        self.loaded = WatermarkStore(config)
+        self.failed_keys = set()  # Files COPY reported errors for; left in S3 for inspection, not retried
+        self.stop_event = threading.Event()
+
+    def resume_point(self):
+        """Where the next extract starts: the extracted watermark, else the loaded one, else Snowflake."""
+        resume = self.extracted.resume_point()
+        if resume[1] is None:
+            resume = self.loaded.resume_point()
+        if resume[1] is None:
+            loader = self.loader_factory()
+            try:
+                resume = loader.get_resume_point()
+            finally:
+                loader.close()
+        return resume
+
+    def extract_once(self):
+        """Fetch everything newer than the extracted watermark into Parquet files under the S3 prefix."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        run_prefix = self.uploader.run_prefix(timestamp)
+        resume = self.resume_point()
+        # Rows of the resumed second extracted last time are dropped, so an idle source uploads nothing
+        seen = self.extracted.boundary(resume[2]) or self.loaded.boundary(resume[2])
+        frames = run_servicenow(self.config, self.password, stream=True, resume=resume, seen=seen)
+        frames = (self.extracted.observe(df) for df in frames)
+        rows, _, s3_keys = stage_to_s3(self.config, frames, self.uploader, run_prefix, f"tickets_{timestamp}")
+        if rows:
+            self.extracted.save()  # Only once every file is in S3
+            print(f"Extracted {rows} tickets into {len(s3_keys)} file(s) under {run_prefix}")
+        return s3_keys
+
+    def pending_files(self):
+        """List the Parquet files waiting under the S3 prefix as (key, last_modified), oldest first."""
+        files = []
+        paginator = self.uploader.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.uploader.bucket, Prefix=self.uploader.prefix + self.uploader.table_prefix):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith(".parquet") and item["Key"] not in self.failed_keys:
+                    files.append((item["Key"], item["LastModified"]))
+        return sorted(files, key=lambda item: item[1])
+
+    def sample_frame(self, s3_key):
+        """One-row DataFrame read from a staged file, for the loader's column types."""
+        body = self.uploader.s3_client.get_object(Bucket=self.uploader.bucket, Key=s3_key)["Body"].read()
+        parquet_file = pq.ParquetFile(io.BytesIO(body))
+        return parquet_file.read_row_group(0).slice(0, 1).to_pandas()
+
+    def load_once(self, force=False):
+        """Load the waiting files if the batch is full or the oldest is due; returns the MERGE counts."""
+        files = self.pending_files()
+        if not files:
+            return {}
+        oldest_age = (datetime.now(timezone.utc) - files[0][1]).total_seconds()
+        if not force and len(files) < self.batch_files and oldest_age < self.max_latency:
+            return {}
+
+        keys = [key for key, _ in files[:self.max_batch_files]]
+        sample_df = self.sample_frame(keys[-1])  # The newest file carries any newly added columns
+        run_state = {"run_id": f"micro_{datetime.now().strftime('%Y%m%d_%H%M%S')}", "watermark": None,
+                     "rows_extracted": None, "s3_keys": keys}
+        loader = self.loader_factory()
+        try:
+            counts = loader.run_batch(sample_df, keys=keys, run_state=run_state)
+            failed = {key for key in keys if any(name.endswith(loader.stage_path(key)) for name in loader.failed_files)}
+        finally:
+            loader.close()
+        self.failed_keys.update(failed)
+        # COPY already PURGEs loaded files; deleting again also clears files it skipped as loaded before
+        done = [key for key in keys if key not in failed]
+        for i in range(0, len(done), 1000):
+            self.uploader.s3_client.delete_objects(
+                Bucket=self.uploader.bucket,
+                Delete={"Objects": [{"Key": key} for key in done[i:i + 1000]], "Quiet": True}
+            )
+        if counts.get("max_sys_updated_on"):
+            self.loaded.save(counts.get("max_sys_created_on"), counts["max_sys_updated_on"])
+        print(f"Micro-batch of {len(keys)} file(s) loaded (oldest waited {oldest_age:.0f}s): {counts}")
+        return counts
+
+    def _loop(self, name, step, interval):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                print(f"Continuous {name} step failed: {e}")  # Retried on the next tick
+            self.stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def run_extractor(self):
+        """Extract every interval_seconds until stopped."""
+        self._loop("extractor", self.extract_once, self.interval)
+
+    def run_loader(self):
+        """Poll for waiting files every poll_seconds until stopped, then flush what is left."""
+        self._loop("loader", self.load_once, self.poll)
+        self.load_once(force=True)
+
+    def run(self, role="both"):
+        """Run the extractor, the loader or both (in threads) until interrupted."""
+        targets = {"extractor": [self.run_extractor], "loader": [self.run_loader],
+                   "both": [self.run_extractor, self.run_loader]}[role]
+        threads = [threading.Thread(target=target, name=target.__name__, daemon=True) for target in targets]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            print("Stopping continuous pipeline...")
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """Ask both loops to finish their current step and exit."""
+        self.stop_event.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline continuously")
+    parser.add_argument("--role", choices=["both", "extractor", "loader"], default="both")
+    args = parser.parse_args()
+    load_dotenv()
+    password = os.getenv("SERVICENOW_PASSWORD")
+    if args.role != "loader" and not password:
+        raise ValueError("SERVICENOW_PASSWORD not found in .env file")
+    try:
+        ContinuousPipeline(load_config(), password).run(args.role)
+    finally:
+        close_all()  # Pooled Snowflake connections and normalize workers live as long as the process
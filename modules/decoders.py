@@ -0,0 +1,128 @@
+import json
+from typing import Any, Optional, Union
+
+class ColumnBatch:
+    """One page of records held as column lists instead of a list of dicts.
+
+    Behaves like a read-only list of records for callers that need a row
+    (len, indexing, iteration), while RecordNormalizer builds its DataFrame
+    straight from the columns.
+    """
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, index):
+        return {name: values[index] for name, values in self.columns.items()}
+
+    def __iter__(self):
+        for index in range(self.rows):
+            yield self[index]
+
+class JsonDecoder:
+    """Decode pages with the standard library json module."""
+    name = "json"
+
+    def decode(self, content):
+        return json.loads(content).get("result", [])
+
+class OrjsonDecoder:
+    """Decode pages with orjson into a list of record dicts."""
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.loads = orjson.loads
+
+    def decode(self, content):
+        return self.loads(content).get("result", [])
+
+class MsgspecDecoder:
+    """Decode pages with msgspec into typed incident structs, then transpose into columns.
+
+    Every projected field is typed as a string or a reference struct, so reference
+    values are flattened while transposing and no per-record dicts are built.
+    """
+    name = "msgspec"
+
+    def __init__(self, fields):
+        import msgspec
+        if not fields:
+            raise ValueError("The msgspec decoder needs servicenow.fields to build its typed schema")
+
+        class Reference(msgspec.Struct):
+            value: str = ""
+            link: str = ""
+            display_value: str = ""
+
+        field_type = Optional[Union[str, Reference]]
+        self.Reference = Reference
+        self.fields = list(fields)
+        incident = msgspec.defstruct("Incident", [(name, field_type, "") for name in self.fields])
+        page = msgspec.defstruct("Page", [("result", list[incident], [])])
+        self.decoder = msgspec.json.Decoder(page)
+        self.astuple = msgspec.structs.astuple
+
+    def decode(self, content):
+        rows = self.decoder.decode(content).result
+        if not rows:
+            return []
+        columns = {}
+        for name, values in zip(self.fields, zip(*map(self.astuple, rows))):
+            kinds = set(map(type, values))
+            if self.Reference in kinds:
+                values = [v.value if v.__class__ is self.Reference else v for v in values]
+            if type(None) in kinds:
+                values = ["" if v is None else v for v in values]
+            columns[name] = list(values)
+        return ColumnBatch(columns, len(rows))
+
+class KeyDecoder:
+    """Decode just each record's (watermark, sys_id) from a page, as a ColumnBatch.
+
+    Enough to count a page and build the next keyset query while a NormalizePool decodes
+    the whole page elsewhere. msgspec skips every other field without building objects;
+    without msgspec the fallback decoder reads the full page.
+    """
+    name = "keys"
+
+    def __init__(self, watermark_column, fallback):
+        self.columns = [watermark_column, "sys_id"]
+        self.fallback = fallback
+        try:
+            import msgspec
+        except ImportError:
+            self.decoder = None
+            return
+        key = msgspec.defstruct("Key", [(name, Any, "") for name in self.columns])
+        page = msgspec.defstruct("Page", [("result", list[key], [])])
+        self.decoder = msgspec.json.Decoder(page)
+        self.astuple = msgspec.structs.astuple
+
+    def decode(self, content):
+        if self.decoder is None:
+            records = self.fallback.decode(content)
+            rows = [[record.get(name) for name in self.columns] for record in records]
+        else:
+            rows = list(map(self.astuple, self.decoder.decode(content).result))
+        if not rows:
+            return []
+        columns = {}
+        for name, values in zip(self.columns, zip(*rows)):
+            # Reference-style {"value": ...} (e.g. with display_value=all) become their value
+            columns[name] = [v.get("value", "") if v.__class__ is dict else v for v in values]
+        return ColumnBatch(columns, len(rows))
+
+def get_decoder(name="json", fields=None):
+    """Return the page decoder backend configured by servicenow.decoder."""
+    if name == "json":
+        return JsonDecoder()
+    if name == "orjson":
+        return OrjsonDecoder()
+    if name == "msgspec":
+        return MsgspecDecoder(fields)
+    raise ValueError(f"Unsupported decoder: {name}")
@@ -0,0 +1,129 @@
+import argparse
+import copy
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from modules.connections import close_all
+from modules.logging_config import setup_logging
+from modules.s3 import S3Uploader, make_s3_client
+from modules.transport import ResilientSession, session_options
+from main import load_config, run_pipeline
+
+class BudgetedSession(ResilientSession):
+    """ResilientSession whose requests each hold a slot of a shared concurrency budget.
+
+    The slot is held only while a request is on the wire, not during retry backoff.
+    """
+
+    def __init__(self, budget, **options):
+        super().__init__(**options)
+        self.budget = budget
+
+    def send_once(self, method, url, **kwargs):
+        with self.budget:
+            return super().send_once(method, url, **kwargs)
+
+def table_config(config, spec):
+    """Pipeline config for one table spec: the shared sections with the table's overrides.
+
+    A spec has a ServiceNow table name and optionally target_table, primary_key,
+    watermark_column, fields, reference_fields and cluster_column (the MERGE only prunes
+    on sys_created_on; any other column just clusters new tables). Each table's files go
+    under <prefix><name>/, so all tables share one Snowflake stage.
+    """
+    name = spec["name"]
+    table = copy.deepcopy(config)
+    watermark_column = spec.get("watermark_column", "sys_updated_on")
+    primary_key = spec.get("primary_key", "number")
+    table["servicenow"].update({
+        "table": name,
+        "primary_key": primary_key,
+        "watermark_column": watermark_column,
+        "fields": spec.get("fields"),
+        "reference_fields": spec.get("reference_fields")  # Detected from the first page when not given
+    })
+    table["snowflake"].update({
+        "table": spec.get("target_table", name),
+        "primary_key": primary_key,
+        "watermark_column": watermark_column
+    })
+    if "cluster_column" in spec:
+        table["snowflake"]["cluster_column"] = spec["cluster_column"]
+    table["s3"]["table_prefix"] = f"{name}/"
+    return table
+
+class TableEngine:
+    """Extract and load several ServiceNow tables concurrently in one process.
+
+    Tables come from the "tables" list in config (see table_config). Up to table_workers
+    tables run at once, and they share one HTTP session (and its connection pool), one
+    S3 client and the process-wide Snowflake connection pool. max_concurrency caps the
+    ServiceNow requests in flight across every table and parallel slice, so adding tables
+    does not multiply the load on the instance the way separate cron processes would.
+    """
+
+    def __init__(self, config, password):
+        self.config = config
+        self.password = password
+        engine = config.get("engine", {})
+        self.max_concurrency = engine.get("max_concurrency", 8)
+        self.table_workers = engine.get("table_workers", 3)
+        self.specs = config.get("tables") or [{"name": config["servicenow"].get("table", "incident"), "target_table": config["snowflake"]["table"]}]
+        self.budget = threading.BoundedSemaphore(self.max_concurrency)
+        self.session = BudgetedSession(self.budget, pool_size=self.max_concurrency, **session_options(config))
+        uploads = self.table_workers * config["s3"].get("upload_workers", 4) * config["s3"].get("max_concurrency", 8)
+        self.s3_client = make_s3_client(config, max_pool_connections=uploads)
+
+    def run_table(self, spec):
+        """Run one table's pipeline; failures are reported, not raised, so other tables carry on."""
+        config = table_config(self.config, spec)
+        started = time.monotonic()
+        try:
+            uploader = S3Uploader(config, s3_client=self.s3_client)
+            rows = run_pipeline(config, self.password, uploader=uploader, session=self.session)
+            return {"table": spec["name"], "rows": rows, "seconds": time.monotonic() - started, "error": None}
+        except Exception as e:
+            print(f"Table {spec['name']} failed: {e}")
+            return {"table": spec["name"], "rows": 0, "seconds": time.monotonic() - started, "error": str(e)}
+
+    def run(self, names=None):
+        """Run every table (or those in names); returns one result dict per table."""
+        specs = [spec for spec in self.specs if not names or spec["name"] in names]
+        print(f"Extracting {len(specs)} table(s), {self.table_workers} at a time, with {self.max_concurrency} ServiceNow requests in flight at most")
+        with ThreadPoolExecutor(max_workers=self.table_workers) as executor:
+            results = list(executor.map(self.run_table, specs))
+        for result in results:
+            status = f"failed: {result['error']}" if result["error"] else f"{result['rows']} rows"
+            print(f"  {result['table']}: {status} in {result['seconds']:.1f}s")
+        return results
+
+    def close(self):
+        """Close the shared HTTP session (pooled Snowflake connections stay for the next run)."""
+        self.session.close()
+
+def run_tables(names=None):
+    """Like main.main, but for every table in config (or those in names); returns the results."""
+    load_dotenv()
+    password = os.getenv("SERVICENOW_PASSWORD")
+    if not password:
+        raise ValueError("SERVICENOW_PASSWORD not found in .env file")
+    config = load_config()
+    setup_logging(config)
+    engine = TableEngine(config, password)
+    try:
+        return engine.run(names)
+    finally:
+        engine.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract every table in config/config.yaml")
+    parser.add_argument("tables", nargs="*", help="Only these ServiceNow tables (default: all)")
+    args = parser.parse_args()
+    try:
+        results = run_tables(args.tables)
+    finally:
+        close_all()
+    if any(result["error"] for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,181 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pandas as pd
+from modules.normalize_pool import get_pool
+from modules.page_cache import PageCache
+from modules.servicenow import ServiceNowClient, TIMESTAMP_FORMAT
+
+SYS_ID_SPACE = 16 ** 4  # sys_id ranges are split on the first four hex digits
+DONE = object()  # End of a slice's pages
+
+class ParallelExtractor:
+    """Fetch an incremental window from ServiceNow as independent slices on a thread pool."""
+
+    def __init__(self, config, password, session=None):
+        self.config = config
+        self.password = password
+        self.session = session  # Shared by every worker's client when given (see TableEngine)
+        self.watermark_column = config["servicenow"].get("watermark_column", "sys_updated_on")
+        parallel = config["servicenow"].get("parallel", {})
+        self.max_workers = parallel.get("max_workers", 4)  # Concurrency cap; keep within the instance rate limit
+        self.slices = parallel.get("slices", self.max_workers * 4)  # More slices than workers evens out skew
+        self.buffer_pages = parallel.get("buffer_pages", 2)  # Pages a slice fetches ahead of the one being yielded
+        self.split_by = parallel.get("split_by", "sys_updated_on")  # "sys_updated_on" (the watermark column) or "sys_id"
+        if self.split_by not in ("sys_updated_on", "sys_id"):
+            raise ValueError(f"Unsupported split_by: {self.split_by}")
+        self.cache = PageCache(config)
+        self.normalize_pool = get_pool(config)  # Shared by every slice (and every extract in this process)
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+
+    def _client(self):
+        """Return this worker thread's ServiceNowClient (one HTTP session per worker)."""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = ServiceNowClient(self.config, self.password, session=self.session)
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def time_slices(self, start, end):
+        """Split [start, end) into watermark-column range filters."""
+        start_dt = datetime.strptime(start, TIMESTAMP_FORMAT)
+        end_dt = datetime.strptime(end, TIMESTAMP_FORMAT)
+        bounds = []
+        for k in range(self.slices):
+            bound = (start_dt + (end_dt - start_dt) * k / self.slices).strftime(TIMESTAMP_FORMAT)
+            if bound not in bounds:  # Short windows collapse to fewer, whole-second slices
+                bounds.append(bound)
+        filters = []
+        for k, lower in enumerate(bounds):
+            if k + 1 < len(bounds):
+                filters.append(f"{self.watermark_column}>={lower}^{self.watermark_column}<{bounds[k + 1]}")
+            else:
+                filters.append(f"{self.watermark_column}>={lower}^{self.watermark_column}<={end}")
+        return filters
+
+    def sys_id_slices(self):
+        """Split the sys_id keyspace into equal hex-prefix ranges."""
+        bounds = [f"{SYS_ID_SPACE * k // self.slices:04x}" for k in range(self.slices)]
+        filters = []
+        for k, lower in enumerate(bounds):
+            condition = f"sys_id>={lower}" if k else ""
+            if k + 1 < self.slices:
+                condition += f"{'^' if condition else ''}sys_id<{bounds[k + 1]}"
+            filters.append(condition)
+        return filters
+
+    def plan_slices(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Build the slice filters covering the incremental window."""
+        if self.split_by == "sys_id":
+            return self.sys_id_slices()
+
+        client = self._client()
+        filter_query = client.build_filter(latest_created_on, latest_updated_on, start_key)
+        start = client.fetch_boundary(filter_query)
+        if start is None:
+            return []
+        end = client.fetch_boundary(filter_query, latest=True)  # Instance time, so no clock skew
+        return self.time_slices(start, end)
+
+    def fetch_slice(self, slice_filter, pages, stop, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Fetch and normalise one slice on the calling worker's session, putting each page on the pages queue.
+
+        The queue is bounded, so a slice ahead of the one being yielded waits instead of
+        buffering its pages. Ends with DONE, or the exception that stopped it.
+        """
+        try:
+            client = self._client()
+            raw_pages = client.iter_pages(latest_created_on, latest_updated_on, slice_filter=slice_filter, start_key=start_key,
+                                          raw=self.normalize_pool.enabled)
+            rows = 0
+            for df in client.page_frames(raw_pages, self.normalize_pool):
+                if df.empty:
+                    continue
+                rows += len(df)
+                if not self.put(pages, df, stop):
+                    return
+            print(f"Fetched slice [{slice_filter}]: {rows} tickets")
+            self.put(pages, DONE, stop)
+        except BaseException as e:
+            self.put(pages, e, stop)
+
+    @staticmethod
+    def put(pages, item, stop):
+        """Put item on pages unless the consumer stopped; returns False if it did."""
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def iter_frames(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Yield page DataFrames in slice order, from ServiceNow or the page cache."""
+        client = ServiceNowClient(self.config, self.password, session=self.session)
+        window = client.cache_window(latest_created_on, latest_updated_on, start_key)  # Same window as a sequential extract
+        client.close()
+        return self.cache.frames(window, lambda: self.fetch_frames(latest_created_on, latest_updated_on, start_key))
+
+    def fetch_frames(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Yield page DataFrames in slice order as they arrive, with at most max_workers + 1 slices in flight.
+
+        Memory is bounded by buffer_pages pages per slice in flight, however big a slice is.
+        """
+        stop = threading.Event()
+        try:
+            if self.normalize_pool.enabled:
+                self.normalize_pool.open()  # Before the slice threads start
+            slice_filters = self.plan_slices(latest_created_on, latest_updated_on, start_key)
+            print(f"Streaming {len(slice_filters)} slices by {self.split_by} with {self.max_workers} workers")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    slices = iter(slice_filters)
+                    pending = deque()
+                    while True:
+                        # Slices start in order, so the one being yielded always has a worker
+                        for slice_filter in slices:
+                            pages = queue.Queue(maxsize=self.buffer_pages)
+                            executor.submit(self.fetch_slice, slice_filter, pages, stop, latest_created_on, latest_updated_on, start_key)
+                            pending.append(pages)
+                            if len(pending) > self.max_workers:
+                                break
+                        if not pending:
+                            break
+                        pages = pending.popleft()
+                        while True:
+                            item = pages.get()
+                            if item is DONE:
+                                break
+                            if isinstance(item, BaseException):
+                                raise item
+                            yield item
+                finally:
+                    stop.set()  # Workers blocked on a full queue give up, so the pool can shut down
+
+        except Exception as e:
+            print(f"Error fetching tickets from ServiceNow: {e}")
+            raise
+
+        finally:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+            self._local = threading.local()
+
+    def fetch_tickets(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Fetch all slices concurrently and merge them in slice order."""
+        frames = list(self.iter_frames(latest_created_on, latest_updated_on, start_key))
+        if not frames:
+            print("No new or updated tickets found from ServiceNow")
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        print(f"Retrieved {len(df)} tickets from ServiceNow (new/updated)")
+        return df
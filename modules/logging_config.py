@@ -1,13 +1,32 @@
+import json
 import logging
 import os
 from datetime import datetime
 
-def setup_logging():
-    """Configure logging to file and console."""
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the record's "metric" fields (see modules.metrics) inlined."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "metric", {}))
+        return json.dumps(entry, default=str)
+
+def setup_logging(config=None):
+    """Configure logging to file and console.
+
+    With metrics.json_logs in config, every metrics observation is also written as a JSON
+    line to logs/metrics_<timestamp>.jsonl (and kept off the console).
+    """
     log_dir = "logs"
     os.makedirs(log_dir, exist_ok=True)
-    log_file = f"logs/pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file = f"logs/pipeline_{timestamp}.log"
+
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
@@ -16,4 +35,11 @@ def setup_logging():
             logging.StreamHandler()
         ]
     )
-    return logging.getLogger()
\ No newline at end of file
+    metrics_logger = logging.getLogger("pipeline.metrics")
+    metrics_logger.propagate = False
+    if (config or {}).get("metrics", {}).get("json_logs", True) and not metrics_logger.handlers:
+        handler = logging.FileHandler(f"logs/metrics_{timestamp}.jsonl")
+        handler.setFormatter(JsonFormatter())
+        metrics_logger.addHandler(handler)
+        metrics_logger.setLevel(logging.INFO)
+    return logging.getLogger()
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("pipeline.metrics")  # One JSON line per observation once setup_logging(config) ran
+
+def table_label(config):
+    """The ServiceNow table a config describes; metrics are kept per table."""
+    return (config or {}).get("servicenow", {}).get("table", "incident")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+class Metrics:
+    """Per-table, per-stage timings, bytes and row counts for the current run.
+
+    Stages wrap their work in timer() or report what they measured with observe(); each
+    observation is logged as a JSON line on the "pipeline.metrics" logger and added to the
+    run's totals, which summary() prints and write_textfile() exports for the Prometheus
+    node_exporter textfile collector. Thread-safe: extract slices, uploads and tables in a
+    TableEngine all record into the module-level instance.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}  # table -> {"run_id", "started", "finished", "rows", "stages": {stage: totals}}
+
+    def start_run(self, table, run_id):
+        """Forget the table's previous run and start timing this one."""
+        with self.lock:
+            self.runs[table] = {"run_id": run_id, "started": time.time(), "finished": None, "rows": 0, "stages": {}}
+
+    def observe(self, stage, table="incident", seconds=None, bytes=None, rows=None, **fields):
+        """Record one measurement of stage (a page fetched, a file uploaded, a MERGE, ...)."""
+        with self.lock:
+            run = self.runs.setdefault(table, {"run_id": None, "started": time.time(), "finished": None, "rows": 0, "stages": {}})
+            totals = run["stages"].setdefault(stage, {"count": 0, "seconds": 0.0, "bytes": 0, "rows": 0, "durations": []})
+            totals["count"] += 1
+            if seconds is not None:
+                totals["seconds"] += seconds
+                totals["durations"].append(seconds)
+            totals["bytes"] += bytes or 0
+            totals["rows"] += rows or 0
+            run_id = run["run_id"]
+        if logger.isEnabledFor(logging.INFO):
+            metric = {"table": table, "run_id": run_id, "stage": stage, "seconds": round(seconds, 6) if seconds is not None else None,
+                      "bytes": bytes, "rows": rows, **fields}
+            logger.info(stage, extra={"metric": {key: value for key, value in metric.items() if value is not None}})
+
+    @contextmanager
+    def timer(self, stage, table="incident", **fields):
+        """Time the with block as one observation; set "bytes"/"rows" on the yielded dict to record them."""
+        values = dict(fields)
+        started = time.perf_counter()
+        yield values
+        self.observe(stage, table, time.perf_counter() - started, **values)
+
+    def summary(self, table):
+        """Per-stage totals of the table's run: count, seconds, p50/p95/max, bytes, rows and rates."""
+        with self.lock:
+            run = self.runs.get(table)
+            stages = {stage: dict(totals, durations=list(totals["durations"])) for stage, totals in (run or {}).get("stages", {}).items()}
+        summary = {}
+        for stage, totals in stages.items():
+            durations = totals.pop("durations")
+            seconds = totals["seconds"]
+            summary[stage] = {
+                **totals,
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": max(durations, default=0.0),
+                "mb_per_second": totals["bytes"] / 1024 / 1024 / seconds if seconds and totals["bytes"] else None,
+                "rows_per_second": totals["rows"] / seconds if seconds and totals["rows"] else None
+            }
+        return summary
+
+    def finish_run(self, table, rows, textfile=None):
+        """Print the run summary (and export every table's metrics to textfile); returns the summary."""
+        with self.lock:
+            run = self.runs.get(table)
+            if run is None:
+                return {}
+            run["finished"] = time.time()
+            run["rows"] = rows
+            elapsed = run["finished"] - run["started"]
+        summary = self.summary(table)
+        print(f"Run summary for {table} ({rows} rows in {elapsed:.1f}s); busy time per stage, summed over threads:")
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["seconds"]):
+            line = f"  {stage:<22} {stats['count']:>6}x {stats['seconds']:>8.2f}s  p50 {stats['p50'] * 1000:.0f}ms  p95 {stats['p95'] * 1000:.0f}ms"
+            if stats["bytes"]:
+                line += f"  {stats['bytes'] / 1024 / 1024:.1f} MB"
+            if stats["mb_per_second"]:
+                line += f" ({stats['mb_per_second']:.1f} MB/s)"
+            if stats["rows"]:
+                line += f"  {stats['rows']} rows"
+            print(line)
+        logger.info("run_summary", extra={"metric": {"table": table, "run_id": run["run_id"], "stage": "run", "seconds": round(elapsed, 3), "rows": rows, "stages": summary}})
+        if textfile:
+            self.write_textfile(textfile)
+        return summary
+
+    def write_textfile(self, path):
+        """Write every table's last run in Prometheus text format, atomically (as the textfile collector needs)."""
+        families = [
+            ("servicenow_pipeline_stage_seconds_total", "counter", "Seconds spent in each pipeline stage, summed over threads", "seconds"),
+            ("servicenow_pipeline_stage_calls_total", "counter", "Observations of each pipeline stage (pages, files, statements)", "count"),
+            ("servicenow_pipeline_stage_bytes_total", "counter", "Bytes handled by each pipeline stage", "bytes"),
+            ("servicenow_pipeline_stage_rows_total", "counter", "Rows handled by each pipeline stage", "rows")
+        ]
+        with self.lock:
+            runs = {table: dict(run, stages={stage: dict(totals) for stage, totals in run["stages"].items()}) for table, run in self.runs.items()}
+        lines = []
+        for name, kind, help_text, key in families:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for table, run in runs.items():
+                for stage, totals in run["stages"].items():
+                    lines.append(f'{name}{{table="{table}",stage="{stage}"}} {totals[key]}')
+        lines += ["# HELP servicenow_pipeline_run_rows Rows extracted by the last run", "# TYPE servicenow_pipeline_run_rows gauge"]
+        lines += [f'servicenow_pipeline_run_rows{{table="{table}"}} {run["rows"]}' for table, run in runs.items() if run["finished"]]
+        lines += ["# HELP servicenow_pipeline_run_duration_seconds Wall time of the last run", "# TYPE servicenow_pipeline_run_duration_seconds gauge"]
+        lines += [f'servicenow_pipeline_run_duration_seconds{{table="{table}"}} {run["finished"] - run["started"]:.3f}' for table, run in runs.items() if run["finished"]]
+        lines += ["# HELP servicenow_pipeline_last_run_timestamp_seconds When the last run finished", "# TYPE servicenow_pipeline_last_run_timestamp_seconds gauge"]
+        lines += [f'servicenow_pipeline_last_run_timestamp_seconds{{table="{table}"}} {run["finished"]:.0f}' for table, run in runs.items() if run["finished"]]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+metrics = Metrics()
+
+if __name__ == "__main__":
+    # Record a few fake observations and print the summary and textfile
+    metrics.start_run("incident", "test")
+    for _ in range(3):
+        with metrics.timer("fetch", "incident") as values:
+            time.sleep(0.01)
+            values["bytes"] = 250000
+            values["rows"] = 1000
+    metrics.finish_run("incident", 3000, textfile="logs/metrics.prom")
+    print(open("logs/metrics.prom").read())
@@ -0,0 +1,86 @@
+import pandas as pd
+from pandas.api.types import infer_dtype
+from modules.decoders import ColumnBatch
+
+DATETIME_COLUMNS = ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+ROW_HASH_COLUMN = "row_hash"
+
+def row_hash(df):
+    """64-bit hash of each row's values (columns in name order), so unchanged rows can be skipped at MERGE."""
+    columns = sorted(col for col in df.columns if col != ROW_HASH_COLUMN)
+    return pd.util.hash_pandas_object(df[columns], index=False, categorize=False).values.view("int64")
+
+def flatten_reference(value):
+    """Return the sys_id held by a reference dict, or the value itself when it is not one."""
+    if value.__class__ is dict:
+        return value.get("value") or value.get("sys_id", "")
+    return value
+
+class RecordNormalizer:
+    """Turn pages of Table API records into DataFrames with flat reference fields and parsed datetimes.
+
+    Reference fields come back as {"link": ..., "value": ...} dicts when set and "" when empty.
+    They are either configured up front or detected from the first page, then flattened in a
+    single pass over just those fields. Other columns get one C-level dtype check per page, so a
+    reference field that was empty on the first page is still caught and learnt.
+    """
+
+    def __init__(self, reference_fields=None, debug_types=False):
+        self.reference_fields = list(reference_fields) if reference_fields else None
+        self.debug_types = debug_types
+
+    def detect_reference_fields(self, records):
+        """Return the fields holding reference dicts anywhere in records."""
+        fields = []
+        for record in records:
+            for key, value in record.items():
+                if value.__class__ is dict and key not in fields:
+                    fields.append(key)
+        return fields
+
+    def flatten(self, records):
+        """Replace reference dicts with their value (sys_id) in place."""
+        fields = self.reference_fields
+        for record in records:
+            for field in fields:
+                value = record.get(field)
+                if value.__class__ is dict:
+                    record[field] = value.get("value") or value.get("sys_id", "")
+
+    def normalize(self, records):
+        """Normalise one page of records (a list of dicts or a ColumnBatch) into a DataFrame."""
+        if isinstance(records, ColumnBatch):
+            # The decoder already flattened references while building the columns
+            df = pd.DataFrame(records.columns)
+            if self.reference_fields is None:
+                self.reference_fields = []
+        else:
+            if self.reference_fields is None:
+                self.reference_fields = self.detect_reference_fields(records)
+                print(f"Detected reference fields: {self.reference_fields}")
+            self.flatten(records)
+            df = pd.DataFrame(records)
+
+        for col in df.columns:
+            if col in self.reference_fields:
+                if df[col].hasnans:
+                    df[col] = df[col].fillna("")
+            elif df[col].dtype == object and infer_dtype(df[col], skipna=True) not in ("string", "empty"):
+                values = df[col].tolist()
+                if any(value.__class__ is dict for value in values):
+                    print(f"Warning: Found dict in column '{col}', will convert to sys_id string")
+                    self.reference_fields.append(col)
+                    df[col] = [flatten_reference(value) if value is not None else "" for value in values]
+
+        # Parse datetime fields
+        for col in DATETIME_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], format=TIMESTAMP_FORMAT, errors="coerce")
+        df[ROW_HASH_COLUMN] = row_hash(df)
+
+        if self.debug_types:
+            for col in df.columns:
+                types = df[col].apply(type).value_counts()
+                print(f"Column '{col}' types after preprocessing: {types}")
+        return df
@@ -0,0 +1,135 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+from modules.decoders import get_decoder
+from modules.metrics import metrics
+from modules.normalize import RecordNormalizer
+
+_decoders = {}  # Per worker process: (decoder name, fields) -> decoder
+
+def to_ipc(df):
+    """Serialise a DataFrame as an Arrow IPC stream (bytes)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def from_ipc(payload):
+    """DataFrame from an Arrow IPC stream written by to_ipc."""
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+def normalize_page(content, decoder_name, fields, reference_fields, debug_types):
+    """Worker: decode and normalise one raw response body.
+
+    Returns (Arrow IPC bytes, or the DataFrame itself if it has no Arrow form, reference
+    fields after this page, rows, seconds).
+    """
+    started = time.perf_counter()
+    key = (decoder_name, tuple(fields))
+    if key not in _decoders:
+        _decoders[key] = get_decoder(decoder_name, fields)
+    normalizer = RecordNormalizer(debug_types=debug_types)
+    normalizer.reference_fields = list(reference_fields)  # Learnt by the parent from the first page
+    df = normalizer.normalize(_decoders[key].decode(content))
+    try:
+        payload = to_ipc(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        payload = df  # Mixed-type object column; pickled instead
+    return payload, normalizer.reference_fields, len(df), time.perf_counter() - started
+
+class NormalizePool:
+    """Decode and normalise pages in worker processes, so large backfills use every core.
+
+    Flattening references, building the DataFrame, parsing datetimes and hashing rows is
+    Python-level work that holds the GIL, so one extract tops out at one core however fast
+    the fetching is. With servicenow.normalize_processes set, the fetching thread sends each
+    raw response body (plain bytes, cheap to pass) to a worker, which decodes and normalises
+    it and sends the page back as an Arrow IPC stream instead of a pickled DataFrame. The
+    fetching thread only decodes each record's watermark and sys_id, for the next page's
+    keyset (see KeyDecoder). Pages come back in order, with at most two per worker in
+    flight per extract.
+
+    The first page is normalised in-process so reference fields are detected once, as in the
+    sequential path; fields a worker learns later are passed on to the pages after it.
+
+    Spawning a worker re-imports pandas and pyarrow, so the workers are started once per
+    process and shared by every extract, table and slice (see get_pool); close_pools stops
+    them at exit.
+    """
+
+    def __init__(self, config):
+        self.processes = config["servicenow"].get("normalize_processes", 0)
+        self.debug_types = config["servicenow"].get("debug_types", False)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    def open(self):
+        """Start the workers (spawned, not forked: the fetching side runs threads)."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self
+
+    def map(self, pages, client):
+        """Yield one DataFrame per (content, keys) page from client.iter_pages(raw=True), in page order."""
+        self.open()
+        normalizer = client.normalizer
+        pending = deque()
+        try:
+            for content, _ in pages:
+                if normalizer.reference_fields is None:
+                    yield client.build_dataframe(client.decoder.decode(content))
+                    continue
+                pending.append(self.executor.submit(normalize_page, content, client.decoder.name, client.fields,
+                                                    normalizer.reference_fields, self.debug_types))
+                if len(pending) >= 2 * self.processes:
+                    yield self.collect(pending.popleft(), normalizer, client.table)
+            while pending:
+                yield self.collect(pending.popleft(), normalizer, client.table)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def collect(self, future, normalizer, table):
+        """The page's DataFrame; records the worker's normalise time and any reference field it learnt."""
+        payload, reference_fields, rows, seconds = future.result()
+        for field in reference_fields:
+            if field not in normalizer.reference_fields:
+                normalizer.reference_fields.append(field)
+        metrics.observe("normalize", table, seconds, rows=rows, process=True)
+        if not isinstance(payload, bytes):
+            return payload
+        with metrics.timer("ipc_read", table, bytes=len(payload), rows=rows):
+            return from_ipc(payload)
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(config):
+    """Return the process-wide pool for the normalize_processes (and debug_types) in config."""
+    key = (config["servicenow"].get("normalize_processes", 0), config["servicenow"].get("debug_types", False))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = NormalizePool(config)
+        return _pools[key]
+
+def close_pools():
+    """Stop the workers of every pool (at process exit)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
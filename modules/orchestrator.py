@@ -0,0 +1,237 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from modules.parquet import ParquetHandler, incident_schema, to_arrow, widen_sample, widen_schema
+from modules.s3 import S3Uploader
+from modules.snowflake import SnowflakeLoader
+from modules.state import WatermarkStore
+
+DONE = object()  # End-of-stream marker passed down the queues
+
+class AsyncPipeline:
+    """Extract, encode, write, upload and load as overlapping asyncio stages.
+
+    The stages are connected by bounded queues of queue_size items, so a slow stage holds
+    back the ones before it instead of letting pages pile up in memory:
+
+        fetch pages -> encode to Arrow (pool) -> write Parquet parts -> upload parts -> COPY into temp
+
+    Each uploaded part is COPYed into the temp table while later pages are still being
+    fetched, and the single MERGE runs once every part is in, so wall time tends towards
+    the slowest stage rather than the sum of all of them. If any stage fails the others
+    are cancelled, the part being written is aborted and the load is rolled back.
+    """
+
+    def __init__(self, config, uploader=None, loader_factory=None, watermarks=None):
+        self.config = config
+        settings = config.get("pipeline", {}).get("async", {})
+        self.queue_size = settings.get("queue_size", 4)
+        self.encode_workers = settings.get("encode_workers", 2)
+        self.encode_processes = settings.get("encode_processes", False)  # Sidesteps the GIL, but pickles every page
+        self.direct_upload = config["s3"].get("direct_upload", False)
+        self.target_bytes = config["s3"].get("target_file_size_mb", 128) * 1024 * 1024
+        self.uploader = uploader or S3Uploader(config)
+        self.loader_factory = loader_factory or (lambda: SnowflakeLoader(config))
+        self.handler = ParquetHandler(config)
+        self.watermarks = watermarks or WatermarkStore(config)
+        self.schema = None
+        self.sample_df = None
+        self.writer = None
+        self.s3_keys = []
+        self.busy = {}  # Stage -> seconds spent working, summed over its workers
+
+    async def _in(self, stage, pool, fn, *args):
+        """Run fn(*args) in pool, adding its duration to the stage's busy time."""
+        started = time.monotonic()
+        try:
+            return await self.loop.run_in_executor(pool, fn, *args)
+        finally:
+            self.busy[stage] = self.busy.get(stage, 0.0) + time.monotonic() - started
+
+    async def fetch(self, frames, pages):
+        """Pull pages from the ServiceNow iterator, one at a time in a worker thread."""
+        while True:
+            df = await self._in("fetch", self.fetch_pool, next, frames, None)
+            if df is None:
+                break
+            if not df.empty:
+                await pages.put(self.watermarks.observe(df))
+        await pages.put(DONE)
+
+    async def encode(self, pages, tables):
+        """Convert pages to Arrow in the encode pool; tables are queued in page order."""
+        while True:
+            df = await pages.get()
+            if df is DONE:
+                break
+            if self.schema is None:
+                self.schema = incident_schema(df)  # The first page fixes the file schema
+                self.sample_df = df.head(1)
+            schema = widen_schema(self.schema, df)
+            if schema is not self.schema:
+                # Columns first seen on this page: later parts carry them, and the load adds them
+                self.schema, self.sample_df = schema, widen_sample(self.sample_df, df)
+            task = asyncio.ensure_future(self._in("encode", self.encode_pool, to_arrow, df, self.schema))
+            await tables.put(task)
+        await tables.put(DONE)
+
+    def open_writer(self):
+        """RollingParquetWriter for this run's parts, into S3 directly or into local_dir."""
+        if self.direct_upload:
+            return self.handler.open_rolling(
+                self.schema, lambda part: f"{self.run_prefix}part-{part:05d}.parquet",
+                target_bytes=self.target_bytes, open_sink=self.uploader.open_multipart
+            )
+        os.makedirs(self.local_dir, exist_ok=True)
+        return self.handler.open_rolling(
+            self.schema, lambda part: os.path.join(self.local_dir, f"part-{part:05d}.parquet"),
+            target_bytes=self.target_bytes
+        )
+
+    async def write(self, tables, parts):
+        """Write encoded pages into rolling Parquet parts; each closed part is queued for upload."""
+        try:
+            while True:
+                item = await tables.get()
+                if item is DONE:
+                    break
+                table = await item
+                if self.writer is None:
+                    self.writer = self.open_writer()
+                for path in await self._in("write", self.write_pool, self.writer.write, table):
+                    await parts.put(path)
+            if self.writer is not None:
+                for path in await self._in("write", self.write_pool, self.writer.close):
+                    await parts.put(path)
+            await parts.put(DONE)
+        except BaseException:
+            if self.writer is not None:
+                await self.loop.run_in_executor(self.write_pool, self.writer.abort)
+            raise
+
+    def upload_part(self, path):
+        """Upload a closed local part and delete it; returns its S3 key."""
+        s3_key = f"{self.run_prefix}{os.path.basename(path)}"
+        self.uploader.upload_to_s3(path, s3_key)
+        os.remove(path)
+        return s3_key
+
+    async def upload(self, parts, keys):
+        """Upload closed parts, upload_workers at a time, and queue their keys for loading."""
+        async def worker():
+            while True:
+                path = await parts.get()
+                if path is DONE:
+                    await parts.put(DONE)  # Let the other workers see it too
+                    return
+                if self.direct_upload:
+                    s3_key = path  # Already completed as a multipart upload
+                else:
+                    s3_key = await self._in("upload", self.upload_pool, self.upload_part, path)
+                await keys.put(s3_key)
+
+        await asyncio.gather(*[worker() for _ in range(self.uploader.upload_workers)])
+        await keys.put(DONE)
+
+    async def load(self, keys):
+        """COPY parts into the temp table as they arrive, then MERGE once; returns the counts."""
+        loader = await self._in("load", self.load_pool, self.loader_factory)  # Logs in while the first pages are fetched
+        cursor = statements = None
+        loading_sample = None
+        rows_loaded = 0
+        try:
+            finished = False
+            while not finished:
+                batch = [await keys.get()]
+                while not keys.empty():
+                    batch.append(keys.get_nowait())  # Parts that arrived during the last COPY share one statement
+                finished = DONE in batch
+                batch = [key for key in batch if key is not DONE]
+                if not batch:
+                    continue
+                if cursor is None:
+                    loading_sample = self.sample_df
+                    cursor, statements = await self._in("load", self.load_pool, loader.begin_batch, loading_sample)
+                elif self.sample_df is not loading_sample:
+                    # A later page brought new columns; add them to the target and temp table first
+                    loading_sample = self.sample_df
+                    statements = await self._in("load", self.load_pool, loader.widen_batch, cursor, statements, loading_sample)
+                rows_loaded += await self._in("load", self.load_pool, loader.copy_into_temp, cursor, statements, batch)
+                self.s3_keys.extend(batch)
+
+            if cursor is None:
+                return {}
+            pattern = loader.backlog_pattern() if self.config["snowflake"].get("drain_backlog") else None
+            if pattern:
+                # Also picks up files that failed runs left in the stage
+                rows_loaded += await self._in("load", self.load_pool, loader.copy_into_temp, cursor, statements, None, pattern)
+            run_state = self.watermarks.run_state(self.timestamp, self.writer.rows, self.s3_keys)
+            return await self._in("load", self.load_pool, loader.finish_batch, cursor, statements, rows_loaded, run_state)
+        except BaseException as e:
+            reason = "cancelled after another stage failed" if isinstance(e, asyncio.CancelledError) else e
+            await self.loop.run_in_executor(self.load_pool, loader.abort_batch, reason)
+            raise
+        finally:
+            await self.loop.run_in_executor(self.load_pool, loader.close)
+
+    async def run(self, frames, timestamp=None, attempt=None):
+        """Run every stage over frames (an iterator of page DataFrames); returns the MERGE counts.
+
+        attempt names the run's S3 prefix and local directory; by default the timestamp plus
+        a random suffix, so attempts started in the same second never share files.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+        attempt = attempt or f"{self.timestamp}_{uuid.uuid4().hex[:8]}"
+        self.run_prefix = self.uploader.run_prefix(attempt)
+        self.local_dir = f"tickets_{self.config['snowflake']['table']}_{attempt}"
+        frames = iter(frames)
+        pages, tables, parts, keys = (asyncio.Queue(maxsize=self.queue_size) for _ in range(4))
+        self.fetch_pool = ThreadPoolExecutor(max_workers=1)  # The page iterator is not thread-safe
+        if self.encode_processes:
+            # Spawned, not forked: the fetch, upload and boto3 threads are already running and a fork would inherit their locks
+            self.encode_pool = ProcessPoolExecutor(max_workers=self.encode_workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.encode_pool = ThreadPoolExecutor(max_workers=self.encode_workers)
+        self.write_pool = ThreadPoolExecutor(max_workers=1)
+        self.upload_pool = ThreadPoolExecutor(max_workers=self.uploader.upload_workers)
+        self.load_pool = ThreadPoolExecutor(max_workers=1)  # One Snowflake session, one statement at a time
+        pools = [self.fetch_pool, self.encode_pool, self.write_pool, self.upload_pool, self.load_pool]
+
+        started = time.monotonic()
+        tasks = [
+            asyncio.ensure_future(self.fetch(frames, pages)),
+            asyncio.ensure_future(self.encode(pages, tables)),
+            asyncio.ensure_future(self.write(tables, parts)),
+            asyncio.ensure_future(self.upload(parts, keys)),
+            asyncio.ensure_future(self.load(keys))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            print(f"Async pipeline failed, cancelling the other stages: {e!r}")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=True, cancel_futures=True)  # Threads finish their current call
+            if hasattr(frames, "close"):
+                frames.close()  # Closes the ServiceNow session if fetching stopped early
+            shutil.rmtree(self.local_dir, ignore_errors=True)
+
+        counts = tasks[-1].result()
+        rows = self.writer.rows if self.writer is not None else 0
+        busy = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in self.busy.items())
+        print(f"Async pipeline loaded {rows} tickets from {len(self.s3_keys)} part(s) in {time.monotonic() - started:.1f}s (busy: {busy})")
+        if rows:
+            self.watermarks.save()
+        else:
+            print("No new tickets to process")
+        return counts
@@ -0,0 +1,154 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import pyarrow as pa
+from modules.metrics import metrics
+
+class PageCache:
+    """On-disk Arrow IPC cache of extracted pages, keyed by table, query window and projection.
+
+    Each extracted window is an entry directory holding one Arrow IPC file per normalised
+    page plus meta.json, written only once the window has been fetched completely. Modes
+    (cache.mode in config):
+
+        off     the default; nothing is read or written
+        record  every extract is fetched from ServiceNow and kept on disk
+        replay  a window already on disk is served from it without calling ServiceNow
+                (and recorded if it is not)
+
+    Pages are read through memory maps, so replaying a window costs little more than the
+    DataFrame conversion. Entries beyond max_size_mb are evicted least recently used first.
+    A window's upper end is open ("updated after X"), so replay serves what was recorded
+    at the time: meant for development loops, backfill tests and reloads, not live runs.
+    """
+
+    def __init__(self, config):
+        settings = config.get("cache", {})
+        self.mode = settings.get("mode", "off")
+        if self.mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unsupported cache mode: {self.mode}")
+        self.path = settings.get("path", "cache")
+        self.max_bytes = settings.get("max_size_mb", 2048) * 1024 * 1024
+        self.table = config.get("servicenow", {}).get("table", "incident")
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @staticmethod
+    def key(window):
+        """Entry name for a window description (a JSON-serialisable dict)."""
+        digest = hashlib.sha1(json.dumps(window, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return f"{window.get('table', 'table')}_{digest}"
+
+    def entry_dir(self, key):
+        return os.path.join(self.path, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.entry_dir(key), "meta.json"))
+
+    def read(self, key):
+        """Yield the entry's pages as DataFrames, memory-mapping each file."""
+        entry_dir = self.entry_dir(key)
+        with open(os.path.join(entry_dir, "meta.json"), "r") as file:
+            meta = json.load(file)
+        os.utime(entry_dir)  # Most recently used
+        print(f"Replaying {meta['rows']} cached rows ({meta['pages']} pages) from {entry_dir}")
+        for page in range(meta["pages"]):
+            path = os.path.join(entry_dir, f"page-{page:05d}.arrow")
+            with metrics.timer("cache_read", self.table, bytes=os.path.getsize(path)) as values:
+                with pa.memory_map(path, "r") as source:
+                    table = pa.ipc.open_file(source).read_all()
+                df = table.to_pandas()
+                values["rows"] = len(df)
+            yield df
+
+    def frames(self, window, fetch):
+        """Yield page DataFrames for window: replayed from disk when possible, else fetch() recorded.
+
+        fetch is a callable returning the page iterator. An extract that fails or is stopped
+        early leaves nothing behind.
+        """
+        if not self.enabled:
+            yield from fetch()
+            return
+        key = self.key(window)
+        if self.mode == "replay" and self.has(key):
+            yield from self.read(key)
+            return
+
+        tmp_dir = f"{self.entry_dir(key)}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        pages = rows = 0
+        recording = True
+        try:
+            for df in fetch():
+                if recording:
+                    try:
+                        table = pa.Table.from_pandas(df, preserve_index=False)
+                        with pa.OSFile(os.path.join(tmp_dir, f"page-{pages:05d}.arrow"), "wb") as sink:
+                            with pa.ipc.new_file(sink, table.schema) as writer:
+                                writer.write_table(table)
+                        pages += 1
+                        rows += len(df)
+                    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                        print(f"Warning: Not caching this extract, a page did not convert to Arrow: {e}")
+                        recording = False
+                yield df
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if not recording:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as file:
+            json.dump({"window": window, "pages": pages, "rows": rows, "created": time.time()}, file, indent=2, default=str)
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        os.replace(tmp_dir, self.entry_dir(key))
+        print(f"Cached {rows} rows ({pages} pages) in {self.entry_dir(key)}")
+        self.evict()
+
+    def entries(self):
+        """(key, bytes, last used, meta) of every complete entry, least recently used first."""
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for key in os.listdir(self.path):
+            entry_dir = self.entry_dir(key)
+            if not self.has(key):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            with open(os.path.join(entry_dir, "meta.json"), "r") as file:
+                meta = json.load(file)
+            entries.append((key, size, os.path.getmtime(entry_dir), meta))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size_mb."""
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        for key, size, _, _ in entries[:-1]:  # Never the entry just written
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+            print(f"Evicted cached extract {key} ({size / 1024 / 1024:.1f} MB)")
+
+if __name__ == "__main__":
+    from main import load_config
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the extract cache")
+    parser.add_argument("command", choices=["list", "clear"])
+    args = parser.parse_args()
+    cache = PageCache(load_config())
+    if args.command == "list":
+        for key, size, used, meta in cache.entries():
+            window = meta["window"]
+            print(f"{key}  {meta['rows']:>9} rows  {size / 1024 / 1024:>8.1f} MB  last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  {window.get('filter')}")
+    else:
+        shutil.rmtree(cache.path, ignore_errors=True)
+        print(f"Cleared {cache.path}")
@@ -1,19 +1,266 @@
+import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from modules.normalize import DATETIME_COLUMNS
+from modules.metrics import metrics, table_label
+
+# Low-cardinality choice and reference fields, stored dictionary-encoded
+DICTIONARY_COLUMNS = [
+    "state", "incident_state", "priority", "impact", "urgency", "severity", "category", "subcategory",
+    "contact_type", "close_code", "hold_reason", "assignment_group", "sys_domain", "company", "location",
+    "sys_class_name"
+]
+INT_COLUMNS = ["row_hash", "sys_mod_count", "reopen_count", "reassignment_count", "child_incidents", "business_stc", "calendar_stc"]
+BOOL_COLUMNS = ["active", "made_sla", "knowledge"]
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+BOOL_VALUES = pa.array(["true", "false"])
+
+def incident_schema(df):
+    """Arrow schema for an incident DataFrame: typed known columns, strings for everything else."""
+    fields = []
+    for col in df.columns:
+        if col in DATETIME_COLUMNS or "datetime" in str(df[col].dtype):
+            col_type = pa.timestamp("us")
+        elif col in INT_COLUMNS:
+            col_type = pa.int64()
+        elif col in BOOL_COLUMNS:
+            col_type = pa.bool_()
+        elif col in DICTIONARY_COLUMNS:
+            col_type = DICTIONARY_TYPE
+        else:
+            col_type = pa.string()
+        fields.append(pa.field(col, col_type))
+    return pa.schema(fields)
+
+def widen_schema(schema, df):
+    """schema plus fields (as incident_schema types them) for df's columns it lacks, or schema itself."""
+    extra = [col for col in df.columns if col not in schema.names]
+    if not extra:
+        return schema
+    return pa.schema(list(schema) + list(incident_schema(df[extra])))
+
+def warn_coerced(column, count, type_name):
+    if count:
+        print(f"Warning: {count} value(s) in column '{column}' did not parse as {type_name} and were stored as null")
+
+def to_arrow(df, schema):
+    """Convert a normalised DataFrame to an Arrow table with the given schema.
+
+    ServiceNow sends numbers and booleans as strings ("" when empty); values that do not
+    parse become nulls, like unparseable datetimes in RecordNormalizer, and are counted in
+    a warning.
+    """
+    arrays = []
+    for field in schema:
+        series = df[field.name] if field.name in df.columns else pd.Series([None] * len(df), dtype=object)
+        if pa.types.is_timestamp(field.type):
+            if not pd.api.types.is_datetime64_any_dtype(series):
+                series = pd.to_datetime(series, errors="coerce")
+            array = pa.array(series, from_pandas=True).cast(field.type)
+        elif pa.types.is_integer(field.type):
+            numbers = pd.to_numeric(series, errors="coerce")
+            if numbers.hasnans:
+                warn_coerced(field.name, int((numbers.isna() & series.notna() & (series != "")).sum()), "an integer")
+            array = pa.array(numbers.astype("Int64"), type=field.type)
+        elif pa.types.is_boolean(field.type):
+            if series.dtype == bool:
+                array = pa.array(series, type=field.type)
+            else:
+                text = pa.array(series.astype(str), type=pa.string())
+                array = pc.if_else(pc.is_in(text, value_set=BOOL_VALUES), pc.equal(text, "true"), None)
+                if array.null_count:
+                    warn_coerced(field.name, int((~series.isin(["true", "false"]) & series.notna() & (series != "")).sum()), "a boolean")
+        else:
+            try:
+                array = pa.array(series, from_pandas=True, type=pa.string())
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Unflattened dicts/lists or stray numbers: store their JSON text
+                array = pa.array(series.map(lambda v: v if v is None or isinstance(v, str) else json.dumps(v)), from_pandas=True, type=pa.string())
+            if pa.types.is_dictionary(field.type):
+                array = array.dictionary_encode()
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def widen_sample(sample_df, df):
+    """sample_df with df's columns it lacks (first row's values), so the target gets them too."""
+    sample_df = sample_df.copy()
+    for col in df.columns:
+        if col not in sample_df.columns:
+            sample_df[col] = df[col].iloc[:1].reset_index(drop=True).reindex(range(len(sample_df))).values
+    return sample_df
+
+class RollingParquetWriter:
+    """Arrow tables buffered into row groups across Parquet files of roughly target_bytes each.
+
+    part_path(n) names the n-th file and open_sink(path) opens it (a local file by default).
+    on_file(path) is called as soon as a file is closed. Used by ParquetHandler.write_rolling
+    and by the async pipeline, which encodes pages elsewhere and only writes here. A table
+    with a wider schema (columns first seen on a later page, see widen_schema) closes the
+    current file, and the files after it are written with the wider schema.
+    """
+
+    def __init__(self, schema, part_path, writer_options, row_group_rows, target_bytes=None, on_file=None, open_sink=None, table="incident"):
+        self.schema = schema
+        self.part_path = part_path
+        self.writer_options = writer_options
+        self.row_group_rows = row_group_rows
+        self.target_bytes = target_bytes
+        self.on_file = on_file
+        self.open_sink = open_sink or (lambda path: pa.OSFile(path, "wb"))
+        self.writer = None
+        self.sink = None
+        self.path = None
+        self.paths = []
+        self.pending = []
+        self.pending_rows = 0
+        self.rows = 0
+        self.file_rows = 0
+        self.table = table  # Metrics label
+
+    def _close_file(self):
+        with metrics.timer("parquet_close", self.table, rows=self.file_rows) as values:
+            self.writer.close()
+            values["bytes"] = self.sink.tell()  # Size of the finished file
+            self.sink.close()
+        self.writer = None
+        self.file_rows = 0
+        self.paths.append(self.path)
+        if self.on_file:
+            self.on_file(self.path)
+        return self.path
+
+    def _write_group(self, table):
+        """Write one row group; returns the path of the file it closed, if any."""
+        if self.writer is None:
+            self.path = self.part_path(len(self.paths))
+            self.sink = self.open_sink(self.path)
+            self.writer = pq.ParquetWriter(self.sink, self.schema, **self.writer_options)
+        with metrics.timer("parquet_encode", self.table, rows=table.num_rows):
+            self.writer.write_table(table, row_group_size=self.row_group_rows)
+        self.rows += table.num_rows
+        self.file_rows += table.num_rows
+        if self.target_bytes and self.sink.tell() >= self.target_bytes:
+            return self._close_file()
+        return None
+
+    def write(self, table):
+        """Buffer table and write every full row group; returns the paths of files closed meanwhile."""
+        closed = []
+        if table.schema != self.schema:
+            extra = [name for name in table.schema.names if name not in self.schema.names]
+            print(f"New column(s) {extra}: closing the current Parquet file and continuing with the wider schema")
+            closed = self.close()
+            self.schema = table.schema
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        while self.pending_rows >= self.row_group_rows:
+            table = pa.concat_tables(self.pending)
+            closed.append(self._write_group(table.slice(0, self.row_group_rows)))
+            rest = table.slice(self.row_group_rows)
+            self.pending, self.pending_rows = ([rest] if rest.num_rows else []), rest.num_rows
+        return [path for path in closed if path]
+
+    def close(self):
+        """Write what is buffered and close the current file; returns the paths closed."""
+        closed = []
+        if self.pending:
+            closed.append(self._write_group(pa.concat_tables(self.pending)))
+            self.pending, self.pending_rows = [], 0
+        if self.writer is not None:
+            closed.append(self._close_file())
+        return [path for path in closed if path]
+
+    def abort(self):
+        """Discard the file being written (aborting the sink if it supports it)."""
+        if self.writer is None:
+            return
+        if hasattr(self.sink, "abort"):
+            self.sink.abort()
+        else:
+            self.writer.close()
+            self.sink.close()
+        self.writer = None
 
 class ParquetHandler:
-    def __init__(self):
-        pass
+    def __init__(self, config=None):
+        parquet_config = (config or {}).get("parquet", {})
+        self.compression = parquet_config.get("compression", "zstd")
+        self.compression_level = parquet_config.get("compression_level", 3)
+        self.row_group_rows = parquet_config.get("row_group_rows", 100000)  # Pages are buffered up to this many rows
+        self.table = table_label(config)
+
+    def writer_options(self):
+        """Keyword arguments shared by every Parquet write."""
+        return {"compression": self.compression, "compression_level": self.compression_level}
 
     def save_to_parquet(self, df, local_file):
         """Save DataFrame to a Parquet file."""
         try:
-            df.to_parquet(local_file, engine="pyarrow", index=False)
+            table = to_arrow(df, incident_schema(df))
+            pq.write_table(table, local_file, row_group_size=self.row_group_rows, **self.writer_options())
             print(f"Saved {len(df)} tickets to Parquet file: {local_file}")
             return df
         except Exception as e:
             print(f"Error saving to Parquet: {e}")
             raise
 
+    def write_stream(self, frames, local_file):
+        """Append the DataFrames in frames to local_file, buffered into row groups of row_group_rows.
+
+        The file schema is taken from the first frame; later frames are aligned to it, and
+        columns they add start a new file (see RollingParquetWriter).
+        Returns the number of rows written and a one-row sample of the first frame.
+        """
+        rows, sample_df, _ = self.write_rolling(frames, lambda part: local_file)
+        return rows, sample_df
+
+    def open_rolling(self, schema, part_path, target_bytes=None, on_file=None, open_sink=None):
+        """RollingParquetWriter for schema using this handler's compression and row group size."""
+        return RollingParquetWriter(
+            schema, part_path, self.writer_options(), self.row_group_rows,
+            target_bytes=target_bytes, on_file=on_file, open_sink=open_sink, table=self.table
+        )
+
+    def write_rolling(self, frames, part_path, target_bytes=None, on_file=None, open_sink=None):
+        """Write frames as row groups across files of roughly target_bytes each.
+
+        part_path(n) names the n-th file. on_file(path) is called as soon as a file is closed,
+        so it can be uploaded while later frames are still being fetched. Frames are buffered
+        (or split) into row groups of row_group_rows, so even one big DataFrame rolls over.
+        open_sink(path) replaces the local file with another writable sink (e.g.
+        S3Uploader.open_multipart); a sink with abort() is aborted rather than closed if
+        writing fails. Returns (rows written, one-row sample of the first frame with every
+        column written, list of file paths).
+        """
+        writer = None
+        sample_df = None
+        try:
+            for df in frames:
+                if df.empty:
+                    continue
+                if writer is None:
+                    writer = self.open_rolling(incident_schema(df), part_path, target_bytes, on_file, open_sink)
+                    sample_df = df.head(1)
+                schema = widen_schema(writer.schema, df)
+                if schema is not writer.schema:
+                    sample_df = widen_sample(sample_df, df)
+                with metrics.timer("arrow_convert", self.table, rows=len(df)):
+                    table = to_arrow(df, schema)
+                writer.write(table)
+            if writer is None:
+                return 0, None, []
+            writer.close()
+            if writer.paths:
+                print(f"Saved {writer.rows} tickets to {len(writer.paths)} Parquet file(s): {', '.join(writer.paths)}")
+            return writer.rows, sample_df, writer.paths
+        except Exception as e:
+            print(f"Error saving to Parquet: {e}")
+            if writer is not None:
+                writer.abort()
+            raise
+
     def run(self, df, local_file):
         """Run the Parquet saving process."""
         return self.save_to_parquet(df, local_file)
@@ -22,4 +269,4 @@ if __name__ == "__main__":
     # Test the class
     df = pd.DataFrame({"ticket_number": ["INC001"], "short_description": ["Test"]})
     handler = ParquetHandler()
-    handler.run(df, "test.parquet")
\ No newline at end of file
+    handler.run(df, "test.parquet")
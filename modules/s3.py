@@ -1,24 +1,213 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from modules.metrics import metrics, table_label
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB  # S3 rejects smaller parts except the last one
+
+class S3MultipartWriter:
+    """Write-only file object that streams into an S3 multipart upload.
+
+    Bytes are buffered until a part is full and then uploaded in the background.
+    At most max_inflight parts are queued, so memory stays within about
+    (max_inflight + 1) * part_size. close() completes the upload; abort() or any
+    failure aborts it so no orphaned parts are left behind.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=16 * MB, max_inflight=4, table="incident"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.position = 0
+        self.parts = []
+        self.closed = False
+        self.aborted = False
+        self.table = table  # Metrics label
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight)
+        self.upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        """Buffer data and upload every full part."""
+        if self.aborted:
+            return len(data)  # e.g. the Parquet footer written when its writer is released after a failure
+        if self.closed:
+            raise ValueError(f"Write to closed multipart upload s3://{self.bucket}/{self.key}")
+        try:
+            self.buffer += data
+            self.position += len(data)
+            while len(self.buffer) >= self.part_size:
+                self._submit_part(bytes(self.buffer[:self.part_size]))
+                del self.buffer[:self.part_size]
+        except Exception:
+            self.abort()
+            raise
+        return len(data)
+
+    def _submit_part(self, body):
+        for future in self.parts:
+            if future.done() and future.exception() is not None:
+                raise future.exception()  # Fail fast instead of buffering more data
+        self.slots.acquire()  # Blocks the writer while max_inflight parts are still uploading
+        self.parts.append(self.executor.submit(self._upload_part, len(self.parts) + 1, body))
+
+    def _upload_part(self, number, body):
+        try:
+            with metrics.timer("s3_upload", self.table, bytes=len(body)):
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+                )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Upload the remaining bytes and complete the multipart upload."""
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.parts:
+                self._submit_part(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self.parts]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts}
+            )
+            self.closed = True
+            self.executor.shutdown(wait=True)
+            print(f"Streamed {self.position} bytes in {len(parts)} part(s) to s3://{self.bucket}/{self.key}")
+        except Exception as e:
+            print(f"Error completing multipart upload to s3://{self.bucket}/{self.key}: {e}")
+            self.abort()
+            raise
+
+    def abort(self):
+        """Abort the multipart upload and discard any uploaded parts."""
+        if self.closed:
+            return
+        self.closed = True
+        self.aborted = True
+        self.buffer = bytearray()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            print(f"Aborted multipart upload to s3://{self.bucket}/{self.key}")
+        except Exception as e:
+            print(f"Error aborting multipart upload to s3://{self.bucket}/{self.key}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def make_s3_client(config, max_pool_connections=None):
+    """boto3 S3 client for the s3 section of config.
+
+    boto3 clients are thread-safe, so one client (with max_pool_connections sized for
+    every thread using it) can be shared by several uploaders.
+    """
+    s3_config = config["s3"]
+    return boto3.client(
+        "s3",
+        region_name=s3_config["region"],
+        endpoint_url=s3_config.get("endpoint_url"),  # e.g. a local MinIO for testing
+        aws_access_key_id=s3_config.get("aws_access_key_id", os.getenv("AWS_ACCESS_KEY_ID")),
+        aws_secret_access_key=s3_config.get("aws_secret_access_key", os.getenv("AWS_SECRET_ACCESS_KEY")),
+        config=Config(max_pool_connections=max_pool_connections) if max_pool_connections else None
+    )
 
 class S3Uploader:
-    def __init__(self, config):
-        self.s3_client = boto3.client(
-            "s3",
-            region_name=config["s3"]["region"],
-            aws_access_key_id=config["s3"]["aws_access_key_id"],
-            aws_secret_access_key=config["s3"]["aws_secret_access_key"]
+    def __init__(self, config, s3_client=None):
+        s3_config = config["s3"]
+        self.s3_client = s3_client or make_s3_client(config)
+        self.bucket = s3_config["bucket"]
+        self.prefix = s3_config.get("prefix", "")
+        self.table_prefix = s3_config.get("table_prefix", "")  # e.g. "change_request/" when several tables share the prefix
+        self.table = table_label(config)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=s3_config.get("multipart_threshold_mb", 16) * MB,
+            multipart_chunksize=s3_config.get("multipart_chunksize_mb", 16) * MB,
+            max_concurrency=s3_config.get("max_concurrency", 8)  # Parallel part uploads per file
         )
-        self.bucket = config["s3"]["bucket"]
+        self.max_concurrency = s3_config.get("max_concurrency", 8)
+        self.upload_workers = s3_config.get("upload_workers", 4)  # Files uploading at the same time
+        self._executor = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def run_prefix(self, timestamp, run_date=None):
+        """Key prefix for one run's files: <prefix><table_prefix>dt=YYYY-MM-DD/run_<timestamp>/."""
+        run_date = run_date or datetime.now().strftime("%Y-%m-%d")
+        return f"{self.prefix}{self.table_prefix}dt={run_date}/run_{timestamp}/"
 
     def upload_to_s3(self, local_file, s3_key):
         """Upload Parquet file to S3."""
         try:
-            self.s3_client.upload_file(local_file, self.bucket, s3_key)
+            with metrics.timer("s3_upload", self.table, bytes=os.path.getsize(local_file)):
+                self.s3_client.upload_file(local_file, self.bucket, s3_key, Config=self.transfer_config)
             print(f"Uploaded Parquet file to s3://{self.bucket}/{s3_key}")
         except Exception as e:
             print(f"Error uploading to S3: {e}")
             raise
 
+    def open_multipart(self, s3_key):
+        """Open an S3MultipartWriter on s3_key; Parquet can be written to it without a local file."""
+        return S3MultipartWriter(
+            self.s3_client, self.bucket, s3_key,
+            part_size=self.transfer_config.multipart_chunksize,
+            max_inflight=self.max_concurrency, table=self.table
+        )
+
+    def _upload_and_remove(self, local_file, s3_key, remove):
+        self.upload_to_s3(local_file, s3_key)
+        if remove:
+            os.remove(local_file)
+        return s3_key
+
+    def submit(self, local_file, s3_key, remove=False):
+        """Start uploading local_file in the background; the caller keeps producing files meanwhile."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.upload_workers)
+            future = self._executor.submit(self._upload_and_remove, local_file, s3_key, remove)
+            self._futures.append(future)
+        return future
+
+    def wait(self):
+        """Wait for every submitted upload and return their keys in submission order.
+
+        Raises the first upload error after all uploads have finished.
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+        return [f.result() for f in futures]
+
     def run(self, local_file, s3_key):
         """Run the S3 upload process."""
         self.upload_to_s3(local_file, s3_key)
@@ -34,4 +223,4 @@ if __name__ == "__main__":
         }
     }
     uploader = S3Uploader(config)
-    uploader.run("test.parquet", "tickets/test.parquet")
\ No newline at end of file
+    uploader.run("test.parquet", "tickets/test.parquet")
@@ -1,11 +1,22 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from main import main
+from datetime import datetime
+from main import load_config, main
+from modules.engine import run_tables
+from modules.cdc import run_cdc
+from modules.connections import close_all
 
 def run_scheduled_job():
     """Run the main pipeline on a schedule."""
     print(f"Starting scheduled job at {datetime.now()}")
     try:
-        main()
+        # Snowflake connections and DDL checks are pooled per process, so later runs reuse them
+        config = load_config()
+        if config.get("cdc", {}).get("enabled"):
+            run_cdc()  # Field-level changes from sys_audit instead of whole rows
+        elif config.get("engine", {}).get("enabled") and config.get("tables"):
+            run_tables()  # Every configured table, sharing connection pools and one request budget
+        else:
+            main()
         print("Scheduled job completed successfully")
     except Exception as e:
         print(f"Scheduled job failed: {e}")
@@ -15,7 +26,10 @@ def schedule_pipeline():
     scheduler = BlockingScheduler(timezone="Asia/Kolkata")
     scheduler.add_job(run_scheduled_job, 'cron', hour=22, minute=0)
     print("Scheduler started. Running daily at 10 PM IST...")
-    scheduler.start()
+    try:
+        scheduler.start()
+    finally:
+        close_all()
 
 if __name__ == "__main__":
     schedule_pipeline()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import threading
+from modules.normalize import ROW_HASH_COLUMN
+
+PRUNE_COLUMNS = ("sys_created_on",)  # Set once at insert, so the MERGE can bound its target scan on them
+
+class SchemaRegistry:
+    """Per-process cache of the target table's columns and of the SQL generated per extract schema.
+
+    An extract schema is the ordered list of (column, Snowflake type) pairs written to Parquet,
+    identified by a fingerprint. The first load with a new fingerprint adds any columns the
+    target is missing (ALTER TABLE ADD COLUMN) and builds its temp-table DDL, COPY select
+    and MERGE once; later loads with the same fingerprint reuse them without metadata calls.
+    """
+
+    def __init__(self, target_table, temp_table, cluster_column=None, primary_key="number", watermark_column="sys_updated_on"):
+        self.target_table = target_table
+        self.temp_table = temp_table
+        self.cluster_column = cluster_column
+        self.primary_key = primary_key
+        self.watermark_column = watermark_column  # Orders versions of a row: the latest one wins
+        self.columns = None  # Target column name -> Snowflake type, read once per process
+        self.synced = set()
+        self.sql = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(column_types):
+        """Stable identifier of an ordered (column, type) list."""
+        return hashlib.sha1(json.dumps(column_types).encode("utf-8")).hexdigest()[:16]
+
+    def load_columns(self, cursor):
+        """Read the target table's columns with DESCRIBE TABLE."""
+        cursor.execute(f"DESCRIBE TABLE {self.target_table}")
+        self.columns = {row[0]: row[1] for row in cursor.fetchall()}
+        return self.columns
+
+    def sync(self, cursor, column_types):
+        """Add target columns missing for this extract schema; returns the added column names.
+
+        Existing columns keep their type even if the extract's type differs (no ALTER ... TYPE).
+        """
+        fingerprint = self.fingerprint(column_types)
+        with self.lock:
+            if fingerprint in self.synced:
+                return []
+        if self.columns is None:
+            self.load_columns(cursor)
+        missing = [(col, col_type) for col, col_type in column_types if col not in self.columns]
+        for col, col_type in missing:
+            cursor.execute(f'ALTER TABLE {self.target_table} ADD COLUMN IF NOT EXISTS "{col}" {col_type}')
+            self.columns[col] = col_type
+        if missing:
+            print(f"Added columns to {self.target_table}: {[col for col, _ in missing]}")
+        with self.lock:
+            self.synced.add(fingerprint)
+        return [col for col, _ in missing]
+
+    def statements(self, column_types):
+        """Return the cached temp-table DDL, COPY select, staging stats query and MERGE template."""
+        fingerprint = self.fingerprint(column_types)
+        with self.lock:
+            if fingerprint in self.sql:
+                return self.sql[fingerprint]
+
+        column_names = [col for col, _ in column_types]
+        all_columns = [f'"{col}"' for col in column_names]
+        key = f'"{self.primary_key}"'
+        watermark = f'"{self.watermark_column}"'
+        update_sets = ', '.join([f'target.{col} = source.{col}' for col in all_columns if col != key])  # Update all except PK
+        insert_columns = ', '.join(all_columns)
+        insert_values = ', '.join([f'source.{col}' for col in all_columns])
+
+        # A mutable column could have moved below the staged minimum since the row was loaded
+        cluster_column = self.cluster_column if self.cluster_column in column_names and self.cluster_column in PRUNE_COLUMNS else None
+        cluster_sql = f'MIN("{cluster_column}"), COUNT(*) - COUNT("{cluster_column}")' if cluster_column else "NULL, 0"
+        watermark_sql = ", ".join(f'MAX("{col}")' if col in column_names else "NULL" for col in (self.watermark_column, "sys_created_on"))
+        matched_conditions = []
+        if self.watermark_column in column_names:
+            matched_conditions.append(f'(target.{watermark} IS NULL OR source.{watermark} >= target.{watermark})')
+        if ROW_HASH_COLUMN in column_names:
+            matched_conditions.append(f'target."{ROW_HASH_COLUMN}" IS DISTINCT FROM source."{ROW_HASH_COLUMN}"')
+        matched_sql = f"AND {' AND '.join(matched_conditions)}" if matched_conditions else ""
+
+        statements = {
+            "fingerprint": fingerprint,
+            "columns": column_names,
+            "cluster_column": cluster_column,
+            "create_temp": f"CREATE OR REPLACE TEMPORARY TABLE {self.temp_table} ({', '.join(f'{col} {col_type}' for col, (_, col_type) in zip(all_columns, column_types))})",
+            # The Parquet columns are already typed, so each cast is a no-op
+            "copy_select": ', '.join(f'$1:"{col}"::{col_type} AS "{col}"' for col, col_type in column_types),
+            # One pass over the (small) temp table for the counts and the pruning bound
+            "stats": f'SELECT COUNT(*), COUNT(DISTINCT {key}), {cluster_sql}, {watermark_sql} FROM {self.temp_table}',
+            "key": key,
+            # ON_CLAUSE is filled per load with the pruning bound
+            "merge": f"""
+        MERGE INTO {self.target_table} AS target
+        USING (
+            SELECT * FROM {self.temp_table}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY {watermark} DESC) = 1
+        ) AS source
+        ON ON_CLAUSE
+        WHEN MATCHED {matched_sql} THEN
+            UPDATE SET {update_sets}
+        WHEN NOT MATCHED THEN
+            INSERT ({insert_columns})
+            VALUES ({insert_values});
+        """
+        }
+        with self.lock:
+            self.sql[fingerprint] = statements
+        return statements
+
+    def forget(self):
+        """Drop the cached target columns (e.g. after a failed load), keeping generated SQL."""
+        with self.lock:
+            self.columns = None
+            self.synced.clear()
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_registry(config, temp_table):
+    """Return the process-wide registry for the target table in config."""
+    sf_config = config["snowflake"]
+    target_table = f"{sf_config['database']}.{sf_config['schema']}.{sf_config['table']}"
+    with _registries_lock:
+        if target_table not in _registries:
+            cluster_column = sf_config.get("cluster_column", "sys_created_on")
+            if cluster_column and cluster_column not in PRUNE_COLUMNS:
+                print(f"Warning: cluster_column '{cluster_column}' of {target_table} can change after insert; the MERGE will not prune on it")
+            _registries[target_table] = SchemaRegistry(
+                target_table, temp_table,
+                cluster_column=cluster_column,
+                primary_key=sf_config.get("primary_key", "number"),
+                watermark_column=sf_config.get("watermark_column", "sys_updated_on")
+            )
+        return _registries[target_table]
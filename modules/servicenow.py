@@ -1,90 +1,239 @@
-import requests
 import pandas as pd
 from datetime import datetime
+from modules.decoders import KeyDecoder, get_decoder
+from modules.metrics import metrics
+from modules.page_cache import PageCache
+from modules.normalize import RecordNormalizer, TIMESTAMP_FORMAT
+from modules.normalize_pool import get_pool
+from modules.transport import get_session
 
 class ServiceNowClient:
-    def __init__(self, config, password):
+    def __init__(self, config, password, session=None):
         self.config = config
         self.password = password
-        self.base_url = config["servicenow"]["url"].format(instance=config["servicenow"]["instance"])
-        self.session = requests.Session()
+        self.table = config["servicenow"].get("table", "incident")
+        self.base_url = config["servicenow"]["url"].format(instance=config["servicenow"]["instance"], table=self.table)
+        self.primary_key = config["servicenow"].get("primary_key", "number")
+        self.watermark_column = config["servicenow"].get("watermark_column", "sys_updated_on")  # Incremental filter and keyset order
+        self.page_size = config["servicenow"].get("page_size", 1000)  # Batch size for pagination
+        self.pagination = config["servicenow"].get("pagination", "offset")  # "offset" or "keyset"
+        if self.pagination not in ("offset", "keyset"):
+            raise ValueError(f"Unsupported pagination mode: {self.pagination}")
+        self.fields = list(config["servicenow"].get("fields") or [])  # Server-side column projection
+        if self.fields:
+            # Keyset paging and the Snowflake MERGE need these whatever the projection
+            self.fields += [f for f in ("sys_id", self.primary_key, self.watermark_column) if f not in self.fields]
+        self.query = config["servicenow"].get("query")  # Encoded query AND'ed onto every request, e.g. "tablename=incident"
+        self.exclude_reference_link = config["servicenow"].get("exclude_reference_link", False)
+        self.display_value = config["servicenow"].get("display_value")  # "true", "false" or "all"
+        ordered = self.pagination == "keyset" or config["servicenow"].get("parallel", {}).get("enabled")
+        if ordered and self.display_value is not None and str(self.display_value).lower() != "false":
+            # Keyset cursors and time slices parse the raw "YYYY-MM-DD HH:MM:SS" watermark, not a localised display value
+            raise ValueError(f"display_value must be \"false\" with keyset pagination or parallel extraction, got {self.display_value!r}")
+        self.decoder = get_decoder(config["servicenow"].get("decoder", "json"), self.fields)
+        self.key_decoder = KeyDecoder(self.watermark_column, self.decoder)  # Raw pages are decoded in full by a NormalizePool
+        self.normalizer = RecordNormalizer(
+            config["servicenow"].get("reference_fields"),  # Detected from the first page when not configured
+            debug_types=config["servicenow"].get("debug_types", False)
+        )
+        self.normalize_pool = get_pool(config)  # Worker processes when servicenow.normalize_processes is set
+        self.cache = PageCache(config)  # Off unless cache.mode is "record" or "replay"
+        self.owns_session = session is None  # A shared session (see TableEngine) is closed by its owner
+        self.session = session or get_session(config)  # Timeouts, retries with backoff, shared rate limit
         self.session.auth = (config["servicenow"]["username"], password)
         self.session.headers.update({"Accept": "application/json"})
 
-    def fetch_tickets(self, latest_created_on=None, latest_updated_on=None):
-        """Fetch tickets from ServiceNow, including new and updated ones, with pagination."""
-        try:
-            all_data = []
-            offset = 0
-            limit = 1000  # Batch size for pagination; adjust as needed
-            while True:
-                params = {
-                    "sysparm_query": "ORDERBYDESCsys_updated_on",  # Order by update time
-                    "sysparm_limit": limit,
-                    "sysparm_offset": offset
-                }
-
-                query_parts = []
-                if latest_created_on:
-                    timestamp_str = latest_created_on.strftime("%Y-%m-%d %H:%M:%S")
-                    query_parts.append(f"sys_created_on>{timestamp_str}")  # New tickets
-                if latest_updated_on:
-                    timestamp_str = latest_updated_on.strftime("%Y-%m-%d %H:%M:%S")
-                    query_parts.append(f"sys_updated_on>{timestamp_str}")  # Updated tickets
-
-                if query_parts:
-                    params["sysparm_query"] += "^" + "^OR".join(query_parts)  # Combine with OR
-
+    def build_filter(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Build the incremental part of the encoded query (new or updated tickets).
+
+        With a start_key (the (watermark, sys_id) of the last committed row) the window starts
+        at that second inclusively and the whole second is fetched again: a ticket updated
+        later in that second keeps its sys_id, so it could sort before the last key. Rows
+        the local store recorded as extracted unchanged are dropped after fetching (see
+        drop_extracted); the MERGE skips any others the last run already loaded.
+        """
+        if start_key is not None:
+            return self.with_query(f"{self.watermark_column}>={start_key[0]}")
+        query_parts = []
+        if latest_created_on:
+            timestamp_str = latest_created_on.strftime(TIMESTAMP_FORMAT)
+            query_parts.append(f"sys_created_on>{timestamp_str}")  # New tickets
+        if latest_updated_on:
+            timestamp_str = latest_updated_on.strftime(TIMESTAMP_FORMAT)
+            query_parts.append(f"{self.watermark_column}>{timestamp_str}")  # Updated tickets
+        return self.with_query("^OR".join(query_parts))  # Combine with OR
+
+    def with_query(self, filter_query):
+        """AND the configured query onto filter_query (^OR binds tighter than ^, so an OR'd filter stays grouped)."""
+        if not self.query:
+            return filter_query
+        return f"{self.query}^{filter_query}" if filter_query else self.query
+
+    def projection_params(self):
+        """Request parameters controlling which columns come back and how references are rendered."""
+        params = {}
+        if self.fields:
+            params["sysparm_fields"] = ",".join(self.fields)
+        if self.exclude_reference_link:
+            params["sysparm_exclude_reference_link"] = "true"  # References come back as plain sys_id strings
+        if self.display_value is not None:
+            params["sysparm_display_value"] = str(self.display_value).lower()
+        return params
+
+    def page_params(self, filter_query="", offset=0, last_key=None):
+        """Build the request parameters for one page.
+
+        Offset mode walks the result set with sysparm_offset. Keyset mode orders by
+        (watermark column, sys_id) and asks for rows strictly after last_key, so the
+        instance can seek straight to the next page instead of skipping offset rows.
+        """
+        if self.pagination == "offset":
+            query = f"ORDERBYDESC{self.watermark_column}"  # Order by update time
+            if filter_query:
+                query += "^" + filter_query
+            return {
+                "sysparm_query": query,
+                "sysparm_limit": self.page_size,
+                "sysparm_offset": offset,
+                **self.projection_params()
+            }
+
+        order_by = f"ORDERBY{self.watermark_column}^ORDERBYsys_id"
+        prefix = f"{filter_query}^" if filter_query else ""
+        if last_key is None:
+            query = prefix + order_by
+        else:
+            # (watermark, sys_id) > last_key, expanded as two OR'd query blocks
+            last_updated_on, last_sys_id = last_key
+            query = (
+                f"{prefix}{self.watermark_column}>{last_updated_on}"
+                f"^NQ{prefix}{self.watermark_column}={last_updated_on}^sys_id>{last_sys_id}"
+                f"^{order_by}"
+            )
+        return {
+            "sysparm_query": query,
+            "sysparm_limit": self.page_size,
+            **self.projection_params()
+        }
+
+    def fetch_boundary(self, filter_query="", latest=False):
+        """Return the earliest (or latest) watermark string matching the filter, or None."""
+        order_by = f"ORDERBYDESC{self.watermark_column}" if latest else f"ORDERBY{self.watermark_column}"
+        params = {
+            "sysparm_query": f"{filter_query}^{order_by}" if filter_query else order_by,
+            "sysparm_fields": self.watermark_column,
+            "sysparm_limit": 1
+        }
+        response = self.session.get(self.base_url, params=params)
+        response.raise_for_status()
+        result = response.json().get("result", [])
+        return result[0][self.watermark_column] if result else None
+
+    def iter_pages(self, latest_created_on=None, latest_updated_on=None, slice_filter=None, start_key=None, raw=False):
+        """Yield raw result pages (lists of ticket dicts, or a ColumnBatch) from the Table API.
+
+        slice_filter is AND'ed onto the incremental filter to restrict the run to one partition.
+        With raw, each page comes as (response body, keys), for a NormalizePool: only each
+        record's watermark and sys_id are decoded here (see KeyDecoder).
+        """
+        filter_query = self.build_filter(latest_created_on, latest_updated_on, start_key)
+        if slice_filter:
+            filter_query = f"{filter_query}^{slice_filter}" if filter_query else slice_filter
+        offset = 0
+        last_key = None  # Even after a start_key: the filter already seeks to (watermark, "") of its second
+        self.checkpoint = last_key  # Key of the last page fully fetched; a failed run can restart from it
+        while True:
+            params = self.page_params(filter_query, offset=offset, last_key=last_key)
+            with metrics.timer("fetch", self.table) as page:  # Includes retries and rate-limit waits
                 response = self.session.get(self.base_url, params=params)
                 response.raise_for_status()
-                batch_data = response.json().get("result", [])
-                if not batch_data:
-                    break  # No more records
-
-                all_data.extend(batch_data)
-                offset += limit
-                print(f"Fetched batch of {len(batch_data)} tickets (total so far: {len(all_data)})")
+                page["bytes"] = len(response.content)
+            with metrics.timer("decode", self.table) as page:
+                batch_data = (self.key_decoder if raw else self.decoder).decode(response.content)
+                page["rows"] = len(batch_data)
+            if not batch_data:
+                break  # No more records
+
+            yield (response.content, batch_data) if raw else batch_data
+            offset += self.page_size
+            last_record = batch_data[-1]
+            last_key = (last_record[self.watermark_column], last_record["sys_id"]) if self.pagination == "keyset" else None
+            self.checkpoint = last_key
+
+    def cache_window(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """What identifies an extract in the page cache: instance, table, query window and projection."""
+        return {
+            "instance": self.config["servicenow"]["instance"],
+            "table": self.table,
+            "filter": self.build_filter(latest_created_on, latest_updated_on, start_key),
+            "start_key": list(start_key) if start_key else None,
+            "fields": self.fields,
+            "display_value": self.display_value,
+            "exclude_reference_link": self.exclude_reference_link
+        }
+
+    def iter_frames(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Yield one normalised DataFrame per page, from ServiceNow or the page cache."""
+        try:
+            yield from self.cache.frames(
+                self.cache_window(latest_created_on, latest_updated_on, start_key),
+                lambda: self.fetch_frames(latest_created_on, latest_updated_on, start_key)
+            )
+        finally:
+            self.close()
 
-            if not all_data:
+    def fetch_frames(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Yield one normalised DataFrame per fetched page, so memory is bounded by the page size."""
+        try:
+            counts = {"total": 0}
+            pages = self.iter_pages(latest_created_on, latest_updated_on, start_key=start_key, raw=self.normalize_pool.enabled)
+            for df in self.page_frames(self.counted(pages, counts), self.normalize_pool):
+                if not df.empty:
+                    yield df
+            total = counts["total"]
+
+            if not total:
                 print("No new or updated tickets found from ServiceNow")
-                return pd.DataFrame()
-
-            # Convert to DataFrame
-            df = pd.DataFrame(all_data)
-
-            # Dynamically preprocess any column containing dictionaries (extract sys_id)
-            for col in df.columns:
-                if df[col].apply(lambda x: isinstance(x, dict)).any():
-                    print(f"Warning: Found dict in column '{col}', will convert to sys_id string")
-                    df[col] = df[col].apply(lambda x: x.get("sys_id", "") if isinstance(x, dict) else (x if isinstance(x, str) else ""))
-
-                # Debug: Check types after conversion
-                types = df[col].apply(type).value_counts()
-                print(f"Column '{col}' types after preprocessing: {types}")
-
-            # Parse datetime fields
-            datetime_cols = ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]
-            for col in datetime_cols:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors="coerce")
-
-            # Final check for any remaining dictionaries
-            for col in df.columns:
-                if df[col].apply(lambda x: isinstance(x, dict)).any():
-                    print(f"Error: Column '{col}' still contains dictionaries after preprocessing")
-                    raise ValueError(f"Column '{col}' contains unhandled dictionary values")
-
-            print(f"Retrieved {len(df)} tickets from ServiceNow (new/updated)")
-            return df
 
         except Exception as e:
-            print(f"Error fetching tickets from ServiceNow: {e}")
+            checkpoint = getattr(self, "checkpoint", None)
+            print(f"Error fetching tickets from ServiceNow: {e}" + (f" (last complete page ended at {checkpoint})" if checkpoint else ""))
             raise
 
-        finally:
+    def counted(self, pages, counts):
+        """Pass pages through, printing the running total of tickets fetched."""
+        for page in pages:
+            records = page[1] if isinstance(page, tuple) else page
+            counts["total"] += len(records)
+            print(f"Fetched batch of {len(records)} tickets (total so far: {counts['total']})")
+            yield page
+
+    def page_frames(self, pages, pool):
+        """Normalised DataFrames for pages, in this thread or, when pool is enabled, in its worker processes."""
+        if pool.enabled:
+            return pool.map(pages, self)
+        return (self.build_dataframe(batch_data) for batch_data in pages)
+
+    def fetch_tickets(self, latest_created_on=None, latest_updated_on=None, start_key=None):
+        """Fetch tickets from ServiceNow, including new and updated ones, with pagination."""
+        frames = list(self.iter_frames(latest_created_on, latest_updated_on, start_key))
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        print(f"Retrieved {len(df)} tickets from ServiceNow (new/updated)")
+        return df
+
+    def build_dataframe(self, records):
+        """Convert a page of tickets into a DataFrame with flattened references and parsed datetimes."""
+        with metrics.timer("normalize", self.table, rows=len(records)):
+            return self.normalizer.normalize(records)
+
+    def close(self):
+        """Close the HTTP session unless it is shared."""
+        if getattr(self, "owns_session", False):
             self.session.close()
 
     def __del__(self):
         """Ensure session is closed."""
-        if hasattr(self, "session"):
-            self.session.close()
+        self.close()
@@ -2,93 +2,133 @@ import snowflake.connector
 import pandas as pd
 from datetime import datetime
 import os
+import re
+from modules.state import PipelineState
+from modules.connections import get_provider
+from modules.schema_registry import get_registry
+from modules.parquet import incident_schema
+from modules.metrics import metrics, table_label
+from modules.normalize import ROW_HASH_COLUMN
+import pyarrow as pa
+
+TEMP_TABLE = "temp_incident_load"
+COPY_FILES_LIMIT = 1000  # Maximum file names in one COPY ... FILES = (...)
+BACKLOG_PATTERN = ".*[.]parquet"
+CHANGES_TABLE = "temp_incident_changes"
+# Change-log columns written by modules.cdc: one changed field (op "U") or a deletion (op "D") per row
+CHANGE_COLUMNS = [("sys_id", "STRING"), ("field", "STRING"), ("value", "STRING"), ("sys_mod_count", "NUMBER"), ("changed_at", "TIMESTAMP_NTZ"), ("op", "STRING")]
+SOFT_DELETE_COLUMNS = [("is_deleted", "BOOLEAN"), ("deleted_at", "TIMESTAMP_NTZ")]
+
+def snowflake_type(arrow_type):
+    """Snowflake column type for an Arrow type from the incident Parquet schema."""
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP_NTZ"
+    if pa.types.is_integer(arrow_type):
+        return "NUMBER"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOLEAN"
+    return "STRING"  # Plain and dictionary-encoded strings
 
 class SnowflakeLoader:
-    def __init__(self, config):
+    def __init__(self, config, provider=None):
         self.config = config
-        self.snowflake_password = os.getenv("SNOWFLAKE_PASSWORD")
-        if not self.snowflake_password:
-            raise ValueError("SNOWFLAKE_PASSWORD not found in .env file")
-        self.conn = self.connect_raw()  # Establish connection once in init for reuse
+        self.provider = provider or get_provider(config)  # Shared per process, so runs reuse the login
+        self.conn = self.connect_raw()  # Borrow a connection once in init for reuse
+        self.registry = get_registry(config, TEMP_TABLE)  # Target columns and generated SQL, cached per process
+        self.failed_files = []
+        self.table = table_label(config)  # Metrics label
+        self.state = PipelineState(
+            self.conn,
+            table=f"{config['snowflake']['database']}.{config['snowflake']['schema']}.{config['snowflake'].get('state_table', 'pipeline_state')}",
+            pipeline=config["snowflake"]["table"]
+        )
 
     def connect_raw(self):
-        """Create a raw Snowflake connection (no DictCursor for simplicity)."""
-        conn = snowflake.connector.connect(
-            user=self.config["snowflake"]["user"],
-            password=self.snowflake_password,
-            account=self.config["snowflake"]["account"],
-            warehouse=self.config["snowflake"]["warehouse"],
-            database=self.config["snowflake"]["database"],
-            schema=self.config["snowflake"]["schema"]
-        )
-        print("Snowflake raw connection established")
-        return conn
+        """Borrow a raw Snowflake connection from the pool (opened on first use)."""
+        return self.provider.acquire()
 
-    def get_latest_created_on(self):
-        """Get the latest sys_created_on timestamp from Snowflake table."""
+    def close(self):
+        """Return the connection to the pool."""
+        if getattr(self, "conn", None) is not None:
+            self.provider.release(self.conn)
+            self.conn = None
+
+    def get_watermarks(self):
+        """Get the latest sys_created_on and watermark (sys_updated_on) from the Snowflake table in one query."""
         try:
             cursor = self.conn.cursor()
-            cursor.execute(f"SHOW TABLES LIKE '{self.config['snowflake']['table']}' IN {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}")
-            if not cursor.fetchone():
-                print("Table does not exist, no latest created_on timestamp")
-                return None
-
-            cursor.execute(f'SELECT MAX("sys_created_on") AS max_created_on FROM {self.config["snowflake"]["database"]}.{self.config["snowflake"]["schema"]}.{self.config["snowflake"]["table"]}')
+            watermark_column = self.config["snowflake"].get("watermark_column", "sys_updated_on")
+            cursor.execute(f'SELECT MAX("sys_created_on"), MAX("{watermark_column}") FROM {self.config["snowflake"]["database"]}.{self.config["snowflake"]["schema"]}.{self.config["snowflake"]["table"]}')
             result = cursor.fetchone()
-            print(f"Raw result from fetchone: {result}")  # For debugging
-            latest_timestamp = result[0] if result else None  # Positional access
-            if latest_timestamp:
-                print(f"Latest created_on in Snowflake: {latest_timestamp}")
-                return latest_timestamp
+            latest_created_on, latest_updated_on = result if result else (None, None)  # Positional access
+            if latest_created_on or latest_updated_on:
+                print(f"Latest created_on in Snowflake: {latest_created_on}, latest updated_on: {latest_updated_on}")
             else:
                 print("No data in table, fetching all tickets")
-                return None
+            return latest_created_on, latest_updated_on
+        except snowflake.connector.errors.ProgrammingError as e:
+            if e.errno == 2003:  # Object does not exist; saves a separate SHOW TABLES round trip
+                print("Table does not exist, no latest timestamps")
+            else:
+                print(f"Error fetching latest timestamps: {e}")
+            return None, None
         except Exception as e:
-            print(f"Error fetching latest created_on: {e}")
-            return None
+            print(f"Error fetching latest timestamps: {e}")
+            return None, None
+
+    def get_resume_point(self):
+        """Return (latest_created_on, latest_updated_on, start_key) for the next incremental run.
+
+        Reads the last committed run from the pipeline-state table (one small lookup) and only
+        falls back to MAX() over the target table when no run has been recorded yet.
+        """
+        try:
+            last_run = self.state.latest()
+        except snowflake.connector.errors.ProgrammingError as e:
+            if e.errno != 2003:  # State table not created yet
+                print(f"Error reading pipeline state: {e}")
+            last_run = None
+        if last_run:
+            print(f"Resuming from pipeline state run {last_run['run_id']}: {last_run['watermark']} / {last_run['last_sys_id']}")
+            start_key = (last_run["watermark"].strftime("%Y-%m-%d %H:%M:%S"), last_run["last_sys_id"]) if last_run["last_sys_id"] else None
+            return last_run["created_watermark"], last_run["watermark"], start_key
+        latest_created_on, latest_updated_on = self.get_watermarks()
+        return latest_created_on, latest_updated_on, None
+
+    def get_latest_created_on(self):
+        """Get the latest sys_created_on timestamp from Snowflake table."""
+        return self.get_watermarks()[0]
 
     def get_latest_updated_on(self):
         """Get the latest sys_updated_on timestamp from Snowflake table."""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute(f"SHOW TABLES LIKE '{self.config['snowflake']['table']}' IN {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}")
-            if not cursor.fetchone():
-                print("Table does not exist, no latest updated_on timestamp")
-                return None
+        return self.get_watermarks()[1]
 
-            cursor.execute(f'SELECT MAX("sys_updated_on") AS max_updated_on FROM {self.config["snowflake"]["database"]}.{self.config["snowflake"]["schema"]}.{self.config["snowflake"]["table"]}')
-            result = cursor.fetchone()
-            print(f"Raw result from fetchone for updated_on: {result}")  # For debugging
-            latest_timestamp = result[0] if result else None  # Positional access
-            if latest_timestamp:
-                print(f"Latest updated_on in Snowflake: {latest_timestamp}")
-                return latest_timestamp
-            else:
-                print("No data in table for updated_on, using None")
-                return None
-        except Exception as e:
-            print(f"Error fetching latest updated_on: {e}")
-            return None
+    def column_types(self, sample_df):
+        """Return (column, Snowflake type) pairs matching the Parquet files written for sample_df."""
+        return [(field.name, snowflake_type(field.type)) for field in incident_schema(sample_df)]
 
     def create_table(self, sample_df=None):
-        """Create table dynamically based on sample DataFrame columns or inferred structure, escaping reserved keywords."""
+        """Create table dynamically based on sample DataFrame columns or inferred structure, escaping reserved keywords.
+
+        The warehouse check and the DDL run once per process; later loads skip them.
+        """
         conn = self.conn
+        target_table = f"{self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']}"
         try:
             cursor = conn.cursor()
-            cursor.execute(f"SHOW WAREHOUSES LIKE '{self.config['snowflake']['warehouse']}'")
-            if not cursor.fetchone():
-                raise Exception(f"Warehouse {self.config['snowflake']['warehouse']} does not exist.")
+
+            def check_warehouse():
+                cursor.execute(f"SHOW WAREHOUSES LIKE '{self.config['snowflake']['warehouse']}'")
+                if not cursor.fetchone():
+                    raise Exception(f"Warehouse {self.config['snowflake']['warehouse']} does not exist.")
+                print(f"Warehouse {self.config['snowflake']['warehouse']} verified")
+            self.provider.run_once(f"warehouse:{self.config['snowflake']['warehouse']}", check_warehouse)
 
             # If sample_df is provided, use it for dynamic column creation; otherwise, use a default schema
             if sample_df is not None and not sample_df.empty:
                 snowflake_columns = []
-                for col in sample_df.columns:
-                    dtype = str(sample_df[col].dtype)
-                    if "datetime" in dtype or col in ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]:
-                        col_type = "TIMESTAMP"
-                    else:
-                        col_type = "STRING"
-                    if col == "number":
+                for col, col_type in self.column_types(sample_df):
+                    if col == self.config["snowflake"].get("primary_key", "number"):
                         col_type += " PRIMARY KEY UNIQUE"
                     snowflake_columns.append(f'"{col}" {col_type}')
             else:
@@ -104,149 +144,336 @@ class SnowflakeLoader:
                     # Add more default columns as needed
                 ]
 
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']} (
-                {', '.join(snowflake_columns)}
-            )
-            """
-            cursor.execute(create_table_sql)
-            print(f"Table {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']} created or verified")
-
-            cursor.execute(f"USE WAREHOUSE {self.config['snowflake']['warehouse']}")
-            print(f"Warehouse {self.config['snowflake']['warehouse']} activated")
+            def create():
+                cluster_column = self.config["snowflake"].get("cluster_column", "sys_created_on")
+                cluster_sql = f'CLUSTER BY ("{cluster_column}")' if cluster_column else ""
+                create_table_sql = f"""
+                CREATE TABLE IF NOT EXISTS {target_table} (
+                    {', '.join(snowflake_columns)}
+                ) {cluster_sql}
+                """
+                cursor.execute(create_table_sql)
+                print(f"Table {target_table} created or verified")
+                self.state.ensure_table(cursor)
+            self.provider.run_once(self.ddl_keys()[0], create)
         except Exception as e:
             print(f"Error creating table: {e}")
             raise
 
     def create_s3_stage(self):
-        """Create an external stage pointing to S3."""
+        """Create an external stage pointing to S3 (once per process)."""
         try:
             cursor = self.conn.cursor()
-            cursor.execute(f"""
-            CREATE STAGE IF NOT EXISTS s3_stage
-            URL = 's3://{self.config['s3']['bucket']}/{self.config['s3']['prefix']}'
-            CREDENTIALS = (AWS_KEY_ID = '{os.getenv("AWS_ACCESS_KEY_ID")}' AWS_SECRET_KEY = '{os.getenv("AWS_SECRET_ACCESS_KEY")}')
-            FILE_FORMAT = (TYPE = 'PARQUET');
-            """)
-            print("S3 stage created")
+
+            def create():
+                cursor.execute(f"""
+                CREATE STAGE IF NOT EXISTS s3_stage
+                URL = 's3://{self.config['s3']['bucket']}/{self.config['s3']['prefix']}'
+                CREDENTIALS = (AWS_KEY_ID = '{os.getenv("AWS_ACCESS_KEY_ID")}' AWS_SECRET_KEY = '{os.getenv("AWS_SECRET_ACCESS_KEY")}')
+                FILE_FORMAT = (TYPE = 'PARQUET' USE_LOGICAL_TYPE = TRUE);
+                """)
+                print("S3 stage created")
+            self.provider.run_once(self.ddl_keys()[1], create)
         except Exception as e:
             print(f"Error creating S3 stage: {e}")
             raise
 
-    def copy_from_s3(self, s3_key, sample_df):
-        """Copy data from S3 Parquet to Snowflake using a temp table and dynamic MERGE for upserts."""
-        try:
-            cursor = self.conn.cursor()
-            temp_table = "temp_incident_load"
-
-            # Compute relative path from s3_key (strip the prefix)
-            relative = s3_key.replace(self.config['s3']['prefix'], '', 1)
-
-            # Step 1: Create temp table with same schema as target (using sample_df for columns)
-            snowflake_columns = []
-            for col in sample_df.columns:
-                dtype = str(sample_df[col].dtype)
-                if "datetime" in dtype or col in ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]:
-                    col_type = "TIMESTAMP"
-                else:
-                    col_type = "STRING"
-                snowflake_columns.append(f'"{col}" {col_type}')
-            create_temp_sql = f"""
-            CREATE TEMPORARY TABLE {temp_table} (
-                {', '.join(snowflake_columns)}
-            )
-            """
-            cursor.execute(create_temp_sql)
-            print(f"Temporary table {temp_table} created")
-
-            # Step 2: COPY INTO temp table with explicit transformations for datetimes
-            # Generate dynamic SELECT clause with casts (e.g., TO_TIMESTAMP for datetime cols)
-            select_clauses = []
-            for col in sample_df.columns:
-                quoted_col = f'"{col}"'
-                if col in ["sys_created_on", "sys_updated_on", "opened_at", "resolved_at", "closed_at"]:
-                    select_clauses.append(f"TO_TIMESTAMP($1:{quoted_col}::STRING) AS {quoted_col}")
-                else:
-                    select_clauses.append(f"$1:{quoted_col}::STRING AS {quoted_col}")
-            select_sql = ', '.join(select_clauses)
-
-            copy_sql = f"""
-            COPY INTO {temp_table}
-            FROM (SELECT {select_sql} FROM @s3_stage/{relative})
-            FILE_FORMAT = (TYPE = 'PARQUET')
-            ON_ERROR = 'CONTINUE'
-            PURGE = TRUE;
-            """
-            cursor.execute(copy_sql)
-            print(f"Copied data into temp table from S3 Parquet: {relative}")
-
-            # Diagnostic: Check row count in temp table after copy
-            cursor.execute(f"SELECT COUNT(*) FROM {temp_table}")
-            temp_count = cursor.fetchone()[0]
-            print(f"Rows loaded into temp table: {temp_count}")
-            if temp_count == 0:
-                # Further diagnostic: Query load history for errors
-                load_history_sql = f"""
-                SELECT TABLE_NAME, FILE_NAME, STATUS, ERROR_COUNT, FIRST_ERROR_MESSAGE, ROW_COUNT
-                FROM INFORMATION_SCHEMA.LOAD_HISTORY
-                WHERE FILE_NAME LIKE '%{relative}%'
-                ORDER BY LAST_LOAD_TIME DESC LIMIT 1
-                """
-                cursor.execute(load_history_sql)
-                load_result = cursor.fetchone()
-                if load_result:
-                    table_name, file_name, status, error_count, first_error, row_count = load_result
-                    inferred_parsed = row_count + error_count if row_count is not None and error_count is not None else 'Unknown'
-                    print(f"Load History: Table={table_name}, File={file_name}, Status={status}, Errors={error_count}, First Error Message={first_error}, Rows Loaded={row_count}, Inferred Parsed Rows={inferred_parsed}")
-                else:
-                    print("No load history found for this file.")
-                print("Warning: No rows were loaded into the temp table. Check the load history above for errors (e.g., type mismatches). Consider verifying Parquet schema locally.")
-
-            # Step 3: Generate dynamic MERGE SQL based on all columns in sample_df
-            all_columns = [f'"{col}"' for col in sample_df.columns]
-            update_sets = ', '.join([f'target.{col} = source.{col}' for col in all_columns if col != '"number"'])  # Update all except PK
-            insert_columns = ', '.join(all_columns)
-            insert_values = ', '.join([f'source.{col}' for col in all_columns])
-
-            merge_sql = f"""
-            MERGE INTO {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']} AS target
-            USING {temp_table} AS source
-            ON target."number" = source."number"
-            WHEN MATCHED THEN
-                UPDATE SET {update_sets}
-            WHEN NOT MATCHED THEN
-                INSERT ({insert_columns})
-                VALUES ({insert_values});
-            """
+    def ddl_keys(self):
+        """The provider's run-once keys for this table's DDL: (target table, stage)."""
+        sf_config = self.config["snowflake"]
+        schema = f"{sf_config['database']}.{sf_config['schema']}"
+        return f"table:{schema}.{sf_config['table']}", f"stage:{schema}.s3_stage"
+
+    def prepare_load(self, sample_df):
+        """Create the target table, state table and stage, and add columns new to this extract.
+
+        All of it is a no-op once done in this process for the same extract schema.
+        """
+        self.create_table(sample_df)  # Pass sample_df if available for schema
+        self.create_s3_stage()
+        column_types = self.column_types(sample_df)
+        self.registry.sync(self.conn.cursor(), column_types)
+        return column_types
+
+    def backlog_pattern(self):
+        """PATTERN for every Parquet file this table still has in the stage, or None.
+
+        Without s3.table_prefix the files of every table share one prefix, so there is no
+        pattern that only matches this table's; the backlog is then not drained.
+        """
+        table_prefix = self.config["s3"].get("table_prefix")
+        if not table_prefix:
+            print("Warning: Not draining the stage backlog without s3.table_prefix (it would load other tables' files)")
+            return None
+        return f".*/{re.escape(table_prefix)}{BACKLOG_PATTERN}"  # Other tables' files share the stage
+
+    def stage_path(self, s3_key):
+        """Path of s3_key relative to the stage (the S3 prefix is the stage URL)."""
+        return s3_key.replace(self.config['s3']['prefix'], '', 1)
+
+    def copy_into_temp(self, cursor, statements, keys=None, pattern=None, table=TEMP_TABLE):
+        """COPY the given keys (or every staged file matching pattern) into the temp table.
+
+        All files are loaded by one COPY statement (Snowflake caps FILES at 1000 names, so
+        longer key lists take one statement per 1000). Returns the number of rows loaded.
+        """
+        if keys:
+            relative = [self.stage_path(key) for key in keys]
+            sources = [
+                "FILES = (" + ", ".join(f"'{path}'" for path in relative[i:i + COPY_FILES_LIMIT]) + ")"
+                for i in range(0, len(relative), COPY_FILES_LIMIT)
+            ]
+        else:
+            sources = [f"PATTERN = '{pattern}'"]
+
+        rows_loaded = 0
+        files = 0
+        for source in sources:
+            with metrics.timer("snowflake_copy", self.table) as values:
+                cursor.execute(f"""
+                COPY INTO {table}
+                FROM (SELECT {statements['copy_select']} FROM @s3_stage)
+                {source}
+                FILE_FORMAT = (TYPE = 'PARQUET' USE_LOGICAL_TYPE = TRUE)
+                ON_ERROR = 'CONTINUE'
+                PURGE = TRUE;
+                """)
+                names = [column[0].lower() for column in cursor.description]
+                results = [dict(zip(names, row)) for row in cursor.fetchall()]
+                results = [result for result in results if "rows_loaded" in result]  # Not "Copy executed with 0 files processed."
+                values["rows"] = sum(result["rows_loaded"] or 0 for result in results)
+                values["files"] = len(results)
+            for result in results:
+                files += 1
+                rows_loaded += result["rows_loaded"] or 0
+                if result.get("errors_seen"):
+                    self.failed_files.append(result["file"])
+                    print(f"Load errors in {result['file']}: status={result['status']}, errors={result['errors_seen']}, first error={result.get('first_error')}")
+        print(f"Copied {rows_loaded} rows from {files} Parquet file(s) into {table}")
+        if files and rows_loaded == 0:
+            print("Warning: No rows were loaded into the temp table. Check the load errors above (e.g., type mismatches). Consider verifying Parquet schema locally.")
+        return rows_loaded
+
+    def merge_temp(self, cursor, statements, run_state=None):
+        """MERGE the temp table into the target and record the run in the same transaction.
+
+        Files from several runs can hold the same ticket, so only the latest version of each
+        primary key ("number" by default) is merged. When the cluster column is sys_created_on (see
+        PRUNE_COLUMNS), the target scan is limited to rows at or after the oldest staged value (or
+        NULL), and matched rows are only updated when their row_hash changed and they are not newer
+        than the staged version.
+        Returns a dict of staged, duplicates, matched, updated, inserted and skipped counts
+        plus the staged max sys_updated_on/sys_created_on.
+        """
+        with metrics.timer("snowflake_stats", self.table):
+            cursor.execute(statements["stats"])
+        staged, distinct, cluster_min, cluster_nulls, max_updated_on, max_created_on = cursor.fetchone()
+
+        on_sql = f'target.{statements["key"]} = source.{statements["key"]}'
+        if cluster_min is not None and not cluster_nulls:
+            # A ticket's sys_created_on never changes, so no match can be older than the oldest staged row.
+            # Target rows without one must still match, or their tickets would be inserted again.
+            cluster = f'target."{statements["cluster_column"]}"'
+            on_sql += f" AND ({cluster} >= '{cluster_min}' OR {cluster} IS NULL)"
+        merge_sql = statements["merge"].replace("ON_CLAUSE", on_sql, 1)
+
+        cursor.execute("BEGIN")  # Explicit transaction: the MERGE and the state row commit together
+        with metrics.timer("snowflake_merge", self.table) as values:
             cursor.execute(merge_sql)
-            merge_rows = cursor.rowcount  # Get affected rows directly from cursor
+            result = dict(zip([column[0].lower() for column in cursor.description], cursor.fetchone()))
+            inserted = result.get("number of rows inserted", 0)
+            updated = result.get("number of rows updated", 0)
+            values.update(rows=inserted + updated, inserted=inserted, updated=updated, staged=staged)
+        counts = {
+            "staged": staged,
+            "duplicates": staged - distinct,
+            "matched": distinct - inserted,
+            "updated": updated,
+            "inserted": inserted,
+            "skipped": distinct - inserted - updated,
+            "max_sys_updated_on": max_updated_on,
+            "max_sys_created_on": max_created_on
+        }
+        if run_state and run_state.get("watermark") is None:
+            # Micro-batches of files from earlier extracts take their watermark from what was staged
+            run_state = {**run_state, "watermark": max_updated_on, "created_watermark": max_created_on}
+        if run_state and run_state.get("watermark") is not None:
+            self.state.record_run(cursor, {**run_state, "rows_merged": inserted + updated})
+        with metrics.timer("snowflake_commit", self.table):
             self.conn.commit()
-            print(f"Merged data from temp table into target (affected rows: {merge_rows})")
+        print(f"Merged data from temp table into target: {counts}")
+        return counts
+
+    def run_batch(self, sample_df, keys=None, pattern=None, run_state=None):
+        """Load many staged Parquet files with one COPY and one MERGE.
+
+        Pass the S3 keys to load, or a regex PATTERN over the stage (backlog_pattern() picks up
+        every file still staged, i.e. files left behind by failed runs, since successful
+        loads PURGE theirs). When run_state is given, the run is recorded in the
+        pipeline-state table inside the same transaction as the MERGE. Returns the
+        merge_temp counts (empty when nothing was loaded).
+        """
+        if not keys and not pattern:
+            raise ValueError("run_batch needs keys or a pattern")
+        try:
+            cursor, statements = self.begin_batch(sample_df)
+            rows_loaded = self.copy_into_temp(cursor, statements, keys=keys, pattern=pattern)
+            return self.finish_batch(cursor, statements, rows_loaded, run_state)
+        except Exception as e:
+            self.abort_batch(e)
+            raise
 
-            # Step 4: Clean up temp table
-            cursor.execute(f"DROP TABLE IF EXISTS {temp_table}")
-            print(f"Temporary table {temp_table} dropped")
+    def begin_batch(self, sample_df):
+        """Prepare the target and create an empty temp table; returns (cursor, statements).
 
-            # Verify total rows
-            cursor.execute(f"SELECT COUNT(*) FROM {self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']}")
-            count = cursor.fetchone()[0]
-            print(f"Total rows in Snowflake table: {count}")
+        Files can then be copied in with copy_into_temp as they become available (the async
+        pipeline COPYs each part while later parts are still being written) before finish_batch.
+        """
+        column_types = self.prepare_load(sample_df)
+        statements = self.registry.statements(column_types)
+        cursor = self.conn.cursor()
+        cursor.execute(statements["create_temp"])
+        self.failed_files = []  # Files COPY reported errors for in this batch; PURGE leaves them in the stage
+        return cursor, statements
+
+    def widen_batch(self, cursor, statements, sample_df):
+        """Add columns new in sample_df to the target and the open batch's temp table; returns the new statements."""
+        column_types = self.prepare_load(sample_df)
+        widened = self.registry.statements(column_types)
+        for col, col_type in column_types:
+            if col not in statements["columns"]:
+                cursor.execute(f'ALTER TABLE {TEMP_TABLE} ADD COLUMN "{col}" {col_type}')
+        return widened
+
+    def finish_batch(self, cursor, statements, rows_loaded, run_state=None):
+        """MERGE what was copied into the temp table (if anything) and drop it; returns the counts."""
+        counts = self.merge_temp(cursor, statements, run_state) if rows_loaded else {}
+        cursor.execute(f"DROP TABLE IF EXISTS {TEMP_TABLE}")
+        return counts
+
+    def abort_batch(self, error):
+        """Roll back a failed batch."""
+        print(f"Error merging data from S3: {error}")
+        self.conn.rollback()
+        self.registry.forget()  # Re-read the target columns next time in case they changed underneath us
+        for key in self.ddl_keys():
+            self.provider.forget_ddl(key)  # And re-create the table or stage if either was dropped (e.g. errno 2003)
+
+    def apply_changes(self, keys):
+        """Apply a CDC change log (see modules.cdc) to the target as partial updates and soft deletes.
+
+        Only the latest change of each (sys_id, field) newer than the target row's sys_mod_count
+        is applied, so a row already reloaded in full is not rolled back; fields the target has
+        no column for are skipped. row_hash is cleared on updated rows so the next full-row
+        MERGE always rewrites them. Deletions set is_deleted and deleted_at. Returns a dict of
+        updated and deleted counts, the fields applied and the changed sys_ids missing from
+        the target (new records whose inserts were not audited), which the caller loads in full.
+        """
+        target_table = f"{self.config['snowflake']['database']}.{self.config['snowflake']['schema']}.{self.config['snowflake']['table']}"
+        watermark_column = self.config["snowflake"].get("watermark_column", "sys_updated_on")
+        try:
+            cursor = self.conn.cursor()
+            self.create_s3_stage()
+            self.registry.sync(cursor, SOFT_DELETE_COLUMNS)
+            columns = self.registry.columns
+            change_columns = ", ".join(f'"{col}" {col_type}' for col, col_type in CHANGE_COLUMNS)
+            cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {CHANGES_TABLE} ({change_columns})")
+            self.failed_files = []
+            copy_select = ", ".join(f'$1:"{col}"::{col_type} AS "{col}"' for col, col_type in CHANGE_COLUMNS)
+            copied = self.copy_into_temp(cursor, {"copy_select": copy_select}, keys=keys, table=CHANGES_TABLE)
+
+            cursor.execute(f"""SELECT DISTINCT "field" FROM {CHANGES_TABLE} WHERE "op" = 'U'""")
+            changed = [row[0] for row in cursor.fetchall()]
+            fields = [field for field in changed if field in columns and field not in ("sys_id", self.registry.primary_key, "sys_mod_count", watermark_column, ROW_HASH_COLUMN)]
+            if set(changed) - set(fields):
+                print(f"Skipping changed fields the target has no column for: {sorted(set(changed) - set(fields))}")
+
+            newer = 'AND (target."sys_mod_count" IS NULL OR change."sys_mod_count" > target."sys_mod_count")' if "sys_mod_count" in columns else ""
+            # One row per sys_id: each changed field's latest value, and whether it changed at all
+            pivot = "".join(
+                ', MAX(IFF("field" = \'{0}\', "value", NULL)) AS "{0}", BOOLOR_AGG("field" = \'{0}\') AS "{0}__changed"'.format(field)
+                for field in fields
+            )
+            update_sets = [
+                f'target."{field}" = IFF(source."{field}__changed", ' + (f'source."{field}"' if columns[field].upper().startswith(("VARCHAR", "STRING", "TEXT")) else f'TRY_CAST(source."{field}" AS {columns[field]})') + f', target."{field}")'
+                for field in fields
+            ]
+            if "sys_mod_count" in columns:
+                update_sets.append('target."sys_mod_count" = GREATEST(COALESCE(target."sys_mod_count", 0), source."sys_mod_count")')
+            if watermark_column in columns:
+                update_sets.append(f'target."{watermark_column}" = GREATEST(COALESCE(target."{watermark_column}", source."changed_at"), source."changed_at")')
+            if ROW_HASH_COLUMN in columns:
+                update_sets.append(f'target."{ROW_HASH_COLUMN}" = NULL')
+
+            cursor.execute("BEGIN")  # Updates and deletes commit together
+            updated = deleted = 0
+            if fields:
+                with metrics.timer("snowflake_merge", self.table) as values:
+                    cursor.execute(f"""
+                    MERGE INTO {target_table} AS target
+                    USING (
+                        SELECT "sys_id", MAX("sys_mod_count") AS "sys_mod_count", MAX("changed_at") AS "changed_at"{pivot}
+                        FROM (
+                            SELECT change.* FROM {CHANGES_TABLE} AS change
+                            JOIN {target_table} AS target ON target."sys_id" = change."sys_id"
+                            WHERE change."op" = 'U' {newer}
+                            QUALIFY ROW_NUMBER() OVER (PARTITION BY change."sys_id", change."field" ORDER BY change."sys_mod_count" DESC, change."changed_at" DESC) = 1
+                        )
+                        GROUP BY "sys_id"
+                    ) AS source
+                    ON target."sys_id" = source."sys_id"
+                    WHEN MATCHED THEN
+                        UPDATE SET {', '.join(update_sets)};
+                    """)
+                    updated = cursor.fetchone()[0]
+                    values["rows"] = updated
+            with metrics.timer("snowflake_soft_delete", self.table) as values:
+                cursor.execute(f"""
+                UPDATE {target_table} AS target
+                SET "is_deleted" = TRUE, "deleted_at" = deleted."changed_at"
+                FROM (SELECT "sys_id", MAX("changed_at") AS "changed_at" FROM {CHANGES_TABLE} WHERE "op" = 'D' GROUP BY "sys_id") AS deleted
+                WHERE target."sys_id" = deleted."sys_id" AND target."is_deleted" IS DISTINCT FROM TRUE
+                """)
+                deleted = cursor.fetchone()[0]
+                values["rows"] = deleted
+            cursor.execute(f"""
+            SELECT DISTINCT change."sys_id" FROM {CHANGES_TABLE} AS change
+            WHERE change."op" = 'U' AND NOT EXISTS (SELECT 1 FROM {target_table} AS target WHERE target."sys_id" = change."sys_id")
+            """)
+            missing = [row[0] for row in cursor.fetchall()]
+            with metrics.timer("snowflake_commit", self.table):
+                self.conn.commit()
+            cursor.execute(f"DROP TABLE IF EXISTS {CHANGES_TABLE}")
+            result = {"changes": copied, "updated": updated, "deleted": deleted, "fields": fields, "missing": missing}
+            print(f"Applied change log to {target_table}: {updated} rows updated, {deleted} soft-deleted, {len(missing)} not in the target yet")
+            return result
         except Exception as e:
-            print(f"Error merging data from S3: {e}")
-            self.conn.rollback()
+            self.abort_batch(e)
             raise
 
-    def run(self, s3_key, sample_df=None):
+    def drain_backlog(self, sample_df, keys=None, run_state=None):
+        """Load every Parquet file still in the stage (left by failed runs) in one batch.
+
+        Falls back to loading just keys when the backlog cannot be scoped to this table.
+        """
+        pattern = self.backlog_pattern()
+        if pattern is None:
+            return self.run_batch(sample_df, keys=keys, run_state=run_state)
+        return self.run_batch(sample_df, pattern=pattern, run_state=run_state)
+
+    def copy_from_s3(self, s3_key, sample_df, run_state=None):
+        """Copy one S3 Parquet file (or every file under a key ending in "/") into Snowflake."""
+        if s3_key.endswith("/"):
+            return self.run_batch(sample_df, pattern=f".*{re.escape(self.stage_path(s3_key))}.*", run_state=run_state)
+        return self.run_batch(sample_df, keys=[s3_key], run_state=run_state)
+
+    def run(self, s3_key, sample_df=None, run_state=None):
         """Run the Snowflake loading process from S3."""
-        self.create_table(sample_df)  # Pass sample_df if available for schema
-        self.create_s3_stage()
-        self.copy_from_s3(s3_key, sample_df)
+        self.copy_from_s3(s3_key, sample_df, run_state)
 
     def __del__(self):
-        """Close connection."""
-        if hasattr(self, 'conn') and self.conn:
-            self.conn.close()
-            print("Snowflake raw connection closed")
+        """Return the connection to the pool."""
+        self.close()
 
 if __name__ == "__main__":
     config = {
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+from datetime import datetime
+from modules.normalize import ROW_HASH_COLUMN
+
+_save_lock = threading.Lock()  # Several stores (e.g. extracted and loaded) share one file
+
+def row_versions(df):
+    """Each row's version (row_hash, else sys_mod_count) as Python ints, or None if df has neither."""
+    for col in (ROW_HASH_COLUMN, "sys_mod_count"):
+        if col in df.columns:
+            return [int(value) if value == value and value is not None else None for value in df[col].tolist()]
+    return None
+
+def drop_extracted(frames, seen):
+    """Drop rows already extracted unchanged, as recorded by WatermarkStore.boundary; skips emptied frames.
+
+    A resumed window fetches its boundary second again, so without this an idle source
+    would produce a file (and a MERGE) of the same few rows on every run.
+    """
+    dropped = 0
+    for df in frames:
+        if seen and not df.empty and "sys_id" in df.columns:
+            versions = row_versions(df)
+            if versions is not None:
+                keep = [version is None or seen.get(sys_id) != version for sys_id, version in zip(df["sys_id"].tolist(), versions)]
+                if not all(keep):
+                    dropped += len(keep) - sum(keep)
+                    df = df[keep].reset_index(drop=True)
+        if not df.empty:
+            yield df
+    if dropped:
+        print(f"Skipped {dropped} row(s) of the resumed second that were already extracted")
+
+class WatermarkStore:
+    """Local JSON record of the last loaded sys_created_on/sys_updated_on per target table.
+
+    A scheduled run that finds its watermark here never has to query Snowflake
+    (or resume the warehouse) before it starts fetching from ServiceNow. The
+    (sys_id, version) pairs of the rows in the last second are kept with it, so the
+    next run can drop them when it fetches that second again (see drop_extracted).
+    """
+
+    def __init__(self, config, name=None):
+        state = config.get("state", {})
+        self.enabled = state.get("enabled", True)
+        self.path = state.get("path", "state/watermarks.json")
+        self.key = f"{config['snowflake']['database']}.{config['snowflake']['schema']}.{config['snowflake']['table']}"
+        if name:
+            self.key += f":{name}"  # A separate watermark, e.g. how far continuous mode has extracted
+        # Stored under "sys_updated_on" whatever the table's watermark column is called
+        self.watermark_column = config["snowflake"].get("watermark_column", "sys_updated_on")
+        self.pending = {}
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def load(self):
+        """Return (latest_created_on, latest_updated_on) from the local store, or (None, None)."""
+        if not self.enabled:
+            return None, None
+        entry = self._read().get(self.key, {})
+        created_on = entry.get("sys_created_on")
+        updated_on = entry.get("sys_updated_on")
+        if updated_on:
+            print(f"Using local watermark for {self.key}: created_on {created_on}, updated_on {updated_on}")
+        return (
+            datetime.fromisoformat(created_on) if created_on else None,
+            datetime.fromisoformat(updated_on) if updated_on else None
+        )
+
+    def resume_point(self):
+        """Return (latest_created_on, latest_updated_on, start_key) from the local store."""
+        latest_created_on, latest_updated_on = self.load()
+        last_sys_id = self._read().get(self.key, {}).get("last_sys_id") if latest_updated_on else None
+        start_key = (latest_updated_on.strftime("%Y-%m-%d %H:%M:%S"), last_sys_id) if last_sys_id else None
+        return latest_created_on, latest_updated_on, start_key
+
+    def boundary(self, start_key):
+        """{sys_id: version} of the rows already extracted in start_key's second, if start_key came from this store."""
+        if not self.enabled or start_key is None:
+            return {}
+        entry = self._read().get(self.key, {})
+        updated_on = entry.get("sys_updated_on")
+        if not updated_on or tuple(start_key) != (datetime.fromisoformat(updated_on).strftime("%Y-%m-%d %H:%M:%S"), entry.get("last_sys_id")):
+            return {}
+        return entry.get("boundary", {})
+
+    def observe(self, df):
+        """Track the maxima of a DataFrame about to be loaded; returns df so it can wrap a stream."""
+        for col, source in (("sys_created_on", "sys_created_on"), ("sys_updated_on", self.watermark_column)):
+            if source in df.columns and not df.empty:
+                latest = df[source].max()
+                if latest is not None and latest == latest:  # Skip NaT
+                    latest = latest.to_pydatetime()
+                    if col == "sys_updated_on" and "sys_id" in df.columns:
+                        # The last row in (sys_updated_on, sys_id) order is where the next run resumes
+                        last_sys_id = df.loc[df[source] == latest, "sys_id"].max()
+                        if latest == self.pending.get(col):
+                            last_sys_id = max(last_sys_id, self.pending["last_sys_id"])
+                        if col not in self.pending or latest >= self.pending[col]:
+                            self.pending["last_sys_id"] = last_sys_id
+                        versions = row_versions(df)
+                        if versions is not None:
+                            # Rows of the last second, which the next run fetches again
+                            at_latest = (df[source] == latest).tolist()
+                            rows = {sys_id: version for sys_id, version, last in zip(df["sys_id"].tolist(), versions, at_latest) if last}
+                            if latest == self.pending.get(col):
+                                self.pending.setdefault("boundary", {}).update(rows)
+                            elif col not in self.pending or latest > self.pending[col]:
+                                self.pending["boundary"] = rows
+                    if col not in self.pending or latest > self.pending[col]:
+                        self.pending[col] = latest
+        return df
+
+    def run_state(self, run_id, rows_extracted, s3_keys):
+        """Describe the run being loaded, for PipelineState.record_run."""
+        if not self.pending.get("sys_updated_on"):
+            return None
+        return {
+            "run_id": run_id,
+            "watermark": self.pending["sys_updated_on"],
+            "last_sys_id": self.pending.get("last_sys_id"),
+            "created_watermark": self.pending.get("sys_created_on"),
+            "rows_extracted": rows_extracted,
+            "s3_keys": s3_keys
+        }
+
+    def save(self, latest_created_on=None, latest_updated_on=None):
+        """Persist the observed maxima (or explicit values) once the load has committed."""
+        if not self.enabled:
+            return
+        created_on = latest_created_on or self.pending.get("sys_created_on")
+        updated_on = latest_updated_on or self.pending.get("sys_updated_on")
+        if not updated_on:
+            return
+        with _save_lock:
+            state = self._read()
+            entry = state.get(self.key, {})
+            current = entry.get("sys_updated_on")
+            current = datetime.fromisoformat(current) if current else None
+            if self.pending.get("last_sys_id") and (not current or updated_on >= current):
+                entry["last_sys_id"] = self.pending["last_sys_id"]
+            boundary = self.pending.get("boundary") if self.pending.get("sys_updated_on") == updated_on else None
+            if not current or updated_on > current:
+                entry["boundary"] = boundary or {}  # Unknown when saved from explicit values; nothing is dropped
+            elif updated_on == current and boundary:
+                entry["boundary"] = {**entry.get("boundary", {}), **boundary}
+            for col, value in (("sys_created_on", created_on), ("sys_updated_on", updated_on)):
+                current = entry.get(col)
+                if value and (not current or value > datetime.fromisoformat(current)):
+                    entry[col] = value.isoformat(sep=" ")
+            state[self.key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(state, file, indent=2)
+            os.replace(tmp_path, self.path)  # Atomic, so a crash never leaves a half-written store
+        self.pending = {}
+        print(f"Saved local watermark for {self.key}: {entry['sys_updated_on']} / {entry.get('last_sys_id')} "
+              f"({len(entry.get('boundary', {}))} row(s) in that second)")
+
+class PipelineState:
+    """Run history of the pipeline (watermark, last sys_id, row counts, S3 keys) in a database table.
+
+    record_run only executes the INSERT; the caller commits it in the same transaction
+    as the MERGE, so the recorded watermark always matches what was loaded. Works on a
+    Snowflake connection or, through for_sqlite, on a local SQLite file for testing.
+    """
+
+    def __init__(self, conn, table="pipeline_state", pipeline="incident", paramstyle="pyformat"):
+        self.conn = conn
+        self.table = table
+        self.pipeline = pipeline
+        self.placeholder = "?" if paramstyle == "qmark" else "%s"
+
+    @classmethod
+    def for_sqlite(cls, path, table="pipeline_state", pipeline="incident"):
+        """Stand-in backed by a local SQLite database."""
+        import sqlite3
+        state = cls(sqlite3.connect(path), table=table, pipeline=pipeline, paramstyle="qmark")
+        state.ensure_table()
+        return state
+
+    def ensure_table(self, cursor=None):
+        """Create the state table if it does not exist."""
+        cursor = cursor or self.conn.cursor()
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table} (
+            pipeline VARCHAR,
+            run_id VARCHAR,
+            watermark TIMESTAMP,
+            last_sys_id VARCHAR,
+            created_watermark TIMESTAMP,
+            rows_extracted INTEGER,
+            rows_merged INTEGER,
+            s3_keys VARCHAR,
+            committed_at TIMESTAMP
+        )
+        """)
+
+    def latest(self):
+        """Return the most recent committed run for this pipeline as a dict, or None."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"SELECT watermark, last_sys_id, created_watermark, run_id FROM {self.table} "
+            f"WHERE pipeline = {self.placeholder} ORDER BY committed_at DESC LIMIT 1",
+            (self.pipeline,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        watermark, last_sys_id, created_watermark, run_id = row
+        if isinstance(watermark, str):  # SQLite hands timestamps back as text
+            watermark = datetime.fromisoformat(watermark)
+        if isinstance(created_watermark, str):
+            created_watermark = datetime.fromisoformat(created_watermark)
+        return {"watermark": watermark, "last_sys_id": last_sys_id, "created_watermark": created_watermark, "run_id": run_id}
+
+    def record_run(self, cursor, run):
+        """Insert a run record on cursor without committing."""
+        values = (
+            self.pipeline,
+            run["run_id"],
+            run["watermark"].strftime("%Y-%m-%d %H:%M:%S"),
+            run.get("last_sys_id"),
+            run["created_watermark"].strftime("%Y-%m-%d %H:%M:%S") if run.get("created_watermark") else None,
+            run.get("rows_extracted"),
+            run.get("rows_merged"),
+            json.dumps(run.get("s3_keys", [])),
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        )
+        placeholders = ", ".join([self.placeholder] * len(values))
+        cursor.execute(
+            f"INSERT INTO {self.table} (pipeline, run_id, watermark, last_sys_id, created_watermark, "
+            f"rows_extracted, rows_merged, s3_keys, committed_at) VALUES ({placeholders})",
+            values
+        )
+
+if __name__ == "__main__":
+    # Test the class against the SQLite stand-in
+    state = PipelineState.for_sqlite(":memory:")
+    cursor = state.conn.cursor()
+    state.record_run(cursor, {
+        "run_id": "20250101_000000",
+        "watermark": datetime(2025, 1, 1, 12, 0, 0),
+        "last_sys_id": "46d44a5fa9fe198101ab4e6a4b1f8a7e",
+        "rows_extracted": 10,
+        "rows_merged": 10,
+        "s3_keys": ["tickets/tickets_20250101_000000.parquet"]
+    })
+    state.conn.commit()
+    print(state.latest())
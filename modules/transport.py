@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every session talking to one instance.
+
+    rate tokens are added per second up to burst; each request takes one. pause() stops
+    everyone (e.g. on a 429 with Retry-After) rather than just the worker that was told.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for the next seconds."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+class CircuitBreaker:
+    """Stops sending requests after failure_threshold consecutive failures.
+
+    While open, requests fail immediately with CircuitOpenError; after reset_seconds one
+    trial request is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=10, reset_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds or self.trial:
+                raise CircuitOpenError(f"ServiceNow circuit open after {self.failures} consecutive failures")
+            self.trial = True  # Half-open: this caller probes the instance
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print("ServiceNow circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                print(f"ServiceNow circuit opened for {self.reset_seconds}s after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+def retry_after(response):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class ResilientSession(requests.Session):
+    """requests.Session with timeouts, retries, rate limiting and a circuit breaker.
+
+    Connection errors, timeouts, 429 and 5xx responses are retried up to max_retries times
+    with exponential backoff and full jitter, or after the server's Retry-After (capped at
+    max_retry_after_seconds). The last failed response is returned as is, so the caller's
+    raise_for_status() still reports it. A 429 means the instance is up: it pauses the
+    limiter but does not count towards the circuit breaker.
+    The limiter and breaker are shared by every session for the same instance (see
+    get_session), so parallel workers throttle and trip together.
+    """
+
+    def __init__(self, limiter=None, breaker=None, connect_timeout=10, read_timeout=120,
+                 max_retries=6, backoff_seconds=1.0, max_backoff_seconds=60.0, max_retry_after_seconds=300.0,
+                 pool_size=10):
+        super().__init__()
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+        self.stats_lock = threading.Lock()  # Sessions are shared by worker threads
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def send_once(self, method, url, **kwargs):
+        """Send one attempt; subclasses wrap it (e.g. to hold a concurrency slot)."""
+        return super().request(method, url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.breaker.before_request()
+            if self.limiter:
+                self.limiter.acquire()
+            self.count("requests")
+            try:
+                response = self.send_once(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response, reason, delay = None, type(e).__name__, None
+                error = e
+            except BaseException:
+                self.breaker.record_failure()  # Always settle the outcome, or a half-open trial would never end
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()  # The instance answered; 4xx errors are the caller's problem
+                    return response
+                reason, delay = f"HTTP {response.status_code}", retry_after(response)
+                if delay is not None:
+                    delay = min(delay, self.max_retry_after_seconds)  # A far-future Retry-After must not stall every worker
+
+            if response is not None and response.status_code == 429:
+                self.breaker.record_success()  # Throttled, not down: the token bucket pause handles it
+            else:
+                self.breaker.record_failure()
+            if attempt >= self.max_retries:
+                print(f"ServiceNow request failed ({reason}) after {attempt} retries")
+                if response is None:
+                    raise error
+                return response
+            if response is not None and response.status_code == 429:
+                self.count("throttled")
+                if self.limiter and delay:
+                    self.limiter.pause(delay)  # Every worker backs off, not just this one
+            wait = delay if delay is not None else self.backoff(attempt)
+            attempt += 1
+            self.count("retries")
+            print(f"ServiceNow request failed ({reason}); retry {attempt}/{self.max_retries} in {wait:.1f}s")
+            time.sleep(wait)
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def session_options(config):
+    """ResilientSession keyword arguments for the servicenow.http section of config.
+
+    The token bucket and breaker are created once per instance URL and shared.
+    """
+    http = config["servicenow"].get("http", {})
+    key = config["servicenow"]["url"].format(instance=config["servicenow"]["instance"], table="")
+    with _shared_lock:
+        if key not in _shared:
+            rate = http.get("rate_limit_per_second", 0)
+            _shared[key] = (
+                TokenBucket(rate, http.get("burst")) if rate else None,
+                CircuitBreaker(http.get("breaker_failures", 10), http.get("breaker_reset_seconds", 60))
+            )
+        limiter, breaker = _shared[key]
+    return {
+        "limiter": limiter,
+        "breaker": breaker,
+        "connect_timeout": http.get("connect_timeout", 10),
+        "read_timeout": http.get("read_timeout", 120),
+        "max_retries": http.get("max_retries", 6),
+        "backoff_seconds": http.get("backoff_seconds", 1.0),
+        "max_backoff_seconds": http.get("max_backoff_seconds", 60.0),
+        "max_retry_after_seconds": http.get("max_retry_after_seconds", 300.0)
+    }
+
+def get_session(config):
+    """New ResilientSession sharing the instance's rate limiter and circuit breaker."""
+    return ResilientSession(**session_options(config))